@@ -0,0 +1,219 @@
+"""Records why each file is in the bundle and reports the sizes that
+each project entry and each library are responsible for.
+
+While the bundle is built, every copy is recorded with the entry of the
+project file that caused it, and every library link that dependency
+resolution follows is recorded too. Libraries that are only in the
+bundle because something links to them have no entry of their own; they
+are attributed to the entries whose binaries reach them.
+"""
+import json
+import os
+import threading
+
+GENERATED = "(generated)"
+DEPENDENCY = "(dependency)"
+
+class Provenance():
+    def __init__(self, bundle):
+        self.bundle = bundle
+        # Bundle relative path -> (source, entry).
+        self.files = {}
+        # Source binary -> sources of the libraries it links to.
+        self.links = {}
+        self.lock = threading.Lock()
+
+    def record_copy(self, entry, source, dest):
+        rel = os.path.relpath(dest, self.bundle)
+        with self.lock:
+            self.files[rel] = (os.path.normpath(source), entry)
+
+    def record_link(self, loader, library):
+        with self.lock:
+            self.links.setdefault(os.path.normpath(loader), set()).add(
+                os.path.normpath(library))
+
+    def graph(self):
+        """Returns the links between files in the bundle, by their
+        bundle relative paths.
+        """
+        by_source = {}
+        for rel, (source, dummy_entry) in sorted(self.files.items()):
+            by_source.setdefault(source, rel)
+        edges = {}
+        for loader, libraries in self.links.items():
+            if loader not in by_source:
+                continue
+            targets = edges.setdefault(by_source[loader], set())
+            targets.update(by_source[lib] for lib in libraries if lib in by_source)
+        return edges
+
+def closure(edges, start):
+    """Returns start and everything reachable from it."""
+    seen = set()
+    work = [start]
+    while work:
+        node = work.pop()
+        if node in seen:
+            continue
+        seen.add(node)
+        work.extend(edges.get(node, ()))
+    return seen
+
+def build_report(bundle, provenances):
+    """Builds the report of the finished bundle from the provenance
+    recorded while building it (one per architecture for universal
+    bundles).
+    """
+    sizes = {}
+    for root, dummy_dirs, names in os.walk(bundle):
+        for name in names:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                sizes[os.path.relpath(path, bundle)] = os.path.getsize(path)
+
+    origins = {}
+    edges = {}
+    for provenance in provenances:
+        for rel, origin in provenance.files.items():
+            origins.setdefault(rel, origin)
+        for loader, libraries in provenance.graph().items():
+            edges.setdefault(loader, set()).update(libraries)
+    edges = {loader: {lib for lib in libraries if lib in sizes}
+             for loader, libraries in edges.items() if loader in sizes}
+    linked_by = {}
+    for loader, libraries in edges.items():
+        for lib in libraries:
+            linked_by.setdefault(lib, set()).add(loader)
+
+    files = {}
+    entries = {}
+    for rel in sorted(sizes):
+        source, entry = origins.get(rel, (None, GENERATED))
+        if entry is None:
+            entry = DEPENDENCY
+        files[rel] = {"size": sizes[rel], "source": source, "entry": entry,
+                      "linked_by": sorted(linked_by.get(rel, ()))}
+        entries.setdefault(entry, []).append(rel)
+
+    libraries = {}
+    for rel in sorted(set(edges) | set(linked_by)):
+        reachable = closure(edges, rel)
+        libraries[rel] = {"size": sizes[rel],
+                          "closure_size": sum(sizes[r] for r in reachable),
+                          "links": sorted(edges.get(rel, ())),
+                          "linked_by": sorted(linked_by.get(rel, ()))}
+
+    entry_report = {}
+    for entry, rels in sorted(entries.items()):
+        reachable = set()
+        for rel in rels:
+            reachable |= closure(edges, rel)
+        entry_report[entry] = {"files": len(rels),
+                               "size": sum(sizes[r] for r in rels),
+                               "closure_size": sum(sizes[r] for r in reachable)}
+    # Libraries only pulled in by dependencies are attributed to the
+    # entries that reach them.
+    for entry, rels in entries.items():
+        if entry in (DEPENDENCY, GENERATED):
+            continue
+        for rel in set().union(*(closure(edges, r) for r in rels)):
+            if files[rel]["entry"] == DEPENDENCY:
+                files[rel].setdefault("pulled_in_by", []).append(entry)
+    for info in files.values():
+        if "pulled_in_by" in info:
+            info["pulled_in_by"].sort()
+
+    return {"bundle": bundle, "total_size": sum(sizes.values()),
+            "entries": entry_report, "libraries": libraries, "files": files}
+
+def write_json(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def dot_quote(name):
+    return '"' + name.replace('"', '\\"') + '"'
+
+def write_dot(report, path):
+    """Writes the dependency graph: the entries of the project file as
+    boxes pointing at the binaries they copied, and the libraries with
+    their own and transitive sizes.
+    """
+    files = report["files"]
+    libraries = report["libraries"]
+    lines = ["digraph bundle {", "  rankdir=LR;", "  node [shape=ellipse];"]
+    for rel, info in sorted(libraries.items()):
+        label = (f'{rel}\\n{info["size"]} bytes, '
+                 f'{info["closure_size"]} with dependencies')
+        lines.append(f'  {dot_quote(rel)} [label={dot_quote(label)}];')
+    for entry in sorted(report["entries"]):
+        if entry in (DEPENDENCY, GENERATED):
+            continue
+        roots = [rel for rel in libraries if files[rel]["entry"] == entry]
+        if not roots:
+            continue
+        lines.append(f'  {dot_quote(entry)} [shape=box];')
+        for rel in sorted(roots):
+            lines.append(f'  {dot_quote(entry)} -> {dot_quote(rel)};')
+    for rel, info in sorted(libraries.items()):
+        for lib in info["links"]:
+            lines.append(f'  {dot_quote(rel)} -> {dot_quote(lib)};')
+    lines.append("}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def diff_reports(old, new):
+    """Returns the size changes between two reports as a list of
+    (kind, name, old size, new size), biggest change first. Sizes of
+    entries and libraries include what they pull in; a size of None
+    means it isn't in that report.
+    """
+    changes = []
+    if old["total_size"] != new["total_size"]:
+        changes.append(("total", new["bundle"], old["total_size"],
+                        new["total_size"]))
+    for kind, key in (("entry", "entries"), ("library", "libraries")):
+        for name in sorted(set(old[key]) | set(new[key])):
+            old_size = old[key].get(name, {}).get("closure_size")
+            new_size = new[key].get(name, {}).get("closure_size")
+            if old_size != new_size:
+                changes.append((kind, name, old_size, new_size))
+    for name in sorted(set(old["files"]) | set(new["files"])):
+        old_size = old["files"].get(name, {}).get("size")
+        new_size = new["files"].get(name, {}).get("size")
+        if old_size != new_size:
+            changes.append(("file", name, old_size, new_size))
+    changes.sort(key=lambda c: -abs((c[3] or 0) - (c[2] or 0)))
+    return changes
+
+def print_report(report, limit=20):
+    print(f'Bundle size: {report["total_size"]} bytes in '
+          f'{len(report["files"])} files')
+    print("By entry (own size, with dependencies):")
+    entries = sorted(report["entries"].items(),
+                     key=lambda item: -item[1]["closure_size"])
+    for entry, info in entries[:limit]:
+        print(f'  {entry}: {info["size"]}, {info["closure_size"]} '
+              f'({info["files"]} files)')
+    print("Largest libraries (own size, with dependencies):")
+    libraries = sorted(report["libraries"].items(),
+                       key=lambda item: -item[1]["closure_size"])
+    for rel, info in libraries[:limit]:
+        print(f'  {rel}: {info["size"]}, {info["closure_size"]}')
+
+def print_diff(changes):
+    if not changes:
+        print("No size changes")
+        return
+    for kind, name, old_size, new_size in changes:
+        if old_size is None:
+            print(f'{kind} {name}: added, {new_size} bytes')
+        elif new_size is None:
+            print(f'{kind} {name}: removed, was {old_size} bytes')
+        else:
+            print(f'{kind} {name}: {old_size} -> {new_size} bytes '
+                  f'({new_size - old_size:+d})')
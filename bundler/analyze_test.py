@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import analyze
+from .macho_test import write_file
+
+class AnalyzeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bundle = os.path.join(self.tmpdir, "Foo.app")
+        self.prefix = os.path.join(self.tmpdir, "prefix")
+        self.provenance = analyze.Provenance(self.bundle)
+        self.files = {}
+        # app links to libfoo, which links to libbar; the module links
+        # to libbar too.
+        self.add("${prefix}/bin/foo", "bin/foo", "Contents/MacOS/Foo-bin", 100)
+        self.add(None, "lib/libfoo.dylib", "Contents/Resources/lib/libfoo.dylib", 20)
+        self.add(None, "lib/libbar.dylib", "Contents/Resources/lib/libbar.dylib", 3)
+        self.add("${prefix}/lib/mods", "lib/mods/mod.so",
+                 "Contents/Resources/lib/mods/mod.so", 4000)
+        self.add("${prefix}/share/foo", "share/foo/data.txt",
+                 "Contents/Resources/share/foo/data.txt", 500)
+        write_file(os.path.join(self.bundle, "Contents", "Info.plist"), b"p" * 7)
+        self.link("bin/foo", "lib/libfoo.dylib")
+        self.link("lib/libfoo.dylib", "lib/libbar.dylib")
+        self.link("lib/mods/mod.so", "lib/libbar.dylib")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def add(self, entry, source, dest, size):
+        source = os.path.join(self.prefix, source)
+        dest = os.path.join(self.bundle, dest)
+        write_file(dest, b"x" * size)
+        self.provenance.record_copy(entry, source, dest)
+
+    def link(self, loader, library):
+        self.provenance.record_link(os.path.join(self.prefix, loader),
+                                    os.path.join(self.prefix, library))
+
+    def test_a_report(self):
+        report = analyze.build_report(self.bundle, [self.provenance])
+        self.assertEqual(report["total_size"], 4630)
+        self.assertEqual(report["entries"]["${prefix}/bin/foo"],
+                         {"files": 1, "size": 100, "closure_size": 123})
+        self.assertEqual(report["entries"]["${prefix}/lib/mods"],
+                         {"files": 1, "size": 4000, "closure_size": 4003})
+        self.assertEqual(report["entries"][analyze.GENERATED]["size"], 7)
+        libbar = "Contents/Resources/lib/libbar.dylib"
+        self.assertEqual(report["libraries"]["Contents/Resources/lib/libfoo.dylib"],
+                         {"size": 20, "closure_size": 23, "links": [libbar],
+                          "linked_by": ["Contents/MacOS/Foo-bin"]})
+        self.assertEqual(report["files"][libbar]["entry"], analyze.DEPENDENCY)
+        self.assertEqual(report["files"][libbar]["pulled_in_by"],
+                         ["${prefix}/bin/foo", "${prefix}/lib/mods"])
+
+        dot = os.path.join(self.tmpdir, "graph.dot")
+        analyze.write_dot(report, dot)
+        with open(dot, encoding="utf-8") as f:
+            graph = f.read()
+        self.assertIn('"${prefix}/lib/mods" -> "Contents/Resources/lib/mods/mod.so";',
+                      graph)
+        self.assertIn('"Contents/Resources/lib/libfoo.dylib" -> '
+                      f'"{libbar}";', graph)
+
+    def test_b_diff(self):
+        old = analyze.build_report(self.bundle, [self.provenance])
+        path = os.path.join(self.tmpdir, "old.json")
+        analyze.write_json(old, path)
+        self.add(None, "lib/libbar.dylib", "Contents/Resources/lib/libbar.dylib", 1003)
+        os.unlink(os.path.join(self.bundle, "Contents", "Resources", "share",
+                               "foo", "data.txt"))
+        new = analyze.build_report(self.bundle, [self.provenance])
+        changes = analyze.diff_reports(analyze.read_json(path), new)
+        self.assertEqual(changes[0][3] - changes[0][2], 1000)
+        self.assertIn(("total", self.bundle, 4630, 5130), changes)
+        self.assertIn(("entry", "${prefix}/lib/mods", 4003, 5003), changes)
+        self.assertIn(("library", "Contents/MacOS/Foo-bin", 123, 1123), changes)
+        self.assertIn(("entry", "${prefix}/share/foo", 500, None), changes)
@@ -0,0 +1,224 @@
+"""Writes the finished bundle to a zip, tar.gz or tar.zst archive.
+
+Every member is compressed on its own on a worker pool while the
+members that are done are written out in a fixed order, so compressing
+runs in parallel and the archive only depends on the bundle's contents.
+For tar.gz and tar.zst each member becomes a separate gzip member or
+zstd frame; concatenated, they are a valid stream.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import os
+import stat
+import struct
+import tarfile
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import utils
+
+FORMATS = {".zip": "zip", ".tar.gz": "tar.gz", ".tgz": "tar.gz",
+           ".tar.zst": "tar.zst", ".tzst": "tar.zst"}
+
+def archive_format(path):
+    for suffix, fmt in FORMATS.items():
+        if path.endswith(suffix):
+            if fmt == "tar.zst" and zstandard is None:
+                raise ValueError("tar.zst archives need the zstandard module")
+            return fmt
+    raise ValueError(f'Unknown archive format for {path}, use one of '
+                     f'{", ".join(sorted(FORMATS))}')
+
+class Member():
+    def __init__(self, name, path, st, epoch=None):
+        self.name = name
+        self.path = path
+        self.stat = st
+        # Reproducible archives clamp the times to SOURCE_DATE_EPOCH.
+        self.mtime = int(st.st_mtime)
+        if epoch is not None:
+            self.mtime = min(self.mtime, epoch)
+        self.epoch = epoch
+
+    def is_dir(self):
+        return stat.S_ISDIR(self.stat.st_mode)
+
+    def is_link(self):
+        return stat.S_ISLNK(self.stat.st_mode)
+
+    def read(self):
+        if self.is_link():
+            return os.readlink(self.path).encode("utf-8")
+        if self.is_dir():
+            return b""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+def list_members(root, epoch=None):
+    """Returns the members for root and everything in it, named
+    relative to root's parent, in sorted order.
+    """
+    base = os.path.dirname(os.path.abspath(root))
+    members = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        members.append(Member(os.path.relpath(dirpath, base) + "/", dirpath,
+                              os.lstat(dirpath), epoch))
+        names = sorted(filenames + [d for d in dirnames
+                                    if os.path.islink(os.path.join(dirpath, d))])
+        for name in names:
+            path = os.path.join(dirpath, name)
+            members.append(Member(os.path.relpath(path, base), path, os.lstat(path),
+                                  epoch))
+        dirnames[:] = [d for d in dirnames if not os.path.islink(os.path.join(dirpath, d))]
+    return members
+
+def in_order(members, compress, jobs):
+    """Yields compress(member) for each member, in order, keeping a
+    bounded number of members in flight on the pool.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for member in members:
+            pending.append(pool.submit(compress, member))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def tar_member(member):
+    info = tarfile.TarInfo(member.name.rstrip("/"))
+    info.mode = stat.S_IMODE(member.stat.st_mode)
+    info.mtime = member.mtime
+    data = b""
+    if member.is_dir():
+        info.type = tarfile.DIRTYPE
+    elif member.is_link():
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.readlink(member.path)
+    else:
+        data = member.read()
+        info.size = len(data)
+    padding = -len(data) % tarfile.BLOCKSIZE
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape") + \
+        data + b"\0" * padding, len(data)
+
+def write_tar(members, fout, compress, jobs):
+    """Writes a tar stream with each member compressed separately by
+    compress. Returns the uncompressed size of the files.
+    """
+    def compress_member(member):
+        data, size = tar_member(member)
+        return compress(data), size
+    total = 0
+    for data, size in in_order(members, compress_member, jobs):
+        fout.write(data)
+        total += size
+    fout.write(compress(b"\0" * (2 * tarfile.BLOCKSIZE)))
+    return total
+
+def dos_time(mtime, utc=False):
+    # Zip times are local, except in reproducible archives.
+    t = (time.gmtime if utc else time.localtime)(max(mtime, 315532800))
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+ZIP64_LIMIT = 0xffffffff
+
+def zip_member(member):
+    data = member.read()
+    size = len(data)
+    crc = zlib.crc32(data)
+    method = 0
+    if data and not member.is_link():
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < size:
+            method, data = 8, compressed
+    return member, crc, method, size, data
+
+def write_zip(members, fout, jobs):
+    """Writes a zip archive, using zip64 extensions where sizes or
+    offsets need them. Returns the uncompressed size of the files.
+    """
+    central = []
+    total = 0
+    offset = 0
+    for member, crc, method, size, data in in_order(members, zip_member, jobs):
+        name = member.name.encode("utf-8")
+        mtime, mdate = dos_time(member.mtime, member.epoch is not None)
+        zip64 = size >= ZIP64_LIMIT or len(data) >= ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 1, 16, size, len(data)) if zip64 else b""
+        version = 45 if zip64 else 20
+        fout.write(struct.pack("<IHHHHHIIIHH", 0x04034b50, version, 0x800,
+                               method, mtime, mdate, crc,
+                               ZIP64_LIMIT if zip64 else len(data),
+                               ZIP64_LIMIT if zip64 else size,
+                               len(name), len(extra)) + name + extra)
+        fout.write(data)
+        central.append((name, version, method, mtime, mdate, crc, len(data),
+                        size, member.stat.st_mode, offset))
+        offset += 30 + len(name) + len(extra) + len(data)
+        total += size
+
+    cd_offset = offset
+    for (name, version, method, mtime, mdate, crc, csize, size, mode,
+         header_offset) in central:
+        values = [v for v in (size, csize, header_offset) if v >= ZIP64_LIMIT]
+        extra = b""
+        if values:
+            extra = struct.pack(f'<HH{len(values)}Q', 1, 8 * len(values), *values)
+            version = 45
+        external = (mode & 0xffff) << 16
+        if stat.S_ISDIR(mode):
+            external |= 0x10
+        fout.write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version,
+                               version, 0x800, method, mtime, mdate, crc,
+                               min(csize, ZIP64_LIMIT), min(size, ZIP64_LIMIT),
+                               len(name), len(extra), 0, 0, 0, external,
+                               min(header_offset, ZIP64_LIMIT)) + name + extra)
+        offset += 46 + len(name) + len(extra)
+
+    cd_size = offset - cd_offset
+    count = len(central)
+    if count >= 0xffff or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        fout.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0,
+                               count, count, cd_size, cd_offset))
+        fout.write(struct.pack("<IIQI", 0x07064b50, 0, offset, 1))
+    fout.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, min(count, 0xffff),
+                           min(count, 0xffff), min(cd_size, ZIP64_LIMIT),
+                           min(cd_offset, ZIP64_LIMIT), 0))
+    return total
+
+def write_archive(bundle, path, jobs=None, epoch=None):
+    """Writes bundle to the archive path, in the format its name
+    implies, with no time later than epoch if given. Returns the
+    uncompressed size of the files and the size of the archive.
+    """
+    fmt = archive_format(path)
+    jobs = jobs or utils.default_jobs()
+    members = list_members(bundle, epoch)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, "wb") as fout:
+            if fmt == "zip":
+                total = write_zip(members, fout, jobs)
+            elif fmt == "tar.gz":
+                total = write_tar(members, fout,
+                                  lambda data: gzip.compress(data, mtime=0), jobs)
+            else:
+                total = write_tar(members, fout,
+                                  lambda data: zstandard.ZstdCompressor().compress(data),
+                                  jobs)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return total, os.path.getsize(path)
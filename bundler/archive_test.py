@@ -0,0 +1,96 @@
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from . import archive, utils
+from .macho_test import write_file
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bundle = os.path.join(self.tmpdir, "Foo.app")
+        contents = os.path.join(self.bundle, "Contents")
+        write_file(os.path.join(contents, "MacOS", "Foo"), b"#!/bin/sh\n" * 100)
+        os.chmod(os.path.join(contents, "MacOS", "Foo"), 0o755)
+        write_file(os.path.join(contents, "Resources", "lib", "libfoo.1.dylib"),
+                   os.urandom(5000))
+        os.symlink("libfoo.1.dylib",
+                   os.path.join(contents, "Resources", "lib", "libfoo.dylib"))
+        write_file(os.path.join(contents, "Resources", "empty"), b"")
+        os.makedirs(os.path.join(contents, "Resources", "share", "empty-dir"))
+        self.files = {"Foo.app/Contents/MacOS/Foo": b"#!/bin/sh\n" * 100,
+                      "Foo.app/Contents/Resources/empty": b""}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected_names(self):
+        return [m.name for m in archive.list_members(self.bundle)]
+
+    def test_a_zip(self):
+        path = os.path.join(self.tmpdir, "Foo.zip")
+        total, size = archive.write_archive(self.bundle, path, jobs=3)
+        self.assertEqual(size, os.path.getsize(path))
+        with zipfile.ZipFile(path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), self.expected_names())
+            for name, data in self.files.items():
+                self.assertEqual(zf.read(name), data)
+            info = zf.getinfo("Foo.app/Contents/MacOS/Foo")
+            self.assertEqual(info.external_attr >> 16 & 0o777, 0o755)
+            self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+            link = zf.getinfo("Foo.app/Contents/Resources/lib/libfoo.dylib")
+            self.assertTrue(stat.S_ISLNK(link.external_attr >> 16))
+            self.assertEqual(zf.read(link), b"libfoo.1.dylib")
+            self.assertTrue(zf.getinfo("Foo.app/Contents/Resources/share/empty-dir/").is_dir())
+        with open(path, "rb") as f:
+            first = f.read()
+        archive.write_archive(self.bundle, path, jobs=1)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), first)
+
+    def test_b_tar_gz(self):
+        path = os.path.join(self.tmpdir, "Foo.tar.gz")
+        archive.write_archive(self.bundle, path, jobs=3)
+        with tarfile.open(path, "r:gz") as tf:
+            self.assertEqual([m.name + ("/" if m.isdir() else "") for m in tf],
+                             self.expected_names())
+            for name, data in self.files.items():
+                self.assertEqual(tf.extractfile(name).read(), data)
+            link = tf.getmember("Foo.app/Contents/Resources/lib/libfoo.dylib")
+            self.assertTrue(link.issym())
+            self.assertEqual(link.linkname, "libfoo.1.dylib")
+            self.assertEqual(tf.getmember("Foo.app/Contents/MacOS/Foo").mode, 0o755)
+
+    def test_c_unknown_format(self):
+        with self.assertRaises(ValueError):
+            archive.archive_format("Foo.rar")
+
+    def test_d_reproducible(self):
+        epoch = 1700000000
+        archives = []
+        for i in range(2):
+            for root, dummy_dirs, files in os.walk(self.bundle):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if not os.path.islink(path):
+                        executable = os.stat(path).st_mode & 0o100
+                        os.chmod(path, (0o700 if executable else 0o600) | (0o40 if i else 0))
+                        os.utime(path, (epoch + 1000 * i, epoch + 1000 * i))
+            utils.normalize_tree(self.bundle, epoch)
+            path = os.path.join(self.tmpdir, f'Foo{i}.zip')
+            archive.write_archive(self.bundle, path, epoch=epoch)
+            with open(path, "rb") as f:
+                archives.append(f.read())
+        self.assertEqual(archives[0], archives[1])
+        with zipfile.ZipFile(path) as zf:
+            info = zf.getinfo("Foo.app/Contents/Resources/empty")
+            self.assertEqual(info.date_time, (2023, 11, 14, 22, 13, 20))
+            self.assertEqual(info.external_attr >> 16 & 0o777, 0o644)
+            info = zf.getinfo("Foo.app/Contents/MacOS/Foo")
+            self.assertEqual(info.external_attr >> 16 & 0o777, 0o755)
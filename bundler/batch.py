@@ -0,0 +1,90 @@
+"""Builds several bundles in one process. The bundles share the
+pkg-config answers, one index of the prefixes and the dyld lookups, so
+projects built from the same prefixes only look things up once, and
+they are built concurrently up to a job limit.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+import traceback
+
+from .bundler import Bundler
+from .fsindex import FileSystemIndex
+from .project import Project
+from .universal import UniversalBundler
+from . import utils
+
+class BundleResult():
+    def __init__(self, project_path):
+        self.project_path = project_path
+        self.final_path = None
+        self.error = None
+        self.seconds = 0.0
+        # The provenance recorded for the bundle (one per architecture
+        # for universal bundles).
+        self.provenances = []
+
+class BatchBuilder():
+    def __init__(self):
+        self.fs_index = FileSystemIndex()
+        self.resolvers = {}
+
+    def make_bundler(self, project_path):
+        """Returns the bundler for project_path and the provenances it
+        records into.
+        """
+        project = Project(project_path, fs_index=self.fs_index)
+        if project.get_meta().arch_prefixes:
+            bundler = UniversalBundler(project_path, fs_index=self.fs_index,
+                                       resolvers=self.resolvers)
+            return bundler, bundler.provenances
+        return Bundler(project, self.resolvers), [project.provenance]
+
+    def build(self, result, bundler):
+        start = time.monotonic()
+        try:
+            result.final_path = bundler.run()
+        except SystemExit as e:
+            # The bundler exits on errors it has already reported.
+            result.error = f'exited with status {e.code}'
+        except Exception as e:
+            traceback.print_exc()
+            result.error = str(e) or type(e).__name__
+        result.seconds = time.monotonic() - start
+        return result
+
+    def build_all(self, project_paths, jobs=None):
+        """Builds the projects, at most jobs at a time, and returns a
+        BundleResult for each of them in the same order. The bundles'
+        stages all take turns on the process's job slots, so building
+        several at once doesn't add to the work running at once.
+        """
+        # The projects are loaded up front, which also adds all the
+        # prefixes to the index before anything uses it.
+        results, bundlers, destinations = [], [], {}
+        for project_path in project_paths:
+            result = BundleResult(project_path)
+            bundler, result.provenances = self.make_bundler(project_path)
+            project = bundler.project
+            dest = os.path.join(project.evaluate_path(project.get_meta().dest),
+                                project.get_bundle_name() + ".app")
+            if dest in destinations:
+                raise ValueError(f'{project_path} and {destinations[dest]} '
+                                 f'both build {dest}')
+            destinations[dest] = project_path
+            results.append(result)
+            bundlers.append(bundler)
+        with ThreadPoolExecutor(max_workers=jobs or utils.default_jobs()) as pool:
+            return list(pool.map(self.build, results, bundlers))
+
+def print_results(results):
+    for result in results:
+        if result.error:
+            print(f'{result.project_path}: failed after {result.seconds:.1f}s, '
+                  f'{result.error}')
+        else:
+            print(f'{result.project_path}: built {result.final_path} in '
+                  f'{result.seconds:.1f}s')
+    failed = sum(1 for result in results if result.error)
+    print(f'Built {len(results) - failed} of {len(results)} bundles'
+          + (f', {failed} failed' if failed else ''))
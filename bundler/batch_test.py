@@ -0,0 +1,85 @@
+import os
+import plistlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from . import macho
+from .batch import BatchBuilder, print_results
+from .bundler import Bundler
+from .bundler_test import BUNDLE
+from .macho_test import make_macho, write_file
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmpdir, "prefix")
+        write_file(os.path.join(self.prefix, "bin", "foo"),
+                   make_macho(macho.MH_EXECUTE, dylibs=["@rpath/libfoo.dylib"]))
+        write_file(os.path.join(self.prefix, "lib", "libfoo.dylib"),
+                   make_macho(dylib_id="@rpath/libfoo.dylib"))
+        write_file(os.path.join(self.prefix, "lib", "mods", "mod.so"),
+                   make_macho(macho.MH_BUNDLE, dylibs=["@rpath/libfoo.dylib"]))
+        write_file(os.path.join(self.prefix, "share", "icons", "hicolor", "index.theme"),
+                   b"[Icon Theme]\nName=Hicolor\nDirectories=\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_project(self, name, executable, dest, prefix=None):
+        project_dir = os.path.join(self.tmpdir, name)
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, "Info.plist"), "wb") as f:
+            plistlib.dump({"CFBundleExecutable": executable,
+                           "CFBundleIdentifier": "org.example." + name,
+                           "CFBundlePackageType": "APPL",
+                           "CFBundleSignature": "????"}, f)
+        path = os.path.join(project_dir, name + ".bundle")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(BUNDLE.format(prefix=prefix or self.prefix,
+                                  dest=os.path.join(self.tmpdir, dest)))
+        return path
+
+    def test_a_shared_caches(self):
+        builder = BatchBuilder()
+        first, dummy = builder.make_bundler(self.make_project("a", "Foo", "dest"))
+        second, dummy = builder.make_bundler(self.make_project("b", "Bar", "dest"))
+        self.assertIs(first.project.fs_index, second.project.fs_index)
+        self.assertIs(first.resolver, second.resolver)
+
+    def test_b_same_destination(self):
+        projects = [self.make_project("a", "Foo", "dest"),
+                    self.make_project("b", "Foo", "dest")]
+        with self.assertRaises(ValueError):
+            BatchBuilder().build_all(projects)
+
+    def test_c_build_all(self):
+        # The second project's prefix lacks the modules it lists.
+        broken = os.path.join(self.tmpdir, "broken")
+        write_file(os.path.join(broken, "bin", "foo"), make_macho(macho.MH_EXECUTE))
+        projects = [self.make_project("a", "Foo", "dest"),
+                    self.make_project("b", "Bar", "dest", broken)]
+        cache = os.path.join(self.tmpdir, "cache")
+        # The loaders catalog needs gdk-pixbuf's tools.
+        with mock.patch.dict(os.environ, GTK_MAC_BUNDLER_CACHE=cache), \
+             mock.patch.object(Bundler, "create_gdk_pixbuf_loaders_setup",
+                               return_value=None), \
+             mock.patch("builtins.print"), mock.patch("traceback.print_exc"):
+            results = BatchBuilder().build_all(projects, jobs=2)
+        self.assertEqual([result.project_path for result in results], projects)
+        built, failed = results
+        self.assertEqual(built.final_path, os.path.join(self.tmpdir, "dest", "Foo.app"))
+        self.assertIsNone(built.error)
+        self.assertTrue(os.path.exists(os.path.join(built.final_path, "Contents", "MacOS",
+                                                    "Foo")))
+        self.assertIsNone(failed.final_path)
+        self.assertIn("lib/mods", failed.error)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "dest", "Bar.app")))
+        for result in results:
+            self.assertGreater(result.seconds, 0)
+
+        with mock.patch("builtins.print") as print_mock:
+            print_results(results)
+        print_mock.assert_called_with("Built 1 of 2 bundles, 1 failed")
@@ -1,16 +1,35 @@
-import glob
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import hashlib
 import os
 import plistlib
-import re
 import shutil
 from subprocess import PIPE, Popen, run
 import sys
-
-from .project import Binary, Path, Project
-from . import utils
+import time
+
+from .project import Binary, GirFile, IconTheme, Path, Project
+from .stages import Stage
+from .trash import TRASH_DIR, Trash, replace
+from . import launcher, macho, python, stages, strip, utils, verify
+from . import store as binstore
+
+def sort_catalog(lines):
+    """Sorts the blocks of a module catalog, which are separated by
+    empty lines, so that it doesn't depend on the order the query tool
+    found the modules in.
+    """
+    blocks, block = [], []
+    for line in lines + [""]:
+        if line:
+            block.append(line)
+        elif block:
+            blocks.append(block)
+            block = []
+    return [line for block in sorted(blocks) for line in block + [""]]
 
 class Bundler():
-    def __init__(self, the_project):
+    def __init__(self, the_project, resolvers=None):
         self.project = the_project
 
         self.project_dir = the_project.get_project_dir()
@@ -23,35 +42,54 @@ class Bundler():
         # binaries that are used to find library dependencies.
         self.binaries_to_copy = []
         self.copied_binaries = []
-        #List of frameworks moved into the bundle which need to be set
-        #up for private use.
+        #List of frameworks moved into the bundle.
         self.frameworks = []
+        # The names of the icons in the icon themes.
+        self.icon_names = set()
+        # Module cache files generated in the bundle, by the
+        # environment variable that points the libraries at them.
+        self.module_files = {}
+
+        # Dependency resolution state: the files scanned so far, the
+        # libraries added to binaries_to_copy, and the cached dyld
+        # lookups.
+        self.scanned_binaries = set()
+        self.resolved_libraries = set()
+        # The libraries each scanned binary links to.
+        self.library_links = {}
+        # Bundles built together share the resolvers (by their
+        # fallback directories) and so their lookups.
+        fallback_dirs = tuple(os.path.join(prefix, "lib") for prefix
+                              in the_project.get_meta().prefixes.values())
+        if resolvers is None:
+            resolvers = {}
+        self.resolver = resolvers.setdefault(
+            fallback_dirs, macho.DyldResolver(fallback_dirs, the_project.fs_index.exists))
 
         # Create the bundle in a temporary location first and move it
         # to the final destination when done.
         self.meta = the_project.get_meta()
         self.bundle_path = os.path.join(self.meta.dest, "." + the_project.get_bundle_name() + ".app")
-
-    def recursive_rm(self, dirname):
+        # The time stamp of the files of a reproducible bundle, None
+        # if it isn't one.
+        self.epoch = the_project.get_source_date_epoch()
+        # Old bundles are moved out of the way and deleted in the
+        # background.
+        self.trash = Trash(os.path.join(the_project.evaluate_path(self.meta.dest),
+                                        TRASH_DIR))
+
+    def check_removable(self, dirname):
         # Extra safety ;)
-        if dirname in [ "/", os.getenv("HOME"), os.path.join(os.getenv("HOME"), "Desktop"), self.meta.dest ]:
+        home = os.path.expanduser("~")
+        dest = self.project.evaluate_path(self.meta.dest)
+        if os.path.normpath(dirname) in [os.path.normpath(p) for p in
+                                         ("/", home, os.path.join(home, "Desktop"), dest)]:
             print(f"Eek, trying to remove a bit much, eh? {dirname}")
             sys.exit(1)
 
-        if not os.path.exists(dirname):
-            return
-
-        files = os.listdir(dirname)
-        for file in files:
-            path = os.path.join (dirname, file)
-            if os.path.isdir(path):
-                self.recursive_rm(path)
-            else:
-                os.unlink(path)
-        if os.path.islink(dirname):
-            os.unlink(dirname)
-        else:
-            os.rmdir(dirname)
+    def remove_bundle(self, dirname):
+        self.check_removable(dirname)
+        self.trash.discard(dirname)
 
     def create_skeleton(self):
         utils.makedirs(self.project.get_bundle_path("Contents/Resources"))
@@ -82,45 +120,82 @@ class Bundler():
             os.remove(temppath)
             return catalog
 
+    def module_catalog_key(self, exe_name, modules_dir):
+        # The relocated catalog only depends on the modules it lists
+        # and on the tool that generated it.
+        digest = hashlib.sha256()
+        if self.epoch is not None:
+            digest.update(b'sorted\0')
+        exepath = self.project.evaluate_path(f'${{prefix}}/bin/{exe_name}')
+        stat = os.stat(exepath)
+        digest.update(f'{exe_name}\0{stat.st_size}\0{stat.st_mtime_ns}\0'.encode("utf-8"))
+        utils.hash_file(exepath, digest)
+        for root, dirs, files in os.walk(modules_dir):
+            dirs.sort()
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                stat = os.stat(path)
+                name = os.path.relpath(path, modules_dir)
+                digest.update(f'{name}\0{stat.st_size}\0{stat.st_mtime_ns}\0'.encode("utf-8"))
+                utils.hash_file(path, digest)
+        return digest.hexdigest()
+
+    def write_module_catalog(self, cachepath, env_var, env_val, exe_name,
+                             modules_dir):
+        key = self.module_catalog_key(exe_name, modules_dir)
+        cached = os.path.join(utils.get_cache_dir('catalogs'), key)
+        utils.makedirs(os.path.dirname(cachepath))
+        if os.path.exists(cached):
+            shutil.copyfile(cached, cachepath)
+            return
+
+        f = self.run_module_catalog(env_var, env_val, exe_name)
+        lines = []
+        prefix = "\"" + self.project.get_bundle_path("Contents/Resources")
+        for line in f:
+            line = line.decode('utf-8')
+            line = line.strip()
+            if line.startswith("#"):
+                continue
+
+            # Replace the hardcoded bundle path with @executable_path...
+            if line.startswith(prefix):
+                line = line[len(prefix):]
+                line = "\"@executable_path/../Resources" + line
+            lines.append(line)
+        if self.epoch is not None:
+            lines = sort_catalog(lines)
+        with open(cachepath, "w", encoding='utf-8') as fout:
+            for line in lines:
+                fout.write(line)
+                fout.write("\n")
+        utils.cache_store(cached, cachepath)
+
     def create_gtk_immodules_setup(self):
         path = self.project.get_bundle_path("Contents/Resources")
         env_var = "GTK_EXE_PREFIX"
         exe_name = 'gtk-query-immodules-' + self.project.get_gtk_version()
-        f = self.run_module_catalog(env_var, path, exe_name)
+        gtkdir = self.project.evaluate_path('${pkg:'+
+                                            self.meta.gtk +
+                                            ':gtk_binary_version}')
+        modules_dir = self.project.get_bundle_path("Contents/Resources/lib/",
+                                                   self.project.get_gtk_dir(),
+                                                   gtkdir, "immodules")
         if self.meta.gtk == 'gtk+-2.0':
-            path = self.project.get_bundle_path("Contents/Resources/etc/",
-                                                self.project.get_gtk_dir())
-            file = 'gtk.immodules'
+            cachepath = self.project.get_bundle_path("Contents/Resources/etc/",
+                                                     self.project.get_gtk_dir(),
+                                                     'gtk.immodules')
         else:
-            gtkdir = self.project.evaluate_path('${pkg:'+
-                                                self.meta.gtk +
-                                                ':gtk_binary_version}')
-            path = self.project.get_bundle_path("Contents/Resources/lib/",
-                                                self.project.get_gtk_dir(),
-                                                gtkdir)
-            file = 'immodules.cache'
-        utils.makedirs(path)
-        with open(os.path.join(path, file), "w", encoding='utf-8') as fout:
-
-            prefix = "\"" + self.project.get_bundle_path("Contents/Resources")
-
-            for line in f:
-                if sys.version_info[0] > 2:
-                    line = line.decode('utf-8')
-                    line = line.strip()
-                    if line.startswith("#"):
-                        continue
-
-                # Replace the hardcoded bundle path with @executable_path...
-                if line.startswith(prefix):
-                    line = line[len(prefix):]
-                    line = "\"@executable_path/../Resources" + line
-                fout.write(line)
-                fout.write("\n")
+            cachepath = self.project.get_bundle_path("Contents/Resources/lib/",
+                                                     self.project.get_gtk_dir(),
+                                                     gtkdir, 'immodules.cache')
+        self.write_module_catalog(cachepath, env_var, path, exe_name,
+                                  modules_dir)
+        return cachepath
 
     def create_gdk_pixbuf_loaders_setup(self):
-        if os.path.exists(os.path.join(self.project.get_prefix(), "lib",
-                                       "gdk-pixbuf-2.0")):
+        if self.project.fs_index.exists(os.path.join(self.project.get_prefix(), "lib",
+                                                     "gdk-pixbuf-2.0")):
 
             modulespath = self.project.get_bundle_path("Contents/Resources/lib/",
                                                      "gdk-pixbuf-2.0",
@@ -130,8 +205,8 @@ class Bundler():
                                                      "gdk-pixbuf-2.0",
                                                      "${pkg:gdk-pixbuf-2.0:gdk_pixbuf_binary_version}",
                                                      "loaders.cache")
-        elif os.path.exists(os.path.join(self.project.get_prefix(), "lib",
-                                       "gdk-pixbuf-3.0")):
+        elif self.project.fs_index.exists(os.path.join(self.project.get_prefix(), "lib",
+                                                       "gdk-pixbuf-3.0")):
             modulespath = self.project.get_bundle_path("Contents/Resources/lib/",
                                                      "gdk-pixbuf-3.0",
                                                      "${pkg:gdk-pixbuf-3.0:gdk_pixbuf_binary_version}",
@@ -152,31 +227,35 @@ class Bundler():
         modulespath = utils.evaluate_pkgconfig_variables (modulespath)
         cachepath = utils.evaluate_pkgconfig_variables (cachepath)
 
-        env_var = 'GDK_PIXBUF_MODULEDIR'
-        f = self.run_module_catalog(env_var, modulespath,
-                                    'gdk-pixbuf-query-loaders')
-
-        utils.makedirs(os.path.dirname(cachepath))
-        with open(cachepath, "w", encoding='utf-8') as fout:
-
-            prefix = "\"" + self.project.get_bundle_path("Contents/Resources")
-            for line in f:
-                if sys.version_info[0] > 2:
-                    line = line.decode('utf-8')
-                line = line.strip()
-                if line.startswith("#"):
-                    continue
-
-                # Replace the hardcoded bundle path with @executable_path...
-                if line.startswith(prefix):
-                    line = line[len(prefix):]
-                    line = "\"@executable_path/../Resources" + line
-                fout.write(line)
-                fout.write("\n")
+        self.write_module_catalog(cachepath, 'GDK_PIXBUF_MODULEDIR',
+                                  modulespath, 'gdk-pixbuf-query-loaders',
+                                  modulespath)
+        return cachepath
+
+    def create_module_catalogs(self):
+        # The two catalogs are independent of each other, so generate
+        # them concurrently.
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = {'GDK_PIXBUF_MODULE_FILE':
+                       pool.submit(self.create_gdk_pixbuf_loaders_setup)}
+            if self.meta.gtk != 'gtk4':
+                futures['GTK_IM_MODULE_FILE'] = pool.submit(self.create_gtk_immodules_setup)
+            for var, future in futures.items():
+                self.module_files[var] = future.result()
+
+    def select_loaders(self):
+        loaders = self.project.get_loaders()
+        if not loaders:
+            return
+        names = loaders.select(self.project)
+        print(f'Selected pixbuf loaders: {", ".join(sorted(names))}')
+        for path in loaders.unused_loaders(self.project, names):
+            self.project.exclude(path)
 
     def copy_binaries(self):
         #clean up duplicates
-        binaries = list(set(self.binaries_to_copy))
+        binaries = sorted(set(self.binaries_to_copy),
+                          key=lambda path: path.source if isinstance(path, Path) else str(path))
         for path in binaries:
             if not isinstance(path, Path):
                 print(f'Warning, {path} not a Path object, skipping.')
@@ -223,118 +302,206 @@ class Bundler():
                 continue
 
         paths = list(filter(filter_path, paths))
-        return list(set(paths))
+        return sorted(set(paths))
+
+    def expand_binary_path(self, path):
+        """Returns the files in the prefix that a <binary> entry covers."""
+        if not isinstance(path, Path):
+            return [path]
+        index = self.project.fs_index
+        source = path.compute_source_path(self.project)
+        binaries = []
+        if path.is_source_glob():
+            source_dir, pattern = os.path.split(source)
+            for root, dummy_dirs, dummy_files in index.walk(source_dir):
+                for item in index.glob(os.path.join(root, pattern)):
+                    if index.isfile(item):
+                        binaries.append(item)
+        elif index.isdir(source):
+            for root, dummy_dirs, files in index.walk(source):
+                for item in files:
+                    if item.endswith('.so') or item.endswith('.dylib'):
+                        binaries.append(os.path.join(root, item))
+        else:
+            binaries.append(source)
+        return binaries
 
     def resolve_library_dependencies(self):
-        # Get the libraries we link to, filter out anything that
-        # doesn't come from any of the prefixes we have declared. Then
-        # copy in the resulting list, and repeat until the list
-        # doesn't change. At that point, all dependencies are
-        # resolved.
-        n_iterations = 0
-        n_paths = 0
-        paths = self.binaries_to_copy
-
-        def relative_path_map(line):
-            if not os.path.isabs(line):
-                for prefix in list(prefixes.values()):
-                    if line.startswith('@'):
-                        line = re.sub(r'@[-_a-z]+/', '', line)
-                    path = os.path.join(prefix, "lib", line)
-                    if os.path.exists(path):
-                        return path
-                print(f'Cannot find a matching prefix for {line}')
-            return line
-
-        def prefix_filter(line):
-            if not "(compatibility" in line:
-                #print(f'Removed {line}')
-                return False
-
-            if line.startswith("/usr/X11"):
-                print("Warning, found X11 library dependency, you most likely don't want that:", line.strip().split()[0])
-
-            if os.path.isabs(line):
-                for prefix in list(prefixes.values()):
-                    if prefix in line:
-                        return True
-
-                if not line.startswith("/usr/lib") and not line.startswith("/System/Library"):
-                    print("Warning, library not available in any prefix:",
-                          line.strip().split()[0])
-                return False
+        # Follow the libraries that each binary links to the way dyld
+        # would find them, using the rpaths of the binary and of
+        # everything that loaded it, and add the ones that come from
+        # any of the prefixes we have declared. The added libraries
+        # are then scanned in turn until nothing new turns up.
+        prefixes = self.meta.prefixes
+        main_binary = self.project.evaluate_path(self.project.get_main_binary().source)
+
+        work = []
+        for path in self.binaries_to_copy:
+            for binary in self.expand_binary_path(path):
+                work.append((binary, None, ()))
+
+        while work:
+            binary, executable, inherited_rpaths = work.pop()
+            if binary in self.scanned_binaries or self.project.is_excluded(binary):
+                continue
+            self.scanned_binaries.add(binary)
+            slices = macho.read(binary)
+            if not slices:
+                continue
+            if executable is None:
+                if any(s.filetype == macho.MH_EXECUTE for s in slices):
+                    executable = binary
+                else:
+                    executable = main_binary
+
+            rpaths = [self.resolver.expand(rpath, binary, executable)
+                      for rpath in macho.rpaths(slices)]
+            rpaths.extend(r for r in inherited_rpaths if r not in rpaths)
+            rpaths = tuple(rpaths)
+
+            for name in macho.dylibs(slices):
+                if name.startswith("/usr/X11"):
+                    print("Warning, found X11 library dependency, you most likely don't want that:", name)
+                library = self.resolver.resolve(name, binary, executable, rpaths)
+                if library is None:
+                    print(f'Cannot find a matching prefix for {name} (from {binary})')
+                    continue
 
-            return True
+                for (key, value) in prefixes.items():
+                    if library.startswith(value + os.sep):
+                        break
+                else:
+                    if not library.startswith("/usr/lib") and not library.startswith("/System/Library"):
+                        print("Warning, library not available in any prefix:", library)
+                    continue
 
-        while n_paths != len(paths):
-            cmds = ['otool', '-L']
-            binaries= []
-            for path in paths:
-                if isinstance(path, Path):
-                    source = path.compute_source_path(self.project)
-                    if path.is_source_glob():
-                        source_dir, pattern = os.path.split(source)
-                        for root, dummy_dirs, dummy_files in os.walk(source_dir):
-                            for item in glob.glob(os.path.join(root, pattern)):
-                                if os.path.isfile(os.path.join(root, item)):
-                                    binaries.append(os.path.join(root, item))
-                    elif os.path.isdir(source):
-                        for root, dummy_dirs, dummy_files in os.walk(source):
-                            for item in glob.glob(os.path.join(root, '*.so')):
-                                binaries.append(os.path.join(root, item))
-                            for item in glob.glob(os.path.join(root, '*.dylib')):
-                                binaries.append(os.path.join(root, item))
-                    else:
-                        binaries.append(source)
+                if self.project.is_excluded(library):
+                    continue
+                self.project.provenance.record_link(binary, library)
+                self.library_links.setdefault(binary, set()).add(library)
+                if library not in self.resolved_libraries:
+                    self.resolved_libraries.add(library)
+                    # Replace the real path with the right prefix so
+                    # we can create a Path object.
+                    dependency = Binary("${prefix:" + key + "}" + library[len(value):])
+                    dependency.entry = None
+                    self.binaries_to_copy.append(dependency)
+                work.append((library, executable, rpaths))
+
+    def prune_libraries(self):
+        # Drop the dylibs that nothing in the bundle loads. The roots
+        # are the executables and the modules, which are loaded with
+        # dlopen, and the libraries that are loaded by name: those of
+        # the shared libraries named in the gir files and those
+        # matching a <keep> pattern.
+        if not self.meta.prune:
+            return
+        keep = set(self.meta.prune_keep)
+        for gir in self.project.get_gir():
+            keep |= gir.shared_libraries(self.project)
+        keep_paths = [self.project.evaluate_path(pattern) for pattern in keep
+                      if os.sep in pattern]
+        keep_names = [pattern for pattern in keep if os.sep not in pattern]
+
+        def is_kept(path):
+            name = os.path.basename(path)
+            return (any(fnmatch.fnmatch(name, pattern) for pattern in keep_names) or
+                    any(fnmatch.fnmatch(path, pattern) for pattern in keep_paths))
+
+        roots = {self.project.evaluate_path(self.project.get_main_binary().source)}
+        candidates = set(self.resolved_libraries)
+        for path in self.binaries_to_copy:
+            for binary in self.expand_binary_path(path):
+                slices = macho.read(binary)
+                if not slices:
+                    continue
+                if (slices[0].filetype in (macho.MH_EXECUTE, macho.MH_BUNDLE) or
+                        binary.endswith(".so")):
+                    roots.add(binary)
                 else:
-                    binaries.append(path)
-
-            if not binaries:
-                break
-            cmds.extend(binaries)
-            with Popen(cmds, stdout=PIPE, stderr=PIPE) as output:
-                results, errors = output.communicate()
-                if errors:
-                    if sys.version_info[0] > 2:
-                        print(f'otool errors:\n{errors.decode("utf-8")}')
-                    else:
-                        print(f'otool errors:\n{errors}')
-
-                if sys.version_info[0] > 2:
-                    results = results.decode("utf-8")
-                prefixes = self.meta.prefixes
-                lines = list(filter(prefix_filter,
-                                    [line.strip() for line in results.splitlines()]))
-                p = re.compile(r"(.*\.dylib\.?.*)\s\(compatibility.*$")
-                lines = utils.filterlines(p, lines)
-                lines = list(map(relative_path_map, lines))
-                new_libraries = []
-                for library in set(lines):
-                    # Replace the real path with the right prefix so we can
-                    # create a Path object.
-                    for (key, value) in list(prefixes.items()):
-                        if library.startswith(value):
-                            path = Binary("${prefix:" + key + "}" + library[len(value):])
-                            new_libraries.append(path)
-
-                n_paths = len(paths)
-                n_iterations += 1
-                if n_iterations > 10:
-                    print("Too many tries to resolve library dependencies")
-                    sys.exit(1)
-
-                self.binaries_to_copy.extend(new_libraries)
-                paths = new_libraries
+                    candidates.add(binary)
+        roots.update(path for path in candidates if is_kept(path))
+
+        reachable = set()
+        work = list(roots)
+        while work:
+            binary = work.pop()
+            if binary not in reachable:
+                reachable.add(binary)
+                work.extend(self.library_links.get(binary, ()))
+
+        pruned = sorted(candidates - reachable)
+        size = 0
+        for path in pruned:
+            print("Pruning unreachable library:", path)
+            self.project.exclude(path)
+            size += os.path.getsize(path)
+        print(f'Pruned {len(pruned)} of {len(candidates)} libraries, {size} bytes')
+
+    def map_frameworks(self):
+        # Work out where every framework binary ends up before
+        # copying anything, so that each binary that links to a
+        # framework can be rewritten with a single install_name_tool
+        # run when it is copied.
+        for framework in self.project.get_frameworks():
+            source = framework.compute_source_path(self.project)
+            name = os.path.basename(source)
+            for root, dummy_dirs, files in os.walk(source):
+                for file in files:
+                    path = os.path.join(root, file)
+                    if os.path.islink(path):
+                        continue
+                    slices = macho.read(path)
+                    if not slices or not slices[0].id:
+                        continue
+                    relative = os.path.join(name, os.path.relpath(path, source))
+                    self.project.framework_names[slices[0].id] = \
+                        "@executable_path/../Frameworks/" + relative
+
+    def thin_binaries(self):
+        # Drop the slices of fat binaries that aren't wanted, the way
+        # lipo -thin would.
+        archs = self.meta.architectures
+        if not archs:
+            return
+        files = verify.find_macho_files(self.project.get_bundle_path())
+        def thin(path):
+            try:
+                return macho.thin(path, archs)
+            except (OSError, macho.MachOError) as e:
+                print(f'Warning, failed to thin {path}: {e}')
+                return 0
+        removed = utils.job_slots().map(thin, files)
+        thinned = sum(1 for size in removed if size)
+        print(f'Thinned {thinned} of {len(files)} Mach-O files to '
+              f'{" ".join(archs)}, removed {sum(removed)} bytes')
+
+    def debug_symbols_path(self):
+        dest = self.project.evaluate_path(self.meta.dest)
+        return os.path.join(dest, self.project.get_bundle_name() + ".debug-symbols")
+
+    def strip_binaries(self):
+        if not self.meta.strip:
+            return
+        debug_dir = None
+        if self.meta.keep_symbols:
+            debug_dir = self.debug_symbols_path()
+            self.trash.discard(debug_dir)
+        signer = Binary(self.project.get_main_binary().source)
+        results = strip.strip_bundle(self.project.get_bundle_path(),
+                                     self.project.evaluate_path(self.meta.strip_tool),
+                                     debug_dir,
+                                     after=lambda path: signer.sign(self.project, path))
+        strip.print_report(results)
+
+    def enumerate_icon_themes(self):
+        self.icon_names = set()
+        for theme in self.project.get_icon_themes():
+            theme.copy_target(self.project)
+            self.icon_names |= theme.enumerate_icons(self.project)
 
     def copy_icon_themes(self):
-        all_icons = set()
-
         themes = self.project.get_icon_themes()
-
-        for theme in themes:
-            theme.copy_target(self.project)
-            all_icons |= theme.enumerate_icons(self.project)
-
         strings = set()
 
         # Get strings from binaries.
@@ -347,7 +514,7 @@ class Bundler():
 
         # FIXME: Also get strings from glade files.
 
-        used_icons = all_icons.intersection(strings)
+        used_icons = self.icon_names.intersection(strings)
         for theme in themes:
             theme.copy_icons(self.project, used_icons)
 
@@ -367,13 +534,13 @@ class Bundler():
         utils.makedirs(typelib_dest)
 
         for gir in self.project.get_gir():
-            self.binaries_to_copy.extend(gir.copy_girfile(self.project, gir_dest,
-                                                          typelib_dest, lib_path))
+            gir.copy_girfile(self.project, gir_dest, typelib_dest, lib_path)
 
     def run(self):
         # Remove the temp location forcefully.
+        self.trash.empty()
         path = self.project.evaluate_path(self.bundle_path)
-        self.recursive_rm(path)
+        self.remove_bundle(path)
 
         final_path = os.path.join(self.meta.dest, self.project.get_bundle_name() + ".app")
         final_path = self.project.evaluate_path(final_path)
@@ -382,13 +549,6 @@ class Bundler():
             print("Bundle already exists: " + final_path)
             sys.exit(1)
 
-        self.create_skeleton()
-        self.create_pkglist()
-        self.copy_plist()
-
-        # Note: could move this to xml file...
-        #Path("${prefix}/lib/charset.alias").copy_target(self.project)
-
         # Main binary
         main_binary_path = self.project.get_main_binary()
         source = self.project.evaluate_path(main_binary_path.source)
@@ -396,47 +556,259 @@ class Bundler():
             print("Cannot find main binary: " + source)
             sys.exit(1)
 
-        self.binaries_to_copy.append(main_binary_path)
-        self.binaries_to_copy.extend(self.project.get_binaries())
-        self.resolve_library_dependencies()
-        self.binaries_to_copy.remove(main_binary_path)
-
-        # Additional binaries (executables, libraries, modules)
-        self.resolve_library_dependencies()
-        self.copy_binaries()
-
-        # Gir and Typelibs
-        self.install_gir()
-
-        # Data
-        for path in self.project.get_data():
-            path.copy_target(self.project)
-
-        # Translations
-        self.copy_translations()
-
-        # Frameworks
-        frameworks = self.project.get_frameworks()
-        for path in frameworks:
-            dest = path.copy_target(self.project)
-            self.frameworks.append(dest)
-
-        self.copy_icon_themes()
+        # Note: could move this to xml file...
+        #Path("${prefix}/lib/charset.alias").copy_target(self.project)
 
+        start = time.monotonic()
+        timings = stages.run_stages(self.stages(main_binary_path))
+        stages.print_timings(timings, time.monotonic() - start)
+
+        store = binstore.default_store()
+        if store:
+            removed = store.evict()
+            print(f'Binary store: {store.hits} hits, {store.misses} misses'
+                  + (f', evicted {removed} bytes' if removed else ''))
+
+        # The old bundle stays complete until the new one is swapped in.
+        self.check_removable(final_path)
+        replace(self.project.get_bundle_path(), final_path, self.trash)
+        self.trash.wait()
+        return final_path
+
+    def stages(self, main_binary_path):
+        """Returns the stages that build the bundle. Everything that
+        copies files into the bundle waits for the exclusions (the
+        unused loaders and Python modules, and the pruned libraries)
+        and, if it relocates binaries, for the framework names; the
+        launcher comes after whatever it describes, and thinning,
+        stripping and normalizing come after everything else.
+        """
+        def skeleton():
+            self.create_skeleton()
+            self.create_pkglist()
+            self.copy_plist()
+
+        def loaders():
+            self.select_loaders()
+
+        def python_prune():
+            modules = self.project.get_python()
+            if modules and modules.entries:
+                python.prune_modules(self.project, modules)
+
+        def dependencies():
+            self.binaries_to_copy.append(main_binary_path)
+            self.binaries_to_copy.extend(self.project.get_binaries())
+            self.resolve_library_dependencies()
+            self.binaries_to_copy.remove(main_binary_path)
+
+            # Additional binaries (executables, libraries, modules)
+            self.resolve_library_dependencies()
+            self.prune_libraries()
+
+        def data():
+            for path in self.project.get_data():
+                path.copy_target(self.project)
+
+        def frameworks():
+            for path in self.project.get_frameworks():
+                self.frameworks.append(path.copy_target(self.project))
+
+        def pixbuf_loaders():
+            self.module_files['GDK_PIXBUF_MODULE_FILE'] = \
+                self.create_gdk_pixbuf_loaders_setup()
+
+        def immodules():
+            self.module_files['GTK_IM_MODULE_FILE'] = self.create_gtk_immodules_setup()
+
+        def launcher_script():
+            script = self.project.get_launcher_script()
+            if script:
+                script.copy_target(self.project)
+                launcher.write_launcher_env(self.project.get_bundle_path("Contents/Resources"),
+                                            self.project.get_name(),
+                                            self.module_files)
+
+        def python_modules():
+            modules = self.project.get_python()
+            if modules:
+                python.compile_bundle(self.project, modules, self.project.get_bundle_path(),
+                                      self.epoch)
+
+        def normalize():
+            if self.epoch is not None:
+                utils.normalize_tree(self.project.get_bundle_path(), self.epoch)
+
+        copying = ["skeleton", "exclusions"]
+        relocating = copying + ["framework-names"]
+        catalogs = ["pixbuf-loaders"]
+        result = [
+            Stage("skeleton", skeleton, outputs=["skeleton"]),
+            Stage("loaders", loaders, outputs=["loader-exclusions"]),
+            Stage("frameworks-map", self.map_frameworks, outputs=["framework-names"]),
+            Stage("python-prune", python_prune, outputs=["python-exclusions"]),
+            Stage("dependencies", dependencies, ["loader-exclusions", "python-exclusions"],
+                  ["exclusions"]),
+            Stage("binaries", self.copy_binaries, relocating, ["binaries"]),
+            Stage("gir", self.install_gir, ["skeleton"], ["typelibs"]),
+            # Data is copied after the binaries, and the main binary
+            # after the data, in the order they always were, so that
+            # overlapping entries give the same bundle every time.
+            Stage("data", data, copying + ["binaries"], ["data"]),
+            Stage("translations", self.copy_translations, copying, ["translations"]),
+            Stage("frameworks", frameworks, relocating, ["frameworks"]),
+            Stage("icon-names", self.enumerate_icon_themes, copying, ["icon-names"]),
+            Stage("icon-themes", self.copy_icon_themes, ["binaries", "icon-names"],
+                  ["icons"]),
+            Stage("pixbuf-loaders", pixbuf_loaders, relocating + ["binaries"],
+                  ["pixbuf-loaders"]),
+            # Packing the library decides from what is on disk which
+            # packages are pure Python, so the extensions must be there.
+            Stage("python", python_modules, ["binaries", "data"], ["python-modules"]),
+            Stage("main-binary", lambda: main_binary_path.copy_target(self.project),
+                  relocating + ["data"], ["main-binary"]),
+        ]
         if self.meta.gtk != 'gtk4':
-            self.create_gtk_immodules_setup()
-
-        self.create_gdk_pixbuf_loaders_setup()
-
-        main_binary_path.copy_target(self.project)
-
-        launcher_script = self.project.get_launcher_script()
-        if launcher_script:
-            launcher_script.copy_target(self.project)
-
-        if self.meta.overwrite:
-            self.recursive_rm(final_path)
-        shutil.move(self.project.get_bundle_path(), final_path)
+            catalogs.append("immodules")
+            result.append(Stage("immodules", immodules, relocating + ["binaries"],
+                                ["immodules"]))
+        contents = ["binaries", "typelibs", "data", "translations", "frameworks",
+                    "icons", "python-modules", "main-binary", "launcher"] + catalogs
+        result.extend([
+            # launcher-env.sh lists the bundled translations and
+            # depends on whether lib/charset.alias was copied.
+            Stage("launcher", launcher_script,
+                  ["skeleton", "binaries", "data", "translations"] + catalogs,
+                  ["launcher"]),
+            Stage("thin", self.thin_binaries, contents, ["thinned"]),
+            Stage("strip", self.strip_binaries, ["thinned"], ["stripped"]),
+            Stage("normalize", normalize, ["stripped"], ["normalized"]),
+        ])
+        return result
+
+    def updatable_entries(self):
+        """Returns the project entries that copy files from the
+        prefixes, which an update may need to copy again.
+        """
+        entries = [self.project.get_main_binary()]
+        entries.extend(self.project.get_binaries())
+        entries.extend(self.project.get_data())
+        entries.extend(self.project.get_translations())
+        entries.extend(self.project.get_frameworks())
+        entries.extend(self.project.get_icon_themes())
+        entries.extend(self.project.get_gir())
+        return entries
+
+    def finish_binaries(self, paths):
+        # What thin_binaries and strip_binaries do for the whole bundle.
+        signer = Binary(self.project.get_main_binary().source)
+        for path in paths:
+            if not macho.read(path):
+                continue
+            if self.meta.architectures:
+                try:
+                    macho.thin(path, self.meta.architectures)
+                except (OSError, macho.MachOError) as e:
+                    print(f'Warning, failed to thin {path}: {e}')
+            if self.meta.strip:
+                debug_path = None
+                if self.meta.keep_symbols:
+                    debug_path = os.path.join(self.debug_symbols_path(),
+                                              os.path.relpath(path, self.project.get_bundle_path()))
+                strip.strip_file(self.project.evaluate_path(self.meta.strip_tool),
+                                 path, debug_path)
+                signer.sign(self.project, path)
+
+    def update(self, changed, final_path):
+        """Brings the bundle that run() made at final_path up to date
+        after the files in changed were modified, added or removed in
+        the prefixes. Only the files copied from them, and the entries
+        that cover new files, are copied again, along with any library
+        they now link to. The bundle is moved back to the temporary
+        location while it is updated. Returns the number of files
+        updated.
+        """
+        project = self.project
+        bundle = project.get_bundle_path()
+        for path in changed:
+            project.fs_index.invalidate(path)
+        with self.resolver.lock:
+            self.resolver.cache.clear()
+
+        copied = {}
+        for rel, (source, entry) in project.provenance.files.items():
+            copied.setdefault(source, []).append((rel, entry))
+        all_entries = self.updatable_entries()
+        files, removed, entries = [], [], []
+        for path in sorted(changed):
+            if path in copied:
+                if os.path.isfile(path):
+                    files.append(path)
+                else:
+                    removed.extend(rel for rel, dummy_entry in copied[path])
+            elif os.path.isfile(path):
+                entries.extend(entry for entry in all_entries
+                               if entry not in entries and entry.covers(project, path))
+        if not (files or removed or entries):
+            return 0
+
+        os.rename(final_path, bundle)
+        try:
+            updated = []
+            for source in files:
+                for rel, entry in copied[source]:
+                    path = Binary(source) if macho.read(source) else Path(source)
+                    path.entry = entry
+                    path.copy_file(project, source, os.path.join(bundle, rel))
+                    updated.append(os.path.join(bundle, rel))
+            for rel in removed:
+                if os.path.lexists(os.path.join(bundle, rel)):
+                    os.unlink(os.path.join(bundle, rel))
+                del project.provenance.files[rel]
+
+            binaries = [source for source in files if macho.read(source)]
+            rerun = set()
+            for entry in entries:
+                if isinstance(entry, (IconTheme, GirFile)):
+                    rerun.add(type(entry))
+                    continue
+                entry.copy_target(project)
+                if isinstance(entry, Binary):
+                    updated.extend(entry.destinations)
+                    binaries.extend(self.expand_binary_path(entry))
+            if GirFile in rerun:
+                self.install_gir()
+            if IconTheme in rerun:
+                self.enumerate_icon_themes()
+                self.copy_icon_themes()
+
+            # Pick up libraries that the changed binaries now link to.
+            self.scanned_binaries.difference_update(binaries)
+            binaries_to_copy = self.binaries_to_copy
+            self.binaries_to_copy = list(binaries)
+            self.resolve_library_dependencies()
+            added = self.binaries_to_copy[len(binaries):]
+            self.binaries_to_copy = binaries_to_copy + added
+            for dependency in added:
+                dependency.copy_target(project)
+                updated.extend(dependency.destinations)
+
+            self.finish_binaries(updated)
+            modules = project.get_python()
+            if modules:
+                sources = [os.path.join(bundle, rel) for rel, (source, dummy_entry)
+                           in project.provenance.files.items() if source in changed]
+                python.compile_bundle(project, modules, bundle, self.epoch, sources)
+            if any(rel.endswith(".so") for rel in removed) or \
+               any(path.endswith(".so") for path in updated):
+                self.create_module_catalogs()
+            if self.epoch is not None:
+                utils.normalize_tree(bundle, self.epoch)
+        finally:
+            os.rename(bundle, final_path)
+        print(f'Updated {len(updated)} files and {len(entries)} entries, '
+              f'removed {len(removed)} files in {final_path}')
+        return len(updated) + len(removed)
 
 if __name__ == '__main__':
     if len(sys.argv) != 2:
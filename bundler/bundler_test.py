@@ -0,0 +1,214 @@
+import os
+import plistlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from . import iconcache, macho
+from .bundler import Bundler, sort_catalog
+from .macho_test import make_macho, write_file
+from .project import Framework, IconTheme, PixbufLoaders, Project
+from .stages import StageGraph
+
+BUNDLE = """<?xml version="1.0"?>
+<app-bundle>
+  <meta>
+    <prefix>{prefix}</prefix>
+    <destination>{dest}</destination>
+    <gtk>gtk4</gtk>
+    <prune><keep>libkept*</keep></prune>
+  </meta>
+  <plist>${{project}}/Info.plist</plist>
+  <main-binary>${{prefix}}/bin/foo</main-binary>
+  <binary>${{prefix}}/lib/mods</binary>
+  <binary>${{prefix}}/lib/lib*.dylib</binary>
+</app-bundle>
+"""
+
+INDEX_THEME = """[Icon Theme]
+Name=Hicolor
+Directories=16x16/apps,48x48/apps,256x256/apps,scalable/apps
+ScaledDirectories=16x16@2/apps
+
+[16x16/apps]
+Size=16
+Type=Threshold
+
+[16x16@2/apps]
+Size=16
+Scale=2
+Type=Threshold
+
+[48x48/apps]
+Size=48
+Type=Threshold
+
+[256x256/apps]
+Size=256
+Type=Threshold
+
+[scalable/apps]
+MinSize=1
+Size=128
+MaxSize=256
+Type=Scalable
+"""
+
+class BundlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmpdir, "prefix")
+        lib = os.path.join(self.prefix, "lib")
+        write_file(os.path.join(self.prefix, "bin", "foo"),
+                   make_macho(macho.MH_EXECUTE, dylibs=["@rpath/libfoo.dylib"],
+                              rpaths=["@executable_path/../lib"]))
+        write_file(os.path.join(lib, "libfoo.dylib"),
+                   make_macho(dylib_id="@rpath/libfoo.dylib",
+                              dylibs=["@rpath/libbar.dylib"]))
+        write_file(os.path.join(lib, "libbar.dylib"),
+                   make_macho(dylib_id="@rpath/libbar.dylib"))
+        write_file(os.path.join(lib, "mods", "mod.so"),
+                   make_macho(macho.MH_BUNDLE, dylibs=["@rpath/libmod.dylib"]))
+        write_file(os.path.join(lib, "libmod.dylib"),
+                   make_macho(dylib_id="@rpath/libmod.dylib"))
+        write_file(os.path.join(lib, "libunused.dylib"),
+                   make_macho(dylib_id="@rpath/libunused.dylib",
+                              dylibs=["@rpath/libunuseddep.dylib"]))
+        write_file(os.path.join(lib, "libunuseddep.dylib"),
+                   make_macho(dylib_id="@rpath/libunuseddep.dylib"))
+        write_file(os.path.join(lib, "libkept.dylib"),
+                   make_macho(dylib_id="@rpath/libkept.dylib"))
+
+        project_dir = os.path.join(self.tmpdir, "project")
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, "Info.plist"), "wb") as f:
+            plistlib.dump({"CFBundleExecutable": "Foo",
+                           "CFBundleIdentifier": "org.example.foo"}, f)
+        self.project_path = os.path.join(project_dir, "foo.bundle")
+        with open(self.project_path, "w", encoding="utf-8") as f:
+            f.write(BUNDLE.format(prefix=self.prefix,
+                                  dest=os.path.join(self.tmpdir, "dest")))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_a_prune_libraries(self):
+        project = Project(self.project_path)
+        bundler = Bundler(project)
+        bundler.binaries_to_copy.append(project.get_main_binary())
+        bundler.binaries_to_copy.extend(project.get_binaries())
+        bundler.resolve_library_dependencies()
+        bundler.prune_libraries()
+
+        lib = os.path.join(self.prefix, "lib")
+        pruned = sorted(os.path.basename(path) for path in project.excluded)
+        self.assertEqual(pruned, ["libunused.dylib", "libunuseddep.dylib"])
+        for name in ["libfoo.dylib", "libbar.dylib", "libmod.dylib", "libkept.dylib"]:
+            self.assertFalse(project.is_excluded(os.path.join(lib, name)))
+
+    def test_b_sort_catalog(self):
+        lines = ['"b.so"', '"b" 2 "gtk20" "B"', "", '"a.so"', '"a" 1 "gtk20" "A"', ""]
+        self.assertEqual(sort_catalog(lines),
+                         ['"a.so"', '"a" 1 "gtk20" "A"', "", '"b.so"', '"b" 2 "gtk20" "B"', ""])
+
+    def test_c_icon_subset(self):
+        theme_dir = os.path.join(self.prefix, "share", "icons", "hicolor")
+        write_file(os.path.join(theme_dir, "index.theme"), INDEX_THEME.encode())
+        for name in ("16x16/apps/foo.png", "16x16@2/apps/foo.png", "48x48/apps/foo.png",
+                     "48x48/apps/bar.png", "256x256/apps/foo.png", "scalable/apps/foo.svg"):
+            write_file(os.path.join(theme_dir, name), b"")
+        project = Project(self.project_path)
+        theme = IconTheme("hicolor", "all", "16, 48, scalable", "1")
+        theme.copy_target(project)
+        theme.copy_icons(project, set())
+
+        bundled = project.get_bundle_path("Contents", "Resources", "share", "icons", "hicolor")
+        files = sorted(os.path.relpath(os.path.join(root, f), bundled)
+                       for root, dummy_dirs, names in os.walk(bundled) for f in names)
+        # The 48 pixel PNG of foo gives way to its SVG.
+        self.assertEqual(files, ["16x16/apps/foo.png", "48x48/apps/bar.png",
+                                 "icon-theme.cache", "index.theme", "scalable/apps/foo.svg"])
+        with open(os.path.join(bundled, "index.theme"), encoding="utf-8") as f:
+            index = f.read()
+        self.assertIn("Directories=16x16/apps,48x48/apps,scalable/apps\n", index)
+        self.assertIn("ScaledDirectories=\n", index)
+        self.assertNotIn("[256x256/apps]", index)
+        self.assertNotIn("[16x16@2/apps]", index)
+        self.assertIn("[scalable/apps]\nMinSize=1", index)
+        directories, dummy_icons = iconcache.read_icon_cache(
+            os.path.join(bundled, "icon-theme.cache"))
+        self.assertEqual(directories, ["16x16/apps", "48x48/apps", "scalable/apps"])
+
+        with self.assertRaisesRegex(ValueError, "Invalid icon theme sizes"):
+            IconTheme("hicolor", "all", "16,huge")
+
+    def test_d_auto_loaders(self):
+        icons = os.path.join(self.prefix, "share", "icons")
+        write_file(os.path.join(icons, "hicolor", "index.theme"), INDEX_THEME.encode())
+        for name in ("hicolor/16x16/apps/foo.png", "hicolor/scalable/apps/foo.svg",
+                     "Legacy/16x16/apps/foo.xpm"):
+            write_file(os.path.join(icons, name), b"")
+        project = Project(self.project_path)
+        loaders = PixbufLoaders("auto")
+        themes = [IconTheme("hicolor", "auto"), IconTheme("Legacy", "none")]
+        with mock.patch.object(project, "get_icon_themes", return_value=themes):
+            # A theme that ships no icons needs no loaders.
+            self.assertEqual(loaders.select(project), {"png", "svg"})
+            # Nor do the directories that aren't shipped.
+            themes[0] = IconTheme("hicolor", "auto", "16")
+            self.assertEqual(loaders.select(project), {"png"})
+
+    def test_e_stage_order(self):
+        project = Project(self.project_path)
+        bundler = Bundler(project)
+        graph = StageGraph(bundler.stages(project.get_main_binary()))
+        # The launcher's environment describes the translations, data
+        # and module catalogs in the bundle.
+        for name in ("binaries", "data", "translations", "pixbuf-loaders"):
+            self.assertIn("launcher", graph.downstream(name), name)
+        # Overlapping entries are copied in a fixed order.
+        self.assertIn("data", graph.downstream("binaries"))
+        self.assertIn("main-binary", graph.downstream("data"))
+        # The Python library is compiled and packed once all of it,
+        # extension modules included, is in place.
+        for name in ("binaries", "data"):
+            self.assertIn("python", graph.downstream(name), name)
+
+    def test_f_svg_size_range(self):
+        # The SVG is only drawn up to 32 pixels, so the 48 and 256
+        # pixel PNGs stay.
+        theme_dir = os.path.join(self.prefix, "share", "icons", "hicolor")
+        write_file(os.path.join(theme_dir, "index.theme"),
+                   INDEX_THEME.replace("MaxSize=256", "MaxSize=32").encode())
+        for name in ("16x16/apps/foo.png", "48x48/apps/foo.png", "256x256/apps/foo.png",
+                     "scalable/apps/foo.svg"):
+            write_file(os.path.join(theme_dir, name), b"")
+        project = Project(self.project_path)
+        theme = IconTheme("hicolor", "all", "16,48,256,scalable")
+        def shipped():
+            return sorted(os.path.relpath(path, theme_dir)
+                          for dummy_directory, path, dummy_name in theme.icon_files(project))
+        self.assertEqual(shipped(), ["16x16/apps/foo.png", "256x256/apps/foo.png",
+                                     "48x48/apps/foo.png", "scalable/apps/foo.svg"])
+        write_file(os.path.join(theme_dir, "index.theme"),
+                   INDEX_THEME.replace("MaxSize=256", "MaxSize=64").encode())
+        self.assertEqual(shipped(), ["16x16/apps/foo.png", "256x256/apps/foo.png",
+                                     "scalable/apps/foo.svg"])
+
+    def test_g_framework_over_symlink(self):
+        source = os.path.join(self.prefix, "Frameworks", "Foo.framework")
+        write_file(os.path.join(source, "Resources", "Info.plist"), b"")
+        other = os.path.join(self.tmpdir, "Other.framework")
+        os.makedirs(other)
+        project = Project(self.project_path)
+        framework = Framework("${prefix}/Frameworks/Foo.framework", True)
+        dest = framework.compute_destination(project)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.symlink(other, dest)
+        framework.copy_target(project)
+        self.assertFalse(os.path.islink(dest))
+        self.assertTrue(os.path.exists(os.path.join(dest, "Resources", "Info.plist")))
+        # What the link pointed to is left alone.
+        self.assertEqual(os.listdir(other), [])
@@ -0,0 +1,143 @@
+import fnmatch
+import glob
+import os
+import re
+import threading
+
+class FileSystemIndex():
+    """In-memory index of the directories under the declared
+    prefixes. Each directory is read from disk with os.scandir the
+    first time it is needed and answered from memory afterwards. Paths
+    outside of the indexed roots go to the file system directly, since
+    those (the bundle, mostly) change during the build.
+    """
+
+    def __init__(self, roots=()):
+        self.roots = set()
+        self.listings = {}
+        self.lock = threading.Lock()
+        for root in roots:
+            self.add_root(root)
+
+    def add_root(self, root):
+        # Replaced rather than updated: the index can be shared by
+        # bundles that are being built while another one adds its
+        # prefixes.
+        self.roots = self.roots | {os.path.normpath(root)}
+
+    def covers(self, path):
+        path = os.path.normpath(path)
+        for root in self.roots:
+            if path == root or path.startswith(root + os.sep):
+                return True
+        return False
+
+    def invalidate(self, path):
+        """Forgets what is known about path, its parent and anything
+        below it, after they changed on disk.
+        """
+        path = os.path.normpath(path)
+        parent = os.path.dirname(path)
+        with self.lock:
+            for key in list(self.listings):
+                if key in (path, parent) or key.startswith(path + os.sep):
+                    del self.listings[key]
+
+    def scan(self, path):
+        """Returns (dirs, files, links, special) for path, where links
+        are the subdirectories that are symbolic links and special the
+        entries in files that aren't regular files.
+        """
+        path = os.path.normpath(path)
+        with self.lock:
+            listing = self.listings.get(path)
+        if listing is not None:
+            return listing
+
+        dirs, files, links, special = [], [], set(), set()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        dirs.append(entry.name)
+                        if entry.is_symlink():
+                            links.add(entry.name)
+                    else:
+                        files.append(entry.name)
+                        try:
+                            if not entry.is_file():
+                                special.add(entry.name)
+                        except OSError:
+                            special.add(entry.name)
+        except OSError:
+            pass
+        listing = (sorted(dirs), sorted(files), links, special)
+        with self.lock:
+            self.listings[path] = listing
+        return listing
+
+    def listdir(self, path):
+        if not self.covers(path):
+            try:
+                return sorted(os.listdir(path))
+            except OSError:
+                return []
+        dirs, files = self.scan(path)[:2]
+        return sorted(dirs + files)
+
+    def walk(self, top):
+        """Like os.walk(top) without following symbolic links."""
+        if not self.covers(top):
+            yield from os.walk(top)
+            return
+        if not self.isdir(top):
+            return
+        dirs, files, links = self.scan(top)[:3]
+        dirs = list(dirs)
+        yield top, dirs, list(files)
+        for name in dirs:
+            if name in links:
+                continue
+            yield from self.walk(os.path.join(top, name))
+
+    def glob(self, pattern):
+        """Like glob.glob(pattern) for patterns that only have
+        wildcards in the last component.
+        """
+        parent, tail = os.path.split(pattern)
+        if not parent or not self.covers(parent):
+            return glob.glob(pattern)
+        if not re.search("[*?[]", tail):
+            return [pattern] if self.exists(pattern) else []
+        names = self.listdir(parent)
+        if not tail.startswith("."):
+            names = [name for name in names if not name.startswith(".")]
+        return [os.path.join(parent, name)
+                for name in fnmatch.filter(names, tail)]
+
+    def exists(self, path):
+        path = os.path.normpath(path)
+        parent, name = os.path.split(path)
+        if not self.covers(parent) or not name:
+            return os.path.exists(path)
+        dirs, files = self.scan(parent)[:2]
+        return name in dirs or name in files
+
+    def isdir(self, path):
+        path = os.path.normpath(path)
+        parent, name = os.path.split(path)
+        if not self.covers(parent) or not name:
+            return os.path.isdir(path)
+        return name in self.scan(parent)[0]
+
+    def isfile(self, path):
+        path = os.path.normpath(path)
+        parent, name = os.path.split(path)
+        if not self.covers(parent) or not name:
+            return os.path.isfile(path)
+        dummy_dirs, files, dummy_links, special = self.scan(parent)
+        return name in files and name not in special
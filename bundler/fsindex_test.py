@@ -0,0 +1,65 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from .fsindex import FileSystemIndex
+
+class FileSystemIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        for path in ["lib/libfoo.1.dylib", "lib/libfoo.dylib", "lib/.hidden.so",
+                     "lib/gtk-3.0/3.0.0/immodules/im-quartz.so",
+                     "lib/gtk-3.0/3.0.0/printbackends/libprintbackend-file.so",
+                     "share/locale/de/LC_MESSAGES/foo.mo"]:
+            path = os.path.join(self.prefix, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w").close()
+        os.symlink(os.path.join(self.prefix, "lib", "gtk-3.0"),
+                   os.path.join(self.prefix, "lib", "gtk-link"))
+        self.index = FileSystemIndex([self.prefix])
+
+    def tearDown(self):
+        shutil.rmtree(self.prefix)
+
+    def test_a_walk(self):
+        expected = [(root, sorted(dirs), sorted(files))
+                    for root, dirs, files in os.walk(self.prefix)]
+        result = list(self.index.walk(self.prefix))
+        self.assertEqual(sorted(result), sorted(expected))
+
+    def test_b_glob(self):
+        for pattern in ["lib/libfoo*", "lib/*.so", "lib/.*.so", "lib/gtk-3.0",
+                        "lib/missing*", "share/locale/*"]:
+            pattern = os.path.join(self.prefix, pattern)
+            self.assertEqual(sorted(self.index.glob(pattern)),
+                             sorted(glob.glob(pattern)), pattern)
+
+    def test_c_stat(self):
+        lib = os.path.join(self.prefix, "lib")
+        self.assertTrue(self.index.isdir(lib))
+        self.assertTrue(self.index.isdir(os.path.join(lib, "gtk-link")))
+        self.assertTrue(self.index.isfile(os.path.join(lib, "libfoo.dylib")))
+        self.assertFalse(self.index.isfile(lib))
+        self.assertFalse(self.index.exists(os.path.join(lib, "libbar.dylib")))
+
+    def test_d_lists_each_directory_once(self):
+        for dummy in range(2):
+            list(self.index.walk(self.prefix))
+            self.index.glob(os.path.join(self.prefix, "lib", "*.dylib"))
+        # Every directory under the prefix, including the symlinked one
+        # that is listed but not descended into.
+        n_dirs = sum(1 for dummy in os.walk(self.prefix))
+        self.assertEqual(len(self.index.listings), n_dirs)
+
+    def test_e_invalidate(self):
+        lib = os.path.join(self.prefix, "lib")
+        new = os.path.join(lib, "libnew.dylib")
+        self.assertFalse(self.index.exists(new))
+        open(new, "w").close()
+        self.assertFalse(self.index.exists(new))
+        self.index.invalidate(new)
+        self.assertTrue(self.index.exists(new))
+        self.assertIn(new, self.index.glob(os.path.join(lib, "*.dylib")))
@@ -0,0 +1,203 @@
+"""Writes icon-theme.cache files, the index of an icon theme's
+directories that GTK maps into memory instead of reading every
+directory at startup, in the format gtk-update-icon-cache writes (in
+its default mode, without the image data).
+
+The file starts with a header (major and minor version, the offsets of
+the hash table and of the directory list), followed by a hash table of
+the icon names; each icon lists the directories that have an image of
+it and the file types found there. All numbers are big endian, and
+every item is aligned on 4 bytes.
+"""
+import os
+import struct
+
+CACHE_NAME = "icon-theme.cache"
+
+HAS_SUFFIX_XPM = 1 << 0
+HAS_SUFFIX_SVG = 1 << 1
+HAS_SUFFIX_PNG = 1 << 2
+HAS_ICON_FILE = 1 << 3
+SUFFIXES = ((".png", HAS_SUFFIX_PNG), (".svg", HAS_SUFFIX_SVG),
+            (".xpm", HAS_SUFFIX_XPM), (".icon", HAS_ICON_FILE))
+
+MAJOR_VERSION = 1
+MINOR_VERSION = 0
+HASH_OFFSET = 12
+NO_OFFSET = 0xffffffff
+
+# The bucket counts GLib's g_spaced_primes_closest() picks from.
+PRIMES = (11, 19, 37, 73, 109, 163, 251, 367, 557, 823, 1237, 1861, 2777, 4177,
+          6247, 9371, 14057, 21089, 31627, 47431, 71143, 106721, 160073, 240101,
+          360163, 540217, 810343, 1215497, 1823231, 2734867, 4102283, 6153409,
+          9230113, 13845163)
+
+def icon_name_hash(name):
+    """GTK's hash of icon names, over the name's bytes as signed chars."""
+    h = 0
+    for i, byte in enumerate(name):
+        c = byte - 256 if byte > 127 else byte
+        h = c if i == 0 else (h << 5) - h + c
+        h &= 0xffffffff
+    return h
+
+def bucket_count(n_icons):
+    return next((p for p in PRIMES if p > n_icons // 3), PRIMES[-1])
+
+def align(size):
+    return (size + 3) & ~3
+
+def padded(name):
+    return name + b"\0" * (align(len(name) + 1) - len(name))
+
+def scan_theme(theme_dir):
+    """Returns the directories of theme_dir that hold images, relative
+    to it, and the images of each icon, by name: (directory index,
+    flags) in the order gtk-update-icon-cache lists them, last
+    directory first. Names are bytes, as file names are.
+    """
+    directories = []
+    icons = {}
+    def scan(subdir):
+        path = os.path.join(theme_dir, subdir) if subdir else theme_dir
+        try:
+            names = sorted(os.listdir(os.fsencode(path)))
+        except OSError:
+            return
+        images = {}
+        index = None
+        for name in names:
+            full = os.path.join(os.fsencode(path), name)
+            if os.path.isdir(full):
+                scan(os.path.join(subdir, os.fsdecode(name)) if subdir else os.fsdecode(name))
+                continue
+            # Images in the theme's own directory don't count.
+            if not subdir or not os.path.isfile(full):
+                continue
+            flags = next((flag for suffix, flag in SUFFIXES
+                          if name.endswith(suffix.encode())), 0)
+            if not flags:
+                continue
+            if index is None:
+                index = len(directories)
+                directories.append(subdir)
+            base = name[:name.rindex(b".")]
+            images[base] = images.get(base, 0) | flags
+        for base, flags in images.items():
+            # A .icon file alone isn't an image.
+            if flags != HAS_ICON_FILE:
+                icons.setdefault(base, []).insert(0, (index, flags))
+    scan("")
+    return directories, icons
+
+def build_cache(directories, icons):
+    """Returns the contents of the cache for what scan_theme() found."""
+    size = bucket_count(len(icons))
+    buckets = [[] for dummy in range(size)]
+    for name in sorted(icons):
+        # Later icons go in front of the bucket's chain.
+        buckets[icon_name_hash(name) % size].insert(0, name)
+
+    data = bytearray(struct.pack(">HHII", MAJOR_VERSION, MINOR_VERSION, HASH_OFFSET, 0))
+    data += struct.pack(">I", size) + b"\0" * (4 * size)
+    strings = {}
+    for i, chain in enumerate(buckets):
+        if not chain:
+            struct.pack_into(">I", data, HASH_OFFSET + 4 + 4 * i, NO_OFFSET)
+            continue
+        struct.pack_into(">I", data, HASH_OFFSET + 4 + 4 * i, len(data))
+        for j, name in enumerate(chain):
+            offset = len(data)
+            images = icons[name]
+            node_size = 12 + align(len(name) + 1) + 4 + 8 * len(images)
+            next_offset = offset + node_size if j + 1 < len(chain) else NO_OFFSET
+            strings[name] = offset + 12
+            data += struct.pack(">III", next_offset, offset + 12,
+                                offset + 12 + align(len(name) + 1))
+            data += padded(name)
+            data += struct.pack(">I", len(images))
+            for index, flags in images:
+                data += struct.pack(">HHI", index, flags, 0)
+
+    # Directory names that are also icon names share their string.
+    dir_list = len(data)
+    struct.pack_into(">I", data, 8, dir_list)
+    data += struct.pack(">I", len(directories))
+    offset = dir_list + 4 + 4 * len(directories)
+    new_strings = []
+    for directory in directories:
+        name = os.fsencode(directory)
+        if name not in strings:
+            strings[name] = offset
+            new_strings.append(name)
+            offset += align(len(name) + 1)
+        data += struct.pack(">I", strings[name])
+    for name in new_strings:
+        data += padded(name)
+    return bytes(data)
+
+def write_icon_cache(theme_dir):
+    """Writes the cache of the icon theme in theme_dir, if it has an
+    index.theme. Returns the path of the cache, or None.
+    """
+    if not os.path.exists(os.path.join(theme_dir, "index.theme")):
+        return None
+    path = os.path.join(theme_dir, CACHE_NAME)
+    data = build_cache(*scan_theme(theme_dir))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    # GTK ignores a cache older than the theme directory, which writing
+    # the cache into it has just changed.
+    st = os.stat(theme_dir)
+    os.utime(theme_dir, ns=(st.st_atime_ns, os.stat(path).st_mtime_ns))
+    return path
+
+def read_icon_cache(path):
+    """Returns the directories listed in the cache at path and the
+    images of each icon, looked up the way GTK does. Raises ValueError
+    if the cache is malformed.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    def card32(offset):
+        if offset + 4 > len(data):
+            raise ValueError(f'Offset {offset} out of bounds in {path}')
+        return struct.unpack_from(">I", data, offset)[0]
+    def string(offset):
+        end = data.find(b"\0", offset)
+        if offset >= len(data) or end < 0:
+            raise ValueError(f'Bad string at {offset} in {path}')
+        return data[offset:end]
+    if len(data) < 12:
+        raise ValueError(f'{path} is too short')
+    major, minor, hash_offset, dir_list = struct.unpack_from(">HHII", data)
+    if (major, minor) != (MAJOR_VERSION, MINOR_VERSION):
+        raise ValueError(f'Unknown version {major}.{minor} in {path}')
+    directories = [os.fsdecode(string(card32(dir_list + 4 + 4 * i)))
+                   for i in range(card32(dir_list))]
+    icons = {}
+    size = card32(hash_offset)
+    for i in range(size):
+        node = card32(hash_offset + 4 + 4 * i)
+        seen = 0
+        while node != NO_OFFSET:
+            seen += 1
+            if seen > len(data) // 12:
+                raise ValueError(f'Loop in hash chain {i} of {path}')
+            name = string(card32(node + 4))
+            if icon_name_hash(name) % size != i:
+                raise ValueError(f'{name!r} is in the wrong bucket in {path}')
+            image_list = card32(node + 8)
+            images = []
+            for j in range(card32(image_list)):
+                if image_list + 12 + 8 * j > len(data):
+                    raise ValueError(f'Image list out of bounds in {path}')
+                index, flags = struct.unpack_from(">HH", data, image_list + 4 + 8 * j)
+                if index >= len(directories):
+                    raise ValueError(f'Bad directory index {index} in {path}')
+                images.append((index, flags))
+            icons[name] = images
+            node = card32(node)
+    return directories, icons
@@ -0,0 +1,76 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from . import iconcache
+from .iconcache import HAS_ICON_FILE, HAS_SUFFIX_PNG, HAS_SUFFIX_SVG, HAS_SUFFIX_XPM
+from .macho_test import write_file
+
+class IconCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.theme = os.path.join(self.tmpdir, "hicolor")
+        for name in ("index.theme", "loose.png", "16x16/apps/app.png", "16x16/apps/app.icon",
+                     "16x16/apps/both.png", "16x16/apps/both.svg", "16x16/apps/only.icon",
+                     "16x16/apps/README", "16x16/actions/go-next-symbolic.svg",
+                     "16x16/actions/old.xpm", "scalable/apps/app.svg",
+                     "scalable/apps/café.svg", "48x48/empty/notes.txt"):
+            write_file(os.path.join(self.theme, name), b"")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_a_hash(self):
+        self.assertEqual(iconcache.icon_name_hash(b"a"), 97)
+        self.assertEqual(iconcache.icon_name_hash(b"ab"), 97 * 31 + 98)
+        # Bytes above 127 are signed chars in GTK.
+        self.assertEqual(iconcache.icon_name_hash(b"\xe9"), 0xffffffe9)
+        self.assertEqual(iconcache.bucket_count(10), 11)
+        self.assertEqual(iconcache.bucket_count(33), 19)
+
+    def test_b_write(self):
+        path = iconcache.write_icon_cache(self.theme)
+        self.assertEqual(path, os.path.join(self.theme, "icon-theme.cache"))
+        self.assertFalse(os.path.exists(path + ".tmp"))
+        self.assertGreaterEqual(os.stat(path).st_mtime, os.stat(self.theme).st_mtime)
+        directories, icons = iconcache.read_icon_cache(path)
+        self.assertEqual(directories, ["16x16/actions", "16x16/apps", "scalable/apps"])
+        self.assertEqual(icons, {
+            b"go-next-symbolic": [(0, HAS_SUFFIX_SVG)],
+            b"old": [(0, HAS_SUFFIX_XPM)],
+            b"app": [(2, HAS_SUFFIX_SVG), (1, HAS_SUFFIX_PNG | HAS_ICON_FILE)],
+            b"both": [(1, HAS_SUFFIX_PNG | HAS_SUFFIX_SVG)],
+            "café".encode(): [(2, HAS_SUFFIX_SVG)],
+        })
+        with open(path, "rb") as f:
+            first = f.read()
+        iconcache.write_icon_cache(self.theme)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), first)
+
+    def test_c_no_index(self):
+        os.unlink(os.path.join(self.theme, "index.theme"))
+        self.assertIsNone(iconcache.write_icon_cache(self.theme))
+        self.assertFalse(os.path.exists(os.path.join(self.theme, "icon-theme.cache")))
+
+    def test_d_malformed(self):
+        path = iconcache.write_icon_cache(self.theme)
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 8)
+        with self.assertRaises(ValueError):
+            iconcache.read_icon_cache(path)
+
+    @unittest.skipUnless(shutil.which("gtk-update-icon-cache"),
+                         "gtk-update-icon-cache is not installed")
+    def test_e_reference(self):
+        path = iconcache.write_icon_cache(self.theme)
+        ours = iconcache.read_icon_cache(path)
+        os.unlink(path)
+        subprocess.check_call(["gtk-update-icon-cache", "-f", "-q", self.theme])
+        self.assertEqual(iconcache.read_icon_cache(path), ours)
+
+if __name__ == '__main__':
+    unittest.main()
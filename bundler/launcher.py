@@ -0,0 +1,49 @@
+import os
+
+# Name of the file, relative to Contents/Resources, that the launcher
+# scripts source instead of working the values out at every start.
+LAUNCHER_ENV = "launcher-env.sh"
+
+def available_languages(locale_dir, domain):
+    """Returns the sorted list of languages that have a translation
+    for domain in locale_dir.
+    """
+    languages = []
+    try:
+        entries = os.listdir(locale_dir)
+    except FileNotFoundError:
+        return languages
+    for lang in entries:
+        mo_file = os.path.join(locale_dir, lang, "LC_MESSAGES", domain + ".mo")
+        if os.path.isfile(mo_file):
+            languages.append(lang)
+    return sorted(languages)
+
+def shell_path(resources, path):
+    """Returns path as a string relative to the launcher's $bundle_res."""
+    return '"$bundle_res/' + os.path.relpath(path, resources) + '"'
+
+def write_launcher_env(resources, domain, module_files):
+    """Writes the launcher environment into the bundle's resources
+    directory. module_files maps environment variables to the module
+    cache files generated in the bundle; missing ones are left out.
+    """
+    lines = ["# Generated by gtk-mac-bundler, sourced by the launcher script."]
+    for var in sorted(module_files):
+        path = module_files[var]
+        if path and os.path.exists(path):
+            lines.append(f'export {var}={shell_path(resources, path)}')
+
+    lib = os.path.join(resources, "lib")
+    if os.path.exists(os.path.join(lib, "charset.alias")):
+        lines.append(f'export CHARSETALIASDIR={shell_path(resources, lib)}')
+
+    languages = available_languages(os.path.join(resources, "share", "locale"),
+                                     domain)
+    lines.append(f'APP_LANGUAGES="{" ".join(languages)}"')
+
+    path = os.path.join(resources, LAUNCHER_ENV)
+    with open(path, "w", encoding="utf-8") as fout:
+        fout.write("\n".join(lines))
+        fout.write("\n")
+    return path
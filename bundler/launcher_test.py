@@ -0,0 +1,128 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from . import launcher
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, "examples")
+# The example launchers as they were before launcher-env.sh, which
+# worked everything out each time the application started.
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, "test", "launchers")
+
+# Commands the example launchers may run; each gets a logging wrapper
+# so that the number of processes spawned per start can be counted.
+WRAPPED_COMMANDS = ["basename", "dirname", "uname", "cut", "sed", "find",
+                    "grep", "cat", "expr"]
+
+DEFAULTS_STUB = """#!/bin/sh
+echo defaults >> "$SPAWN_LOG"
+case "$3" in
+    AppleLanguages) printf '(\\n    "de-DE",\\n    "en-US"\\n)\\n';;
+    AppleLocale) echo de_DE;;
+    *) exit 1;;
+esac
+"""
+
+@unittest.skipUnless(shutil.which("bash"), "The launchers need bash")
+class LauncherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stubdir = os.path.join(self.tmpdir, "stubs")
+        os.makedirs(self.stubdir)
+        for cmd in WRAPPED_COMMANDS:
+            real = shutil.which(cmd)
+            if not real:
+                continue
+            self.write_script(os.path.join(self.stubdir, cmd),
+                              f'#!/bin/sh\necho {cmd} >> "$SPAWN_LOG"\nexec {real} "$@"\n')
+        self.write_script(os.path.join(self.stubdir, "defaults"), DEFAULTS_STUB)
+
+        self.bundle = os.path.join(self.tmpdir, "Foo.app")
+        self.resources = os.path.join(self.bundle, "Contents", "Resources")
+        for lang in ["de", "fr"]:
+            path = os.path.join(self.resources, "share", "locale", lang,
+                                "LC_MESSAGES")
+            os.makedirs(path)
+            open(os.path.join(path, "Foo.mo"), "w").close()
+        os.makedirs(os.path.join(self.resources, "share", "locale", "it"))
+        loaders = os.path.join(self.resources, "lib", "gdk-pixbuf-2.0",
+                               "2.10.0", "loaders.cache")
+        os.makedirs(os.path.dirname(loaders))
+        open(loaders, "w").close()
+        self.module_files = {"GDK_PIXBUF_MODULE_FILE": loaders,
+                             "GTK_IM_MODULE_FILE": None}
+
+        macos = os.path.join(self.bundle, "Contents", "MacOS")
+        os.makedirs(macos)
+        self.write_script(os.path.join(macos, "Foo-bin"),
+                          '#!/bin/sh\necho "LANG=$LANG"\n'
+                          'echo "LC_MESSAGES=$LC_MESSAGES"\n'
+                          'echo "GDK_PIXBUF_MODULE_FILE=$GDK_PIXBUF_MODULE_FILE"\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_script(self, path, contents):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(contents)
+        os.chmod(path, 0o755)
+
+    def run_launcher(self, name, directory=EXAMPLES_DIR):
+        exe = os.path.join(self.bundle, "Contents", "MacOS", "Foo")
+        shutil.copy(os.path.join(directory, name), exe)
+        log = os.path.join(self.tmpdir, "spawns")
+        if os.path.exists(log):
+            os.unlink(log)
+        env = {"PATH": self.stubdir, "SPAWN_LOG": log, "HOME": self.tmpdir}
+        output = subprocess.run([shutil.which("bash"), exe], env=env,
+                                cwd=self.tmpdir, check=True, text=True,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE).stdout
+        with open(log, encoding="utf-8") as f:
+            spawns = f.read().split()
+        values = dict(line.split("=", 1) for line in output.splitlines())
+        return values, spawns
+
+    def test_a_available_languages(self):
+        languages = launcher.available_languages(
+            os.path.join(self.resources, "share", "locale"), "Foo")
+        self.assertEqual(languages, ["de", "fr"])
+
+    def test_b_write_launcher_env(self):
+        path = launcher.write_launcher_env(self.resources, "Foo",
+                                           self.module_files)
+        with open(path, encoding="utf-8") as f:
+            contents = f.read()
+        self.assertIn('export GDK_PIXBUF_MODULE_FILE="$bundle_res/lib/'
+                      'gdk-pixbuf-2.0/2.10.0/loaders.cache"', contents)
+        self.assertNotIn("GTK_IM_MODULE_FILE", contents)
+        self.assertIn('APP_LANGUAGES="de fr"', contents)
+
+    def test_c_launcher_spawns(self):
+        env_file = os.path.join(self.resources, launcher.LAUNCHER_ENV)
+        for name in ["gtk3-launcher.sh", "gtk4-launcher.sh"]:
+            if os.path.exists(env_file):
+                os.unlink(env_file)
+            baseline_values, baseline_spawns = self.run_launcher(name, BASELINE_DIR)
+            # Without the file the launcher works it all out itself,
+            # to the same result.
+            fallback_values, dummy_spawns = self.run_launcher(name)
+            launcher.write_launcher_env(self.resources, "Foo",
+                                        self.module_files)
+            values, spawns = self.run_launcher(name)
+            self.assertEqual(values, baseline_values)
+            self.assertEqual(values, fallback_values)
+            self.assertEqual(values["LANG"], "de")
+            self.assertEqual(values["LC_MESSAGES"], "de_DE")
+            # Only the user's preferences are left to read at startup;
+            # the old launcher also ran the path and language helpers.
+            self.assertEqual(spawns, ["defaults"] * 3)
+            self.assertEqual(baseline_spawns.count("defaults"), 3)
+            self.assertLess(len(spawns), len(baseline_spawns))
+            for helper in ("basename", "dirname", "sed"):
+                self.assertIn(helper, baseline_spawns)
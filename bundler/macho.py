@@ -0,0 +1,374 @@
+"""Minimal reader for the Mach-O headers and load commands that the
+bundler cares about: linked libraries, install ids and rpaths. It only
+reads the header of each slice, so it is cheap enough to run on every
+file in a prefix and doesn't need otool, which means it also works on
+Linux.
+"""
+import contextlib
+import os
+import shutil
+import struct
+import threading
+
+MH_MAGIC = 0xfeedface
+MH_CIGAM = 0xcefaedfe
+MH_MAGIC_64 = 0xfeedfacf
+MH_CIGAM_64 = 0xcffaedfe
+FAT_MAGIC = 0xcafebabe
+FAT_MAGIC_64 = 0xcafebabf
+
+MH_EXECUTE = 0x2
+MH_DYLIB = 0x6
+MH_BUNDLE = 0x8
+
+LC_REQ_DYLD = 0x80000000
+LC_LOAD_DYLIB = 0xc
+LC_ID_DYLIB = 0xd
+LC_LOAD_WEAK_DYLIB = 0x18 | LC_REQ_DYLD
+LC_RPATH = 0x1c | LC_REQ_DYLD
+LC_REEXPORT_DYLIB = 0x1f | LC_REQ_DYLD
+LC_LAZY_LOAD_DYLIB = 0x20
+LC_LOAD_UPWARD_DYLIB = 0x23 | LC_REQ_DYLD
+
+LOAD_COMMANDS = (LC_LOAD_DYLIB, LC_LOAD_WEAK_DYLIB, LC_REEXPORT_DYLIB,
+                 LC_LAZY_LOAD_DYLIB, LC_LOAD_UPWARD_DYLIB)
+
+CPU_ARCH_ABI64 = 0x01000000
+CPU_TYPE_X86 = 7
+CPU_TYPE_ARM = 12
+CPU_TYPE_POWERPC = 18
+
+# Architecture names as lipo knows them, by (cputype, cpusubtype).
+ARCHITECTURES = {
+    (CPU_TYPE_X86, 3): "i386",
+    (CPU_TYPE_X86 | CPU_ARCH_ABI64, 3): "x86_64",
+    (CPU_TYPE_X86 | CPU_ARCH_ABI64, 8): "x86_64h",
+    (CPU_TYPE_ARM, 9): "armv7",
+    (CPU_TYPE_ARM | CPU_ARCH_ABI64, 0): "arm64",
+    (CPU_TYPE_ARM | CPU_ARCH_ABI64, 2): "arm64e",
+    (CPU_TYPE_POWERPC, 0): "ppc",
+    (CPU_TYPE_POWERPC | CPU_ARCH_ABI64, 0): "ppc64",
+}
+
+# Java class files share the fat magic; they are told apart by the
+# number of architectures, which is a class file version for them.
+MAX_FAT_ARCHS = 30
+
+class MachOError(Exception):
+    pass
+
+class MachO():
+    """The load commands of one architecture slice."""
+    def __init__(self, cputype, cpusubtype, filetype):
+        self.cputype = cputype
+        self.cpusubtype = cpusubtype
+        self.filetype = filetype
+        self.id = None
+        self.dylibs = []
+        self.rpaths = []
+
+def _read_lc_str(data, cmd_offset, cmdsize, str_offset):
+    start = cmd_offset + str_offset
+    end = data.find(b"\0", start, cmd_offset + cmdsize)
+    if end < 0:
+        end = cmd_offset + cmdsize
+    return data[start:end].decode("utf-8", "replace")
+
+def _parse_slice(f, offset):
+    f.seek(offset)
+    header = f.read(32)
+    if len(header) < 28:
+        raise MachOError("Truncated Mach-O header")
+    magic = struct.unpack("<I", header[:4])[0]
+    if magic in (MH_MAGIC, MH_MAGIC_64):
+        endian = "<"
+    elif magic in (MH_CIGAM, MH_CIGAM_64):
+        endian = ">"
+        magic = struct.unpack(">I", header[:4])[0]
+    else:
+        raise MachOError(f'Bad Mach-O magic {magic:#x}')
+    (cputype, cpusubtype, filetype, ncmds,
+     sizeofcmds) = struct.unpack(endian + "iiIII", header[4:24])
+    header_size = 32 if magic == MH_MAGIC_64 else 28
+
+    f.seek(offset + header_size)
+    data = f.read(sizeofcmds)
+    if len(data) < sizeofcmds:
+        raise MachOError("Truncated Mach-O load commands")
+
+    macho = MachO(cputype, cpusubtype & 0x00ffffff, filetype)
+    pos = 0
+    for dummy in range(ncmds):
+        if pos + 8 > len(data):
+            raise MachOError("Load command past the end of the header")
+        cmd, cmdsize = struct.unpack(endian + "II", data[pos:pos + 8])
+        if cmdsize < 8:
+            raise MachOError("Bad load command size")
+        if cmd in LOAD_COMMANDS or cmd == LC_ID_DYLIB or cmd == LC_RPATH:
+            str_offset = struct.unpack(endian + "I", data[pos + 8:pos + 12])[0]
+            name = _read_lc_str(data, pos, cmdsize, str_offset)
+            if cmd == LC_ID_DYLIB:
+                macho.id = name
+            elif cmd == LC_RPATH:
+                macho.rpaths.append(name)
+            else:
+                macho.dylibs.append(name)
+        pos += cmdsize
+    return macho
+
+def fat_archs(f):
+    """Returns the (cputype, cpusubtype, offset, size, align) of each
+    slice if f is a fat file, or None.
+    """
+    f.seek(0)
+    header = f.read(8)
+    if len(header) < 8:
+        return None
+    magic, nfat_arch = struct.unpack(">II", header)
+    if magic not in (FAT_MAGIC, FAT_MAGIC_64) or nfat_arch > MAX_FAT_ARCHS:
+        return None
+    archs = []
+    for dummy in range(nfat_arch):
+        if magic == FAT_MAGIC:
+            entry = struct.unpack(">iiIII", f.read(20))
+        else:
+            entry = struct.unpack(">iiQQII", f.read(32))[:5]
+        archs.append(entry)
+    return archs
+
+def arch_name(cputype, cpusubtype):
+    cpusubtype &= 0x00ffffff
+    return ARCHITECTURES.get((cputype, cpusubtype),
+                             f'cputype{cputype}:{cpusubtype}')
+
+def _copy_range(fin, fout, offset, size):
+    fin.seek(offset)
+    while size > 0:
+        data = fin.read(min(size, 1 << 20))
+        if not data:
+            raise MachOError("Truncated fat slice")
+        fout.write(data)
+        size -= len(data)
+
+def _write_fat(fout, magic, slices):
+    """Writes a fat file holding slices, a list of (file, cputype,
+    cpusubtype, offset, size, align) tuples, keeping each slice's
+    alignment.
+    """
+    entry_size = 20 if magic == FAT_MAGIC else 32
+    offset = 8 + entry_size * len(slices)
+    layout = []
+    for dummy_f, cputype, cpusubtype, dummy_offset, size, align in slices:
+        offset = (offset + (1 << align) - 1) & ~((1 << align) - 1)
+        layout.append((cputype, cpusubtype, offset, size, align))
+        offset += size
+    if magic == FAT_MAGIC and offset >= 1 << 32:
+        raise MachOError("Slices too large for a 32-bit fat header")
+
+    fout.write(struct.pack(">II", magic, len(layout)))
+    for entry in layout:
+        if magic == FAT_MAGIC:
+            fout.write(struct.pack(">iiIII", *entry))
+        else:
+            fout.write(struct.pack(">iiQQII", *entry, 0))
+    for slice_, entry in zip(slices, layout):
+        fout.write(b"\0" * (entry[2] - fout.tell()))
+        _copy_range(slice_[0], fout, slice_[3], slice_[4])
+
+def _replace(path, write, mode_from=None):
+    """Writes path through write(file) into a temporary file that then
+    replaces it.
+    """
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp, "wb") as fout:
+            write(fout)
+        if mode_from:
+            shutil.copymode(mode_from, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+def thin(path, keep):
+    """Removes the slices of the fat file path whose architecture is
+    not in keep, like lipo -thin (or -extract for several). The kept
+    slices are copied verbatim, so their code signatures stay valid.
+    Returns the number of bytes removed; files that aren't fat, or
+    that don't have any of the architectures, are left alone.
+    """
+    with open(path, "rb") as fin:
+        archs = fat_archs(fin)
+        if not archs:
+            return 0
+        fin.seek(0)
+        magic = struct.unpack(">I", fin.read(4))[0]
+        kept = [(fin,) + arch for arch in archs
+                if arch_name(arch[0], arch[1]) in keep]
+        if not kept or len(kept) == len(archs):
+            return 0
+        size = os.fstat(fin.fileno()).st_size
+        if len(kept) == 1:
+            _replace(path, lambda fout: _copy_range(fin, fout, kept[0][3],
+                                                    kept[0][4]), path)
+        else:
+            _replace(path, lambda fout: _write_fat(fout, magic, kept), path)
+    return size - os.path.getsize(path)
+
+def _thin_arch(f):
+    """Returns the (cputype, cpusubtype) of the thin Mach-O file f."""
+    f.seek(0)
+    header = f.read(12)
+    if len(header) < 12:
+        raise MachOError("Truncated Mach-O header")
+    magic = struct.unpack("<I", header[:4])[0]
+    if magic in (MH_MAGIC, MH_MAGIC_64):
+        return struct.unpack("<ii", header[4:12])
+    if magic in (MH_CIGAM, MH_CIGAM_64):
+        return struct.unpack(">ii", header[4:12])
+    raise MachOError("Not a Mach-O file")
+
+def create_fat(paths, output):
+    """Writes a fat file holding every slice of the Mach-O files in
+    paths to output, like lipo -create. Raises MachOError if two of
+    them have the same architecture.
+    """
+    with contextlib.ExitStack() as stack:
+        slices = []
+        for path in paths:
+            f = stack.enter_context(open(path, "rb"))
+            archs = fat_archs(f)
+            if archs is None:
+                cputype, cpusubtype = _thin_arch(f)
+                # lipo aligns thin files to the page size.
+                align = 14 if cputype == CPU_TYPE_ARM | CPU_ARCH_ABI64 else 12
+                archs = [(cputype, cpusubtype, 0, os.fstat(f.fileno()).st_size,
+                          align)]
+            slices.extend((f,) + tuple(arch) for arch in archs)
+
+        names = [arch_name(s[1], s[2]) for s in slices]
+        for name in names:
+            if names.count(name) > 1:
+                raise MachOError(f'{name} is in more than one of {", ".join(paths)}')
+        total = sum(s[4] + (1 << s[5]) for s in slices)
+        magic = FAT_MAGIC if total < 1 << 32 else FAT_MAGIC_64
+        _replace(output, lambda fout: _write_fat(fout, magic, slices))
+
+def parse(path):
+    """Returns the list of MachO slices in path, or None if it isn't
+    a Mach-O file.
+    """
+    try:
+        with open(path, "rb") as f:
+            archs = fat_archs(f)
+            if archs is not None:
+                return [_parse_slice(f, arch[2]) for arch in archs]
+            f.seek(0)
+            magic = f.read(4)
+            if len(magic) < 4 or struct.unpack("<I", magic)[0] not in (
+                    MH_MAGIC, MH_CIGAM, MH_MAGIC_64, MH_CIGAM_64):
+                return None
+            return [_parse_slice(f, 0)]
+    except (OSError, struct.error, MachOError):
+        return None
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def read(path):
+    """Cached parse(), keyed on the file's identity so that rewritten
+    files are read again.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.normpath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+    slices = parse(path)
+    with _cache_lock:
+        _cache[key] = slices
+    return slices
+
+def dylibs(slices):
+    """Returns the libraries linked by any of the slices, in order."""
+    names = []
+    for macho in slices:
+        for name in macho.dylibs:
+            if name not in names:
+                names.append(name)
+    return names
+
+def rpaths(slices):
+    names = []
+    for macho in slices:
+        for name in macho.rpaths:
+            if name not in names:
+                names.append(name)
+    return names
+
+class DyldResolver():
+    """Resolves install names the way dyld does, substituting
+    @executable_path, @loader_path and @rpath, and remembers every
+    lookup. fallback_dirs are searched by file name when the proper
+    search fails, like DYLD_FALLBACK_LIBRARY_PATH.
+    """
+
+    def __init__(self, fallback_dirs=(), exists=os.path.exists):
+        self.fallback_dirs = list(fallback_dirs)
+        self.exists = exists
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def expand(path, loader, executable):
+        if path.startswith("@loader_path/") or path == "@loader_path":
+            return os.path.normpath(os.path.join(os.path.dirname(loader),
+                                                 path[len("@loader_path/"):]))
+        if path.startswith("@executable_path/") or path == "@executable_path":
+            return os.path.normpath(os.path.join(os.path.dirname(executable),
+                                                 path[len("@executable_path/"):]))
+        return path
+
+    def search_paths(self, name, loader, executable, rpath_list):
+        """Returns the candidate locations for name, in search order."""
+        if name.startswith("@rpath/"):
+            tail = name[len("@rpath/"):]
+            return [os.path.join(self.expand(rpath, loader, executable), tail)
+                    for rpath in rpath_list]
+        return [self.expand(name, loader, executable)]
+
+    def resolve(self, name, loader, executable, rpath_list=()):
+        """Returns the file name refers to when loaded by loader, or
+        None. rpath_list holds the already expanded rpaths of loader
+        and of the binaries that loaded it.
+        """
+        candidates = self.search_paths(name, loader, executable, rpath_list)
+        key = (tuple(candidates), name)
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+
+        resolved = None
+        for candidate in candidates:
+            if os.path.isabs(candidate) and self.exists(candidate):
+                resolved = candidate
+                break
+        if resolved is None and not os.path.isabs(name):
+            basename = os.path.basename(name)
+            for directory in self.fallback_dirs:
+                candidate = os.path.join(directory, basename)
+                if self.exists(candidate):
+                    resolved = candidate
+                    break
+        elif resolved is None:
+            # Absolute names outside of the prefixes (system libraries)
+            # don't need to exist here.
+            resolved = name
+
+        with self.lock:
+            self.cache[key] = resolved
+        return resolved
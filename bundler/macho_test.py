@@ -0,0 +1,191 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from . import macho
+
+CPU_TYPE_X86_64 = 0x01000007
+CPU_TYPE_ARM64 = 0x0100000c
+
+def _lc_str_command(cmd, header_size, name):
+    name = name.encode("utf-8") + b"\0"
+    size = (header_size + len(name) + 7) & ~7
+    return cmd, size, name.ljust(size - header_size, b"\0")
+
+def make_macho(filetype=macho.MH_DYLIB, cputype=CPU_TYPE_ARM64, dylib_id=None,
+               dylibs=(), rpaths=(), payload=b"", cpusubtype=0):
+    """Returns the bytes of a little endian 64-bit Mach-O file with the
+    given load commands, followed by payload.
+    """
+    commands = []
+    if dylib_id:
+        cmd, size, name = _lc_str_command(macho.LC_ID_DYLIB, 24, dylib_id)
+        commands.append(struct.pack("<IIIIII", cmd, size, 24, 2, 0x10000, 0x10000) + name)
+    for dylib in dylibs:
+        cmd, size, name = _lc_str_command(macho.LC_LOAD_DYLIB, 24, dylib)
+        commands.append(struct.pack("<IIIIII", cmd, size, 24, 2, 0x10000, 0x10000) + name)
+    for rpath in rpaths:
+        cmd, size, name = _lc_str_command(macho.LC_RPATH, 12, rpath)
+        commands.append(struct.pack("<III", cmd, size, 12) + name)
+    data = b"".join(commands)
+    header = struct.pack("<IiiIIIII", macho.MH_MAGIC_64, cputype, cpusubtype,
+                         filetype, len(commands), len(data), 0, 0)
+    return header + data + payload
+
+def make_fat(slices, align=12):
+    """Returns the bytes of a fat file holding the Mach-O files in
+    slices, each aligned to 2**align bytes.
+    """
+    header = struct.pack(">II", macho.FAT_MAGIC, len(slices))
+    offset = len(header) + 20 * len(slices)
+    entries, body = [], b""
+    for data in slices:
+        cputype, cpusubtype = struct.unpack("<ii", data[4:12])
+        padding = -(offset + len(body)) % (1 << align)
+        body += b"\0" * padding
+        entries.append(struct.pack(">iiIII", cputype, cpusubtype,
+                                   offset + len(body), len(data), align))
+        body += data
+    return header + b"".join(entries) + body
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+class MachOTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.prefix)
+
+    def path(self, *args):
+        return os.path.join(self.prefix, *args)
+
+    def test_a_parse(self):
+        write_file(self.path("lib", "libfoo.dylib"),
+                   make_macho(dylib_id="@rpath/libfoo.dylib",
+                              dylibs=["/usr/lib/libSystem.B.dylib",
+                                      "@loader_path/libbar.dylib"],
+                              rpaths=["@loader_path/../lib"]))
+        slices = macho.parse(self.path("lib", "libfoo.dylib"))
+        self.assertEqual(len(slices), 1)
+        self.assertEqual(slices[0].filetype, macho.MH_DYLIB)
+        self.assertEqual(slices[0].id, "@rpath/libfoo.dylib")
+        self.assertEqual(macho.dylibs(slices), ["/usr/lib/libSystem.B.dylib",
+                                                "@loader_path/libbar.dylib"])
+        self.assertEqual(macho.rpaths(slices), ["@loader_path/../lib"])
+
+    def test_b_not_macho(self):
+        write_file(self.path("share", "data.txt"), b"just some text\n")
+        write_file(self.path("share", "Foo.class"),
+                   struct.pack(">II", macho.FAT_MAGIC, 52) + b"\0" * 64)
+        self.assertIsNone(macho.parse(self.path("share", "data.txt")))
+        self.assertIsNone(macho.parse(self.path("share", "Foo.class")))
+        self.assertIsNone(macho.read(self.path("share", "missing")))
+
+    def test_c_resolve(self):
+        executable = self.path("bin", "app")
+        libdir = self.path("lib")
+        write_file(self.path("lib", "libfoo.dylib"), b"")
+        write_file(self.path("lib", "private", "libbar.dylib"), b"")
+        write_file(self.path("other", "libbaz.dylib"), b"")
+        resolver = macho.DyldResolver([self.path("other")])
+        loader = self.path("lib", "libfoo.dylib")
+
+        self.assertEqual(resolver.resolve("@executable_path/../lib/libfoo.dylib",
+                                          loader, executable),
+                         self.path("lib", "libfoo.dylib"))
+        self.assertEqual(resolver.resolve("@loader_path/private/libbar.dylib",
+                                          loader, executable),
+                         self.path("lib", "private", "libbar.dylib"))
+        rpaths = [resolver.expand("@loader_path/private", loader, executable),
+                  libdir]
+        self.assertEqual(resolver.resolve("@rpath/libfoo.dylib", loader,
+                                          executable, rpaths),
+                         self.path("lib", "libfoo.dylib"))
+        self.assertEqual(resolver.resolve("@rpath/libbar.dylib", loader,
+                                          executable, rpaths),
+                         self.path("lib", "private", "libbar.dylib"))
+        # Not on any rpath, found through the fallback directories.
+        self.assertEqual(resolver.resolve("@rpath/libbaz.dylib", loader,
+                                          executable, rpaths),
+                         self.path("other", "libbaz.dylib"))
+        self.assertIsNone(resolver.resolve("@rpath/libnone.dylib", loader,
+                                           executable, rpaths))
+        self.assertEqual(resolver.resolve("/usr/lib/libSystem.B.dylib", loader,
+                                          executable),
+                         "/usr/lib/libSystem.B.dylib")
+
+    def test_d_resolve_cache(self):
+        lookups = []
+        def exists(path):
+            lookups.append(path)
+            return True
+        resolver = macho.DyldResolver([], exists)
+        for dummy in range(3):
+            resolver.resolve("@rpath/libfoo.dylib", "/pfx/lib/libbar.dylib",
+                             "/pfx/bin/app", ["/pfx/lib"])
+        self.assertEqual(lookups, ["/pfx/lib/libfoo.dylib"])
+
+    def test_e_thin(self):
+        arm64 = make_macho(cputype=CPU_TYPE_ARM64, dylib_id="@rpath/libfoo.dylib",
+                           payload=b"arm64" * 1000)
+        x86_64 = make_macho(cputype=CPU_TYPE_X86_64, cpusubtype=3,
+                            dylib_id="@rpath/libfoo.dylib", payload=b"x86_64" * 1000)
+        fat = make_fat([x86_64, arm64])
+        path = self.path("lib", "libfoo.dylib")
+        write_file(path, fat)
+        os.chmod(path, 0o555)
+
+        self.assertEqual(macho.thin(path, ["arm64", "x86_64"]), 0)
+        self.assertEqual(macho.thin(path, ["ppc"]), 0)
+        self.assertEqual(macho.thin(path, ["arm64"]), len(fat) - len(arm64))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), arm64)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o555)
+        # Thin files are left alone.
+        self.assertEqual(macho.thin(path, ["x86_64"]), 0)
+
+    def test_f_thin_to_fat(self):
+        archs = [(macho.CPU_TYPE_X86, 3), (CPU_TYPE_X86_64, 3), (CPU_TYPE_ARM64, 0)]
+        slices = [make_macho(cputype=cputype, cpusubtype=cpusubtype,
+                             payload=bytes([n]) * 100)
+                  for n, (cputype, cpusubtype) in enumerate(archs)]
+        path = self.path("bin", "app")
+        write_file(path, make_fat(slices))
+        macho.thin(path, ["x86_64", "arm64"])
+        with open(path, "rb") as f:
+            archs = macho.fat_archs(f)
+            self.assertEqual([macho.arch_name(a[0], a[1]) for a in archs],
+                             ["x86_64", "arm64"])
+            for arch, data in zip(archs, slices[1:]):
+                self.assertEqual(arch[2] % (1 << arch[4]), 0)
+                f.seek(arch[2])
+                self.assertEqual(f.read(arch[3]), data)
+
+    def test_g_create_fat(self):
+        arm64 = make_macho(cputype=CPU_TYPE_ARM64, payload=b"a" * 100)
+        x86_64 = make_macho(cputype=CPU_TYPE_X86_64, cpusubtype=3,
+                            payload=b"x" * 100)
+        write_file(self.path("arm64", "app"), arm64)
+        write_file(self.path("x86_64", "app"), x86_64)
+        output = self.path("app")
+        macho.create_fat([self.path("x86_64", "app"), self.path("arm64", "app")],
+                         output)
+        self.assertEqual([macho.arch_name(s.cputype, s.cpusubtype)
+                          for s in macho.parse(output)], ["x86_64", "arm64"])
+        with open(output, "rb") as f:
+            archs = macho.fat_archs(f)
+            self.assertEqual([(a[2], a[4]) for a in archs],
+                             [(1 << 12, 12), (1 << 14, 14)])
+        # Thinning gives the inputs back.
+        macho.thin(output, ["arm64"])
+        with open(output, "rb") as f:
+            self.assertEqual(f.read(), arm64)
+        with self.assertRaises(macho.MachOError):
+            macho.create_fat([self.path("arm64", "app"), output], self.path("dup"))
@@ -1,21 +1,143 @@
+import argparse
 import os
 import sys
 
-from .project import Project
-from .bundler import Bundler
+from .batch import BatchBuilder
+from . import analyze, archive, batch, verify, watch
 
-def main(argv):
-    if len(argv) != 1:
-        print(f'Usage: {sys.argv[0]} <bundle description file>')
-        sys.exit(2)
+def verify_main(argv):
+    parser = argparse.ArgumentParser(prog=f'{os.path.basename(sys.argv[0])} verify',
+                                     description='Check that the Mach-O files in '
+                                     'an application bundle only load libraries '
+                                     'from the bundle or the system.')
+    parser.add_argument('bundle', help='the .app bundle to check')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the report to FILE as JSON')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of files to check in parallel')
+    args = parser.parse_args(argv)
 
-    if not os.path.exists(argv[0]):
-        print(f'File {argv[0]} does not exist')
+    if not os.path.isdir(args.bundle):
+        print(f'Bundle {args.bundle} does not exist')
         sys.exit(2)
+    if not verify.verify_bundle(args.bundle, args.json, args.jobs):
+        sys.exit(1)
+
+def diff_main(argv):
+    parser = argparse.ArgumentParser(prog=f'{os.path.basename(sys.argv[0])} diff',
+                                     description='Show the size changes between '
+                                     'two bundle reports.')
+    parser.add_argument('old', help='the earlier report')
+    parser.add_argument('new', help='the later report')
+    args = parser.parse_args(argv)
+    analyze.print_diff(analyze.diff_reports(analyze.read_json(args.old),
+                                            analyze.read_json(args.new)))
+
+SUBCOMMANDS = {'verify': verify_main, 'diff': diff_main}
+
+def main(argv):
+    # A bundle description file by the name of a subcommand is built.
+    if argv and argv[0] in SUBCOMMANDS and not os.path.exists(argv[0]):
+        SUBCOMMANDS[argv[0]](argv[1:])
+        return
 
-    project = Project(argv[0])
-    bundler = Bundler(project)
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     usage='%(prog)s [--verify] [--archive FILE] [--report FILE] '
+                                     '[--dot FILE] [--compare FILE] <bundle description file>\n'
+                                     '       %(prog)s [--verify] [-j N] <bundle description file>...\n'
+                                     '       %(prog)s --watch [--poll] [--verify] <bundle description file>\n'
+                                     '       %(prog)s verify [--json FILE] <app bundle>\n'
+                                     '       %(prog)s diff <old report> <new report>\n'
+                                     '(a bundle description file named verify or diff in the '
+                                     'current directory is built, not taken as a subcommand)')
+    parser.add_argument('projects', nargs='+', help=argparse.SUPPRESS)
+    parser.add_argument('--verify', action='store_true',
+                        help='check the finished bundle for unresolved or '
+                        'leaked library references')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of bundles to build at the same time')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep the bundle up to date with the prefixes '
+                        'and the project files until interrupted')
+    parser.add_argument('--poll', action='store_true',
+                        help='with --watch, poll for changes instead of '
+                        'using inotify')
+    parser.add_argument('--archive', metavar='FILE',
+                        help='also pack the bundle into FILE, a .zip, .tar.gz '
+                        'or .tar.zst archive')
+    parser.add_argument('--report', metavar='FILE',
+                        help='write why each file is in the bundle and the '
+                        'sizes per entry and library to FILE as JSON')
+    parser.add_argument('--dot', metavar='FILE',
+                        help='write the dependency graph to FILE in DOT format')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='show the size changes since the report in FILE')
+    args = parser.parse_args(argv)
+
+    for project_path in args.projects:
+        if not os.path.exists(project_path):
+            print(f'File {project_path} does not exist')
+            sys.exit(2)
+    if args.watch:
+        if len(args.projects) > 1 or args.archive or args.report or args.dot or args.compare:
+            parser.error('--watch takes a single bundle description file and '
+                         'only --poll and --verify')
+        watch_main(args.projects[0], args.poll, args.verify)
+        return
+    if len(args.projects) > 1:
+        if args.archive or args.report or args.dot or args.compare:
+            parser.error('--archive, --report, --dot and --compare take a '
+                         'single bundle description file')
+        build_many(args.projects, args.jobs, args.verify)
+        return
+    if args.archive:
+        try:
+            archive.archive_format(args.archive)
+        except ValueError as err:
+            print(err)
+            sys.exit(2)
+
+    bundler, provenances = BatchBuilder().make_bundler(args.projects[0])
     #try:
-    bundler.run()
+    final_path = bundler.run()
     #except Exception as err:
      #   print(f'Bundler encountered an error {str(err)}')
+    if args.report or args.dot or args.compare:
+        report = analyze.build_report(final_path, provenances)
+        analyze.print_report(report)
+        # Read before writing, the new report may replace the old one.
+        if args.compare:
+            analyze.print_diff(analyze.diff_reports(analyze.read_json(args.compare),
+                                                    report))
+        if args.report:
+            analyze.write_json(report, args.report)
+        if args.dot:
+            analyze.write_dot(report, args.dot)
+    if args.archive:
+        total, size = archive.write_archive(final_path, args.archive,
+                                            epoch=bundler.project.get_source_date_epoch())
+        print(f'Wrote {args.archive}: {total} bytes packed into {size}')
+    if args.verify and not verify.verify_bundle(final_path):
+        sys.exit(1)
+
+def build_many(project_paths, jobs, check):
+    try:
+        results = BatchBuilder().build_all(project_paths, jobs)
+    except ValueError as err:
+        print(err)
+        sys.exit(2)
+    batch.print_results(results)
+    ok = all(not result.error for result in results)
+    if check:
+        for result in results:
+            if not result.error and not verify.verify_bundle(result.final_path):
+                ok = False
+    if not ok:
+        sys.exit(1)
+
+def watch_main(project_path, polling, check):
+    after = verify.verify_bundle if check else None
+    try:
+        watch.Watcher(project_path, polling=polling, after=after).run()
+    except KeyboardInterrupt:
+        print()
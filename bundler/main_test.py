@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from . import main
+
+class MainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_a_subcommand(self):
+        verify_main = mock.Mock()
+        with mock.patch.dict(main.SUBCOMMANDS, verify=verify_main):
+            main.main(["verify", "Foo.app"])
+        verify_main.assert_called_once_with(["Foo.app"])
+
+    def test_b_description_named_like_subcommand(self):
+        with open("verify", "w", encoding="utf-8"):
+            pass
+        verify_main = mock.Mock()
+        with mock.patch.dict(main.SUBCOMMANDS, verify=verify_main), \
+             mock.patch.object(main, "BatchBuilder") as builder:
+            builder.return_value.make_bundler.return_value = (mock.Mock(), {})
+            main.main(["verify"])
+        verify_main.assert_not_called()
+        builder.return_value.make_bundler.assert_called_once_with("verify")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,26 @@
+import configparser
 import errno
+import fnmatch
+import functools
+import hashlib
+import json
 import sys
 import re
 import os
-import glob
+import stat
 import shutil
-from subprocess import call, check_call, Popen, PIPE, STDOUT
+from subprocess import call, Popen, PIPE, STDOUT
 import xml.dom.minidom
 import plistlib
-from . import utils
+from . import iconcache, macho, utils
+from . import store as binstore
+from .analyze import Provenance
+from .fsindex import FileSystemIndex
+from .python import PythonModules
+
+def path_is_glob(path):
+    (dummy_parent, tail) = os.path.split(path)
+    return bool(re.search("[*?]", tail))
 
 # Base class for anything that can be copied into a bundle with a
 # source and dest.
@@ -27,6 +40,9 @@ class Path():
         self.dest = dest
         self.recurse = recurse
         self.bundledir = 'Resources'
+        # The project entry that the copied files are attributed to,
+        # None for libraries added by dependency resolution.
+        self.entry = source
 
     @classmethod
     def from_node(cls, node, validate=True):
@@ -56,7 +72,8 @@ class Path():
                 raise ValueError("Icon theme must have a 'name' property")
 
             icons = node.getAttribute("icons")
-            return IconTheme(name, icons)
+            return IconTheme(name, icons, node.getAttribute("sizes"),
+                             node.getAttribute("scales"))
 
         return Path(source, dest, recurse)
 
@@ -88,10 +105,13 @@ class Path():
 
         return True
 
-    def copy_file(self, dummy_project, source, dest):
+    def copy_file(self, the_project, source, dest):
+        if the_project.is_excluded(source):
+            return
         try:
             # print(f'Copying {source} to {dest}')
-            shutil.copy2(source, dest)
+            copied = shutil.copy2(source, dest)
+            the_project.provenance.record_copy(self.entry, source, copied)
         except EnvironmentError as e:
             if e.errno == errno.ENOENT:
                 print("Warning, source file missing: " + source)
@@ -102,19 +122,20 @@ class Path():
 
 
     def copy_target_glob_recursive(self, the_project, source, dest):
+        index = the_project.fs_index
         source_parent, source_tail = os.path.split(source)
-        for root, dummy_dirs, dummy_files in os.walk(source_parent):
+        for root, dummy_dirs, dummy_files in index.walk(source_parent):
             destdir = os.path.join(dest, os.path.relpath(root, source_parent))
-            glob_list = glob.glob(os.path.join(root, source_tail))
+            glob_list = index.glob(os.path.join(root, source_tail))
             if not glob_list:
                 continue
             utils.makedirs(destdir)
             for globbed_source in glob_list:
-                if os.path.isfile(globbed_source):
+                if index.isfile(globbed_source):
                     self.copy_file(the_project, globbed_source, destdir)
 
     def copy_target_recursive(self, the_project, source, dest):
-        for root, dummy_dirs, files in os.walk(source):
+        for root, dummy_dirs, files in the_project.fs_index.walk(source):
             destdir = os.path.join(dest, os.path.relpath(root, source))
             if not files:
                 continue
@@ -124,8 +145,8 @@ class Path():
 
 
     def copy_target_glob(self, the_project, source, dest):
-        for globbed_source in glob.glob(source):
-            if os.path.isdir(globbed_source):
+        for globbed_source in the_project.fs_index.glob(source):
+            if the_project.fs_index.isdir(globbed_source):
                 self.copy_target_recursive(the_project, globbed_source, dest)
             else:
                 self.copy_file(the_project, globbed_source, dest)
@@ -156,11 +177,23 @@ class Path():
         return dest
 
     def is_source_glob(self):
-        p = re.compile("[*?]")
-        (dummy_source_parent, source_tail) = os.path.split(self.source)
-        if p.search(source_tail):
-            return True
-        return False
+        return path_is_glob(self.source)
+
+    def covers(self, the_project, path):
+        """Returns True if path, a file in a prefix, is (or would be)
+        copied by this entry.
+        """
+        source = the_project.evaluate_path(self.source)
+        if not path_is_glob(source):
+            return path == source or path.startswith(source + os.sep)
+        parent, pattern = os.path.split(source)
+        if not path.startswith(parent + os.sep):
+            return False
+        if self.recurse:
+            return fnmatch.fnmatch(os.path.basename(path), pattern)
+        # Matching directories are copied with everything in them.
+        first = os.path.relpath(path, parent).split(os.sep)[0]
+        return fnmatch.fnmatch(first, pattern)
 
     def compute_source_path(self, the_project):
         source = the_project.evaluate_path(self.source)
@@ -175,7 +208,7 @@ class Path():
             source_check = source_parent
         else:
             source_check = source
-        if not os.path.exists(source_check):
+        if not the_project.fs_index.exists(source_check):
             raise ValueError("Cannot find source to copy: " + source)
 
         return source
@@ -200,6 +233,9 @@ class Variable():
 class Meta():
     def __init__(self, node):
         self.prefixes = {}
+        # Prefixes with an arch attribute, by architecture. A universal
+        # bundle is built from one set of them per architecture.
+        self.arch_prefixes = {}
 
         prefixes = utils.node_get_elements_by_tag_name(node, "prefix")
         for child in prefixes:
@@ -207,7 +243,16 @@ class Meta():
             if len(name) == 0:
                 name = "default"
             value = utils.evaluate_environment_variables(utils.node_get_string(child))
-            self.prefixes[name] = value
+            arch = child.getAttribute("arch")
+            if arch:
+                self.arch_prefixes.setdefault(arch, {})[name] = value
+            else:
+                self.prefixes[name] = value
+        self.common_prefixes = dict(self.prefixes)
+        # Until an architecture is picked the first one stands in.
+        for arch_prefixes in self.arch_prefixes.values():
+            self.prefixes.update(arch_prefixes)
+            break
 
         child = utils.node_get_element_by_tag_name(node, "image")
         if child:
@@ -219,6 +264,38 @@ class Meta():
         else:
             self.run_install_name_tool = False
 
+        # Architectures to keep in fat binaries; all of them if empty.
+        child = utils.node_get_element_by_tag_name(node, "architectures")
+        if child:
+            self.architectures = utils.node_get_string(child).replace(",", " ").split()
+        else:
+            self.architectures = []
+
+        child = utils.node_get_element_by_tag_name(node, "strip")
+        if child:
+            self.strip = True
+            self.strip_tool = child.getAttribute("tool") or "strip"
+            self.keep_symbols = utils.node_get_property_boolean(child, "keep-symbols")
+        else:
+            self.strip = False
+            self.strip_tool = "strip"
+            self.keep_symbols = False
+
+        # Libraries that nothing loads are dropped if <prune> is set,
+        # except for the ones matching a <keep> pattern.
+        child = utils.node_get_element_by_tag_name(node, "prune")
+        if child:
+            self.prune = True
+            self.prune_keep = [utils.node_get_string(keep) for keep
+                               in utils.node_get_elements_by_tag_name(child, "keep")]
+        else:
+            self.prune = False
+            self.prune_keep = []
+
+        # Reproducible bundles get the same timestamps, permissions and
+        # generated file contents from the same inputs.
+        self.reproducible = bool(utils.node_get_element_by_tag_name(node, "reproducible"))
+
         child = utils.node_get_element_by_tag_name(node, "destination")
         self.overwrite = utils.node_get_property_boolean(child, "overwrite", False)
         self.dest = utils.node_get_string(child, "${project}")
@@ -229,6 +306,30 @@ class Meta():
         else:
             self.gtk = "gtk+-2.0"
 
+    def use_architecture(self, arch):
+        """Switches to the prefixes of arch, and keeps only that
+        architecture in fat binaries.
+        """
+        self.prefixes = dict(self.common_prefixes)
+        self.prefixes.update(self.arch_prefixes[arch])
+        self.architectures = [arch]
+
+def change_install_names(target, new_id=None, changes=None):
+    """Rewrites the install id of target and the library names in
+    changes with a single install_name_tool run.
+    """
+    args = ['install_name_tool']
+    if new_id:
+        args.extend(['-id', new_id])
+    for old, new in sorted((changes or {}).items()):
+        args.extend(['-change', old, new])
+    if len(args) == 1:
+        return False
+    os.chmod(target, os.stat(target).st_mode | stat.S_IWUSR)
+    if call(args + [target]) != 0:
+        print(f'Warning, install_name_tool failed on {target}')
+    return True
+
 class Binary(Path):
     def __init__(self, source, dest=None, recurse=False):
         super().__init__(source, dest, recurse)
@@ -238,20 +339,54 @@ class Binary(Path):
     def copy_file(self, the_project, source, dest):
         dummy_path, ext = os.path.splitext(source)
         # Skip static libs and libtool files:
-        if ext in ('.la', '.a'):
+        if ext in ('.la', '.a') or the_project.is_excluded(source):
             return
-        super().copy_file(the_project, source, dest)
         if os.path.isdir(dest):
             dest = os.path.join(dest, os.path.split(source)[1])
+        store = binstore.default_store()
+        key = store and self.store_key(the_project, source)
+        if key and store.fetch(key, dest):
+            the_project.provenance.record_copy(self.entry, source, dest)
+            self.destinations.append(dest)
+            return
+        super().copy_file(the_project, source, dest)
         # print(f"Copy binary file {source} to "
         #       "{'directory' if os.path.isdir(dest) else 'file'} {dest}")
-        self.fix_rpaths(the_project, dest)
-        # self.strip_debugging(dest)
-        self.sign(the_project, dest)
+        self.relocate_and_sign(the_project, dest)
+        if key and os.path.exists(dest):
+            store.add(key, dest)
         self.destinations.append(dest)
 
+    def relocate_and_sign(self, the_project, target):
+        self.fix_rpaths(the_project, target)
+        # The strip stage signs the files once they are stripped.
+        if not the_project.get_meta().strip:
+            self.sign(the_project, target)
+
+    def store_key(self, the_project, source):
+        """Returns the binary store key of what relocate_and_sign makes
+        of source: its contents, the install names it gets and how it
+        is signed. None if source isn't a Mach-O file.
+        """
+        slices = macho.read(source)
+        if not slices:
+            return None
+        meta = the_project.get_meta()
+        digest = utils.hash_file(source, hashlib.sha256())
+        relocations = None
+        if meta.run_install_name_tool:
+            new_id, changes = self.relocations(the_project, slices)
+            relocations = [new_id, sorted(changes.items())]
+        signing = None
+        if not meta.strip and "APPLICATION_CERT" in os.environ:
+            entitlements = the_project.get_entitlements_path()
+            signing = [os.getenv("APPLICATION_CERT"), the_project.get_bundle_id(),
+                       utils.hash_file(entitlements) if entitlements else None]
+        digest.update(json.dumps([relocations, signing]).encode("utf-8"))
+        return digest.hexdigest()
+
     def copy_target(self, the_project, dummy_log = False):
-        if os.path.isdir(self.compute_source_path(the_project)):
+        if the_project.fs_index.isdir(self.compute_source_path(the_project)):
             source = self.source
             self.source = os.path.join(source, '*.so')
             self.recurse = True
@@ -263,25 +398,44 @@ class Binary(Path):
             super().copy_target(the_project)
         return self.destinations
 
-    def fix_rpaths(self, the_project, target, frameworks = None):
+    def relocated_name(self, the_project, name):
+        """Returns the install name that library name gets in the
+        bundle, or None if it doesn't need changing.
+        """
+        if name in the_project.framework_names:
+            return the_project.framework_names[name]
+        if "@executable_path" in name:
+            return None
+        bundle_res = "@executable_path/../Resources"
+        for prefix in the_project.get_meta().prefixes:
+            prefix_path = the_project.get_prefix(prefix)
+            if prefix_path in name:
+                return name.replace(prefix_path, bundle_res, 1)
+        if name.startswith("@rpath/"):
+            return os.path.join(bundle_res, "lib", name[len("@rpath/"):])
+        return None
+
+    def relocations(self, the_project, slices):
+        """Returns the new install id and the library name changes for
+        a binary in the bundle.
+        """
+        new_id = None
+        if slices[0].id:
+            new_id = self.relocated_name(the_project, slices[0].id)
+        changes = {}
+        for name in macho.dylibs(slices):
+            relocated = self.relocated_name(the_project, name)
+            if relocated and relocated != name:
+                changes[name] = relocated
+        return new_id, changes
+
+    def fix_rpaths(self, the_project, target):
         if not the_project.get_meta().run_install_name_tool:
             return
-        # Byte compiled scheme and python files don't have rpaths.
-        if (target.endswith('.go') or target.endswith('.pyc') or
-            target.endswith('.pyo')):
+        slices = macho.read(target)
+        if not slices:
             return
-        cmd = os.path.join(os.path.dirname(__file__),
-                           "run-install-name-tool-change.sh")
-        for prefix in the_project.get_meta().prefixes:
-            prefix_path = the_project.get_prefix(prefix)
-            bundle_libdir = os.path.join(self.bundledir, 'lib')
-            call([cmd, target, prefix_path, self.bundledir, "change"])
-            call([cmd, target, prefix_path, self.bundledir, "id"])
-            call([cmd, target, '@rpath', bundle_libdir, "change"])
-            call([cmd, target, '@rpath', bundle_libdir, "id"])
-            if hasattr(frameworks, '__iter__'):
-                for fw in frameworks:
-                    fw.fix_rpaths(the_project, fw, frameworks)
+        change_install_names(target, *self.relocations(the_project, slices))
 
     def sign(self, the_project, target):
         if "APPLICATION_CERT" not in os.environ:
@@ -299,16 +453,6 @@ class Binary(Path):
             if results:
                 raise SystemError(f'Warning! Codesigning {target} returned error {results}')
 
-    def strip_debugging(self, target):
-        if target.endswith(".dylib") or target.endswith(".so"):
-            os.chmod(os.path.dirname(target), 0o644)
-            os.system("strip -x " + target + " 2>/dev/null")
-            os.chmod(target, 0o444)
-        else:
-            os.chmod(target, 0o755)
-            os.system("strip -ur " + target + " 2>/dev/null")
-            os.chmod(target, 0o555)
-
 
 class Framework(Binary):
     def __init__(self, source, recurse):
@@ -324,19 +468,32 @@ class Framework(Binary):
     def get_bundle_name(self):
         return os.path.join(self.bundledir, self.get_name())
 
-    def fix_rpaths(self, the_project, target, frameworks = None):
-        if not the_project.get_meta().run_install_name_tool:
-            return
+    def copy_target(self, the_project, dummy_log = False):
+        source = self.compute_source_path(the_project)
         dest = self.compute_destination(the_project)
-        cmd = os.path.join(os.path.dirname(__file__),
-                           "run-install-name-tool-change.sh")
-        check_call([cmd, dest, self.get_name(), self.bundledir, 'id'])
-        if hasattr(frameworks, '__iter__'):
-            for dep in frameworks:
-                if dep == self:
+        # rmtree refuses symlinks, even to directories.
+        if os.path.islink(dest) or os.path.isfile(dest):
+            os.unlink(dest)
+        elif os.path.lexists(dest):
+            shutil.rmtree(dest)
+        shutil.copytree(source, dest, symlinks=True)
+        for root, dummy_dirs, files in os.walk(dest):
+            for file in files:
+                path = os.path.join(root, file)
+                if os.path.islink(path):
+                    continue
+                the_project.provenance.record_copy(
+                    self.entry, os.path.join(source, os.path.relpath(path, dest)), path)
+                if not macho.read(path):
                     continue
-                check_call([cmd, dest, dep.get_name(),
-                            dep.get_bundle_name(), 'change'])
+                store = binstore.default_store()
+                key = store and self.store_key(the_project, path)
+                if not (key and store.fetch(key, path)):
+                    self.relocate_and_sign(the_project, path)
+                    if key:
+                        store.add(key, path)
+                self.destinations.append(path)
+        return dest
 
 class Translation(Path):
     def __init__(self, name, sourcepath, destpath, recurse):
@@ -357,59 +514,181 @@ class Translation(Path):
         if source is None:
                 raise ValueError(f'Failed to parse {self.name} translation source!')
         prefix = the_project.get_prefix()
-        for root, dummy_trees, files in os.walk(source):
+        for root, dummy_trees, files in the_project.fs_index.walk(source):
             for file in filter(name_filter, files):
                 path = os.path.join(root, file)
-                Path("${prefix}" + path[len(prefix):], self.dest).copy_target(the_project)
+                mo_file = Path("${prefix}" + path[len(prefix):], self.dest)
+                mo_file.entry = self.entry
+                mo_file.copy_target(the_project)
 
 
 class GirFile(Path):
+    SHARED_LIBRARY_RE = re.compile(r'\s*shared-library=')
+    LIBRARY_SPLIT_RE = re.compile('[",]')
+
     def __init__(self, sourcepath, destpath, recurse):
         super().__init__(sourcepath, destpath, recurse)
         self.bundle_path = '@executable_path/../Resources/lib'
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def compiler_version():
+        with Popen(['g-ir-compiler', '--version'], stdout=PIPE,
+                   stderr=STDOUT) as output:
+            return output.communicate()[0]
+
     def copy_girfile(self, the_project, gir_dest, typelib_dest, lib_path):
+        lib_path_re = re.compile(re.escape(lib_path))
+        cache_dir = utils.get_cache_dir('typelibs')
+
+        def rewrite_line(line):
+            if not GirFile.SHARED_LIBRARY_RE.match(line):
+                return line
+            (new_line, subs) = lib_path_re.subn(self.bundle_path, line)
+            if subs:
+                return new_line
+            libs = GirFile.LIBRARY_SPLIT_RE.split(line)
+            return libs[0] + '"' +  ",".join(map(lambda lib: os.path.join(self.bundle_path, lib), libs[1:-1])) + '"'
 
         def transform_file(filename):
             dummy_path, fname = os.path.split(filename)
             name, dummy_ext = os.path.splitext(fname)
 
-            with open (filename, "r", encoding="utf8") as source:
-                lines = source.readlines()
             gir_file = os.path.join(gir_dest, fname)
             typelib = os.path.join(typelib_dest, name + '.typelib')
-            with open (gir_file, "w", encoding="utf8") as target:
-                for line in lines:
-                    if re.match(r'\s*shared-library=', line):
-                        (new_line, subs) = re.subn(lib_path, self.bundle_path, line)
-                        if subs:
-                            target.write(new_line)
-                        else:
-                            libs = re.split('[",]', line)
-                            new_line = libs[0] + '"' +  ",".join(map(lambda lib: os.path.join(self.bundle_path, lib), libs[1:-1])) + '"'
-                            target.write(new_line)
-                    else:
-                        target.write(line)
-
-            call(['g-ir-compiler', '--output=' + typelib, gir_file])
+            digest = hashlib.sha256(GirFile.compiler_version())
+            with open (filename, "r", encoding="utf8") as source, \
+                 open (gir_file, "w", encoding="utf8") as target:
+                for line in source:
+                    line = rewrite_line(line)
+                    digest.update(line.encode("utf8"))
+                    target.write(line)
+
+            the_project.provenance.record_copy(self.entry, filename, gir_file)
+            the_project.provenance.record_copy(self.entry, filename, typelib)
+
+            # The typelib only depends on the rewritten gir and on the
+            # compiler, so an unchanged gir doesn't need compiling again.
+            cached = os.path.join(cache_dir, digest.hexdigest() + '.typelib')
+            if os.path.exists(cached):
+                shutil.copyfile(cached, typelib)
+                return typelib
+
+            if call(['g-ir-compiler', '--output=' + typelib, gir_file]) == 0:
+                utils.cache_store(cached, typelib)
+            else:
+                print(f'Warning, g-ir-compiler failed on {gir_file}')
             return typelib
 
-        filename = the_project.evaluate_path(self.source)
-        typelib_paths = []
-        for globbed_source in glob.glob(filename):
+        def transform(globbed_source):
             try:
-                typelib_paths.append(transform_file(globbed_source))
+                return transform_file(globbed_source)
             except ValueError as err:
                 print(f'Error in transformation of {globbed_source} { err}')
-        return typelib_paths
+                return None
+
+        filename = the_project.evaluate_path(self.source)
+        girs = the_project.fs_index.glob(filename)
+        return [typelib for typelib in utils.job_slots().map(transform, girs)
+                if typelib is not None]
+
+    def shared_libraries(self, the_project):
+        """Returns the file names of the libraries that
+        gobject-introspection loads by name for these gir files.
+        """
+        names = set()
+        for filename in the_project.fs_index.glob(the_project.evaluate_path(self.source)):
+            with open(filename, "r", encoding="utf8") as source:
+                for line in source:
+                    if GirFile.SHARED_LIBRARY_RE.match(line):
+                        libs = GirFile.LIBRARY_SPLIT_RE.split(line)[1:-1]
+                        names.update(os.path.basename(lib) for lib in libs)
+                        break
+        return names
 
 class Data(Path):
     pass
 
+class PixbufLoaders():
+    """The gdk-pixbuf loaders to ship, either listed by name or picked
+    automatically from the image types found in the bundled data.
+    """
+    LOADER_RE = re.compile(r"^libpixbufloader[-_](.+)\.(?:so|dylib)$")
+    LOADER_DIRS = ["${prefix}/lib/gdk-pixbuf-2.0",
+                   "${prefix}/lib/gdk-pixbuf-3.0",
+                   "${prefix}/lib/gtk-2.0"]
+    EXTENSIONS = {
+        ".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".jpe": "jpeg",
+        ".gif": "gif", ".svg": "svg", ".svgz": "svg", ".ico": "ico",
+        ".cur": "ico", ".ani": "ani", ".bmp": "bmp", ".tif": "tiff",
+        ".tiff": "tiff", ".xpm": "xpm", ".xbm": "xbm", ".pnm": "pnm",
+        ".pbm": "pnm", ".pgm": "pnm", ".ppm": "pnm", ".tga": "tga",
+        ".icns": "icns", ".webp": "webp", ".qtif": "qtif", ".qif": "qtif",
+        ".avif": "avif", ".heic": "heif", ".heif": "heif", ".jxl": "jxl",
+    }
+
+    def __init__(self, include):
+        include = include.strip()
+        self.auto = include in ("", "auto")
+        self.names = set()
+        if not self.auto:
+            self.names = {name.strip() for name in include.split(",")
+                          if name.strip()}
+
+    def select(self, the_project):
+        if not self.auto:
+            return self.names
+
+        # GTK itself always needs to load PNGs (icons, cursors).
+        names = {"png"}
+        # Only the images that icon themes ship count; which icons an
+        # auto theme ships depends on the binaries, which aren't copied
+        # yet, so all of its images in the selected sizes do.
+        files = [path for theme in the_project.get_icon_themes()
+                 if theme.icons != IconTheme.ICONS_NONE
+                 for dummy_directory, path, dummy_name in theme.icon_files(the_project)]
+        sources = []
+        for path in the_project.get_data():
+            try:
+                sources.append(path.compute_source_path(the_project))
+            except ValueError:
+                continue
+        for source in sources:
+            if path_is_glob(source):
+                files.extend(the_project.fs_index.glob(source))
+            elif the_project.fs_index.isdir(source):
+                files.extend(os.path.join(root, f)
+                             for root, dummy_dirs, dir_files in the_project.fs_index.walk(source)
+                             for f in dir_files)
+            else:
+                files.append(source)
+        for f in files:
+            ext = os.path.splitext(f)[1].lower()
+            if ext in PixbufLoaders.EXTENSIONS:
+                names.add(PixbufLoaders.EXTENSIONS[ext])
+        return names
+
+    def unused_loaders(self, the_project, names):
+        """Returns the loader modules in the prefix that aren't in names."""
+        unused = []
+        index = the_project.fs_index
+        for base in PixbufLoaders.LOADER_DIRS:
+            base = the_project.evaluate_path(base)
+            for version in index.glob(os.path.join(base, "*")):
+                for path in index.glob(os.path.join(version, "loaders", "*")):
+                    m = PixbufLoaders.LOADER_RE.match(os.path.basename(path))
+                    if m and m.group(1) not in names:
+                        unused.append(path)
+        return unused
+
 class IconTheme(Path):
     ICONS_NONE, ICONS_ALL, ICONS_AUTO = list(range(3))
+    # Icons that are shipped scalable lose their PNGs above this many
+    # pixels, where the SVG covers their size; smaller ones are usually
+    # drawn for their size.
+    PREFER_SVG_ABOVE = 32
 
-    def __init__(self, name, icons = "all"):
+    def __init__(self, name, icons = "all", sizes="", scales=""):
         super().__init__("${prefix}/share/icons/" + name)
         self.name = name
         if icons == "all":
@@ -420,6 +699,20 @@ class IconTheme(Path):
             self.icons = IconTheme.ICONS_AUTO
         else:
             self.icons = IconTheme.ICONS_ALL
+        # The sizes and scales of the directories to ship; all of them
+        # if None. "scalable" in sizes stands for the scalable ones.
+        self.sizes = IconTheme.parse_numbers(sizes, "sizes", {"scalable"})
+        self.scales = IconTheme.parse_numbers(scales, "scales")
+
+    @staticmethod
+    def parse_numbers(value, attribute, words=()):
+        items = [item.strip() for item in (value or "").split(",") if item.strip()]
+        if not items:
+            return None
+        for item in items:
+            if item not in words and not item.isdigit():
+                raise ValueError(f'Invalid icon theme {attribute} {value}')
+        return {item if item in words else int(item) for item in items}
 
     def copy_target(self, the_project):
         source_base = self.source
@@ -431,42 +724,156 @@ class IconTheme(Path):
         all_icons = set()
         if self.icons == IconTheme.ICONS_NONE:
             return all_icons
-        for dummy_root, dummy_dirs, files in os.walk(the_project.evaluate_path(self.source)):
+        for dummy_root, dummy_dirs, files in the_project.fs_index.walk(the_project.evaluate_path(self.source)):
             for f in files:
                 (head, tail) = os.path.splitext(f)
                 if tail in [".png", ".svg"]:
                     all_icons.add(head)
         return all_icons
 
-    def copy_icons(self, the_project, used_icons):
-        if self.icons == IconTheme.ICONS_NONE:
-            return
-        prefix = the_project.get_prefix()
-        for root, dummy_dirs, files in os.walk(the_project.evaluate_path(self.source)):
+    def read_directories(self, the_project):
+        """Returns the directories that the theme's index.theme lists,
+        with their type, size, scale and the range of sizes they cover
+        (MinSize and MaxSize, which default to the size).
+        """
+        index = configparser.ConfigParser(interpolation=None, strict=False)
+        index.optionxform = str
+        directories = {}
+        try:
+            index.read(os.path.join(the_project.evaluate_path(self.source), "index.theme"),
+                       encoding="utf-8")
+        except configparser.Error as e:
+            print(f'Warning, cannot read the index of the {self.name} icon theme: {e}')
+            return directories
+        if not index.has_section("Icon Theme"):
+            return directories
+        names = []
+        for key in ("Directories", "ScaledDirectories"):
+            names.extend(n.strip() for n in index["Icon Theme"].get(key, "").split(",")
+                         if n.strip())
+        for name in names:
+            if not index.has_section(name):
+                continue
+            section = index[name]
+            try:
+                size = int(section.get("Size", "0"))
+                directories[name] = (section.get("Type", "Threshold"), size,
+                                     int(section.get("Scale", "1")),
+                                     int(section.get("MinSize", str(size))),
+                                     int(section.get("MaxSize", str(size))))
+            except ValueError:
+                print(f'Warning, invalid size or scale for {name} in the {self.name} icon theme')
+        return directories
+
+    def ships_directory(self, directory):
+        kind, size, scale = directory[:3]
+        if self.scales is not None and scale not in self.scales:
+            return False
+        if self.sizes is None:
+            return True
+        if kind == "Scalable":
+            return "scalable" in self.sizes
+        return size in self.sizes
+
+    def is_subset(self):
+        return self.sizes is not None or self.scales is not None
+
+    def icon_files(self, the_project, directories=None):
+        """Returns the images of the theme in the directories that its
+        sizes and scales select, as (directory, path, icon name)
+        tuples; directories are those read_directories() returns.
+        """
+        source = the_project.evaluate_path(self.source)
+        subset = self.is_subset()
+        if directories is None:
+            directories = self.read_directories(the_project) if subset else {}
+        shipped = {name for name, directory in directories.items()
+                   if self.ships_directory(directory)}
+        # The icons that are shipped as SVGs in scalable directories,
+        # with the ranges of pixel sizes they are drawn at.
+        scalable = {}
+        for name in shipped:
+            kind, dummy_size, scale, min_size, max_size = directories[name]
+            if kind == "Scalable":
+                for dummy_root, dummy_dirs, files in the_project.fs_index.walk(
+                        os.path.join(source, name)):
+                    for f in files:
+                        if f.endswith(".svg"):
+                            scalable.setdefault(f[:-4], []).append(
+                                (min_size * scale, max_size * scale))
+
+        result = []
+        for root, dummy_dirs, files in the_project.fs_index.walk(source):
+            directory = os.path.relpath(root, source)
+            if subset and directory not in shipped:
+                continue
+            kind, size, scale = directories.get(directory, ("Scalable", 0, 1))[:3]
             for f in files:
-                # Go through every file, if it matches the icon
-                # set, copy it.
-                (head, dummy_tail) = os.path.splitext(f)
+                (head, tail) = os.path.splitext(f)
 
                 if head.endswith('.symbolic'):
                     (head, dummy_tail) = os.path.splitext(head)
 
-                if head in used_icons or self.icons == IconTheme.ICONS_ALL:
-                    path = os.path.join(root, f)
+                pixels = size * scale
+                if subset and tail == ".png" and kind != "Scalable" and \
+                   pixels > IconTheme.PREFER_SVG_ABOVE and \
+                   any(low <= pixels <= high for low, high in scalable.get(head, ())):
+                    continue
+                result.append((directory, os.path.join(root, f), head))
+        return result
 
-                    # Replace the real paths with the prefix macro
-                    # so we can use copy_target.
-                    Path("${prefix}" + path[len(prefix):]).copy_target(the_project)
+    def copy_icons(self, the_project, used_icons):
+        if self.icons == IconTheme.ICONS_NONE:
+            return
+        prefix = the_project.get_prefix()
+        directories = self.read_directories(the_project) if self.is_subset() else {}
+        copied = set()
+        for directory, path, head in self.icon_files(the_project, directories):
+            # Copy every file that matches the icon set.
+            if head in used_icons or self.icons == IconTheme.ICONS_ALL:
+                # Replace the real paths with the prefix macro
+                # so we can use copy_target.
+                icon = Path("${prefix}" + path[len(prefix):])
+                icon.entry = self.entry
+                icon.copy_target(the_project)
+                copied.add(directory)
+
+        theme = the_project.get_bundle_path("Contents/Resources/share/icons", self.name)
+        if self.is_subset():
+            self.rewrite_index(os.path.join(theme, "index.theme"), set(directories), copied)
 
         # Generate icon cache.
-        path = the_project.get_bundle_path("Contents/Resources/share/icons", self.name)
-        cmd = "gtk-update-icon-cache -f " + path + " 2>/dev/null"
-        os.popen(cmd)
+        iconcache.write_icon_cache(theme)
 
+    @staticmethod
+    def rewrite_index(path, directories, shipped):
+        """Rewrites the index.theme at path to list only the shipped
+        directories, leaving out the sections of the others.
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        result = []
+        section = None
+        for line in lines:
+            stripped = line.strip()
+            if stripped.startswith("[") and stripped.endswith("]"):
+                section = stripped[1:-1]
+            if section in directories and section not in shipped:
+                continue
+            key = stripped.split("=", 1)[0].strip()
+            if section == "Icon Theme" and key in ("Directories", "ScaledDirectories"):
+                names = [n.strip() for n in stripped.split("=", 1)[1].split(",")]
+                line = f'{key}={",".join(n for n in names if n in shipped)}'
+            result.append(line)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(result) + "\n")
 
 
 class Project():
-    def __init__(self, project_path=None):
+    def __init__(self, project_path=None, arch=None, dest=None, fs_index=None):
         if not os.path.isabs(project_path):
             project_path = os.path.join(os.getcwd(), project_path)
         self.project_path = project_path
@@ -485,7 +892,17 @@ class Project():
         # The directory the project file is in (as opposed to
         # project_path which is the path including the filename).
         self.project_dir, dummy_tail = os.path.split(project_path)
+        # Set when building one architecture of a universal bundle:
+        # the prefixes to use and where to put the result.
+        self.arch = arch
+        self.dest = dest
         self.meta = self.get_meta()
+        # Projects built in the same process can share one index.
+        if fs_index is None:
+            fs_index = FileSystemIndex()
+        for prefix in self.meta.prefixes.values():
+            fs_index.add_root(prefix)
+        self.fs_index = fs_index
         plist_path = self.get_plist_path()
         try:
             with open(plist_path, "rb") as f:
@@ -503,6 +920,15 @@ class Project():
             self.bundle_name = plist['CFBundleExecutable']
 
         self.bundle_id = plist['CFBundleIdentifier']
+        # Where each file in the bundle came from, for the analysis
+        # report.
+        self.provenance = Provenance(self.get_bundle_path())
+        # Install names of the frameworks' binaries mapped to their
+        # names in the bundle.
+        self.framework_names = {}
+        # Source files that must not be copied into the bundle even
+        # though an entry matches them.
+        self.excluded = set()
 
     def evaluate_path(self, path, include_bundle=True):
         """
@@ -551,6 +977,12 @@ class Project():
 
         return os.path.normpath(path)
 
+    def exclude(self, path):
+        self.excluded.add(os.path.normpath(path))
+
+    def is_excluded(self, path):
+        return os.path.normpath(path) in self.excluded
+
     def get_name(self):
         return self.name
 
@@ -560,6 +992,16 @@ class Project():
     def get_bundle_id(self):
         return self.bundle_id
 
+    def get_source_date_epoch(self):
+        """Returns the timestamp for the files of a reproducible
+        bundle, $SOURCE_DATE_EPOCH or 0, or None if the bundle isn't
+        reproducible.
+        """
+        epoch = utils.source_date_epoch()
+        if epoch is None and self.get_meta().reproducible:
+            return 0
+        return epoch
+
     def get_prefix(self, name="default"):
         meta = self.get_meta()
         return meta.prefixes[name]
@@ -617,9 +1059,27 @@ class Project():
 
         return themes
 
+    def get_loaders(self):
+        node = utils.node_get_element_by_tag_name(self.root, "loaders")
+        if not node:
+            return None
+        return PixbufLoaders(node.getAttribute("include"))
+
+    def get_python(self):
+        node = utils.node_get_element_by_tag_name(self.root, "python")
+        if not node:
+            return None
+        return PythonModules(node)
+
     def get_meta(self):
         node = utils.node_get_element_by_tag_name(self.root, "meta")
-        return Meta(node)
+        meta = Meta(node)
+        if self.arch:
+            meta.use_architecture(self.arch)
+        if self.dest:
+            meta.dest = self.dest
+            meta.overwrite = True
+        return meta
 
     def get_gtk_version(self):
         if self.meta.gtk == "gtk+-3.0":
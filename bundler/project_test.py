@@ -1,11 +1,14 @@
 import os
 import errno
 import sys
+import tempfile
 import unittest
+from unittest import mock
 import xml.dom.minidom
 from plistlib import load as plist_load
 
-from .project import Project
+from .macho_test import make_macho, write_file
+from .project import Binary, Project
 from . import utils
 
 class MockProject(Project):
@@ -169,3 +172,62 @@ class ProjectTest(unittest.TestCase):
                              f'Bad translation name {trans[0].name}')
         self.assertEqual(trans[0].source, "${prefix}/share/locale",
                              f'Bad translation source {trans[0].source}')
+
+    def test_p_get_loaders(self):
+        loaders = self.goodproject.get_loaders()
+        self.assertFalse(loaders.auto, "Loaders list parsed as auto")
+        self.assertEqual(loaders.select(self.goodproject), {"png", "svg"},
+                         f'Bad loader selection {loaders.names}')
+        self.assertEqual(self.badproject.get_loaders(), None,
+                         "Badproject has no loaders tag")
+
+    def test_q_relocated_name(self):
+        binary = Binary("${prefix}/lib/libfoo.dylib")
+        prefix = self.goodproject.get_prefix()
+        framework = "/Library/Frameworks/Foo.framework/Versions/A/Foo"
+        self.goodproject.framework_names = {
+            framework: "@executable_path/../Frameworks/Foo.framework/Versions/A/Foo"}
+        self.assertEqual(binary.relocated_name(self.goodproject,
+                                               prefix + "/lib/libbar.dylib"),
+                         "@executable_path/../Resources/lib/libbar.dylib")
+        self.assertEqual(binary.relocated_name(self.goodproject,
+                                               "/usr/local/gtk/lib/libalt.dylib"),
+                         "@executable_path/../Resources/lib/libalt.dylib")
+        self.assertEqual(binary.relocated_name(self.goodproject,
+                                               "@rpath/libbaz.dylib"),
+                         "@executable_path/../Resources/lib/libbaz.dylib")
+        self.assertEqual(binary.relocated_name(self.goodproject, framework),
+                         "@executable_path/../Frameworks/Foo.framework/Versions/A/Foo")
+        self.assertIsNone(binary.relocated_name(self.goodproject,
+                                                "/usr/lib/libSystem.B.dylib"))
+
+    def test_r_covers(self):
+        prefix = self.goodproject.get_prefix()
+        lib = os.path.join(prefix, "lib")
+        directory = Binary("${prefix}/lib/gtk-2.0")
+        self.assertTrue(directory.covers(self.goodproject,
+                                         os.path.join(lib, "gtk-2.0", "2.10.0", "foo.so")))
+        self.assertFalse(directory.covers(self.goodproject,
+                                          os.path.join(lib, "gtk-2.0-extra", "foo.so")))
+        pattern = Binary("${prefix}/lib/libfoo*.dylib")
+        self.assertTrue(pattern.covers(self.goodproject, os.path.join(lib, "libfoo.1.dylib")))
+        self.assertFalse(pattern.covers(self.goodproject,
+                                        os.path.join(lib, "sub", "libfoo.1.dylib")))
+        pattern.recurse = True
+        self.assertTrue(pattern.covers(self.goodproject,
+                                       os.path.join(lib, "sub", "libfoo.1.dylib")))
+
+    def test_s_store_key(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, "libfoo.dylib")
+            write_file(source, make_macho(dylib_id="@rpath/libfoo.dylib"))
+            other = os.path.join(tmpdir, "other")
+            write_file(other, b"not a binary")
+            binary = Binary("${prefix}/lib/libfoo.dylib")
+            self.assertIsNone(binary.store_key(self.goodproject, other))
+            key = binary.store_key(self.goodproject, source)
+            self.assertEqual(key, binary.store_key(self.goodproject, source))
+            with mock.patch.dict(os.environ, {"APPLICATION_CERT": "Developer ID"}):
+                self.assertNotEqual(key, binary.store_key(self.goodproject, source))
+            write_file(source, make_macho(dylib_id="@rpath/libbar.dylib"))
+            self.assertNotEqual(key, binary.store_key(self.goodproject, source))
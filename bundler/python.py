@@ -0,0 +1,434 @@
+"""Byte-compiles the Python modules copied into a bundle, so that the
+application doesn't compile them when it first starts (or on every
+start, when the bundle is signed or read-only). The modules are
+compiled by the bundle's own interpreter, found in the prefix, with
+compileall running a worker per processor.
+
+The pure Python part of the standard library can then be packed into
+lib/pythonXY.zip, which is on the interpreter's default module path:
+importing from one archive saves thousands of stats at every start,
+and signing has far fewer files to go through.
+
+Before anything is copied, the modules that the application's entry
+scripts can't import, directly or not, can be left out of the bundle,
+along with the extension modules among them.
+"""
+import fnmatch
+import json
+import os
+import shutil
+from subprocess import PIPE, STDOUT, run
+import time
+import zipfile
+
+from . import utils
+
+INVALIDATION_MODES = ("timestamp", "checked-hash", "unchecked-hash")
+
+class PythonModules():
+    """The <python> element: which interpreter compiles the modules,
+    how the compiled files are checked against their sources, and
+    whether the sources are kept.
+    """
+
+    def __init__(self, node):
+        self.interpreter = node.getAttribute("interpreter") or "${prefix}/bin/python3"
+        self.invalidation = node.getAttribute("invalidation") or "unchecked-hash"
+        if self.invalidation not in INVALIDATION_MODES:
+            raise ValueError(f'Invalid Python invalidation mode {self.invalidation}, '
+                             f'use one of {", ".join(INVALIDATION_MODES)}')
+        optimize = node.getAttribute("optimize") or "0"
+        if optimize not in ("0", "1", "2"):
+            raise ValueError(f'Invalid Python optimization level {optimize}')
+        self.optimize = int(optimize)
+        self.drop_sources = utils.node_get_property_boolean(node, "drop-sources")
+        self.zip = utils.node_get_property_boolean(node, "zip")
+        # The directories to compile, by default the interpreter's
+        # library directory in the bundle.
+        self.directories = (utils.node_get_string(node) or "").split()
+        # The scripts the application starts from, if the modules it
+        # doesn't import are to be left out, and the patterns of the
+        # modules it imports in ways that can't be found.
+        self.entries = [utils.node_get_string(child) for child
+                        in utils.node_get_elements_by_tag_name(node, "entry")]
+        self.keep = [utils.node_get_string(child) for child
+                     in utils.node_get_elements_by_tag_name(node, "keep")]
+        # The patterns of modules that are left out even if imported.
+        self.exclude = [utils.node_get_string(child) for child
+                        in utils.node_get_elements_by_tag_name(node, "exclude")]
+
+# Imported by the interpreter itself as it starts, or by names that
+# are worked out when they're imported.
+STARTUP_MODULES = ("site", "sitecustomize", "encodings", "_sysconfigdata*")
+
+# Never needed by an application; the finder doesn't follow imports
+# into them.
+DEFAULT_EXCLUDES = ("test", "*.test", "*.tests", "idlelib", "ensurepip", "lib2to3",
+                    "turtledemo", "pydoc_data", "venv")
+
+# Run by the bundle's interpreter to list the modules that the entry
+# scripts and the named modules import, directly or not.
+FIND_MODULES = """
+import fnmatch, json, modulefinder, os, sys
+entries, names, excludes = json.loads(sys.argv[1])
+class Finder(modulefinder.ModuleFinder):
+    def import_module(self, partname, fqname, parent):
+        if any(fnmatch.fnmatchcase(fqname, pattern) for pattern in excludes):
+            raise ImportError(fqname)
+        return super().import_module(partname, fqname, parent)
+finder = Finder([os.path.dirname(e) for e in entries] + sys.path[1:])
+for entry in entries:
+    finder.run_script(entry)
+for name in names:
+    try:
+        finder.import_hook(name)
+    except ImportError:
+        pass
+missing = {name.split(".")[0] for name, callers in finder.badmodules.items()
+           if "__main__" in callers} - set(finder.modules)
+missing = [name for name in missing
+           if not any(fnmatch.fnmatchcase(name, pattern) for pattern in excludes)]
+print(json.dumps([sorted(finder.modules), sorted(missing)]))
+"""
+
+def run_interpreter(interpreter, *args):
+    result = run([interpreter] + list(args), stdout=PIPE, stderr=PIPE, check=False,
+                 text=True, errors="replace")
+    if result.returncode != 0:
+        raise OSError(f'Cannot run {interpreter}: {result.stderr.strip()}')
+    return result.stdout
+
+def interpreter_info(interpreter):
+    """Returns the cache tag (cpython-312) and the version (3.12) of
+    interpreter, and where its library is.
+    """
+    output = run_interpreter(interpreter, "-c", "import sys, sysconfig; "
+                             "print(sys.implementation.cache_tag, '%d.%d' % "
+                             "sys.version_info[:2], sysconfig.get_path('stdlib'))")
+    cache_tag, version, library = output.split(None, 2)
+    return cache_tag, version, library.strip()
+
+def module_names(library):
+    """Returns the modules in library, by name, with the files that
+    belong to them: their code, and for packages the other files in
+    the package's directories. Extension modules are in lib-dynload,
+    third party ones in site-packages. Files outside of packages that
+    aren't modules are left out.
+    """
+    modules = {}
+    for top in (library, os.path.join(library, "lib-dynload"),
+                os.path.join(library, "site-packages")):
+        for root, dirs, files in os.walk(top):
+            if root == library:
+                dirs[:] = [d for d in dirs if d not in ("lib-dynload", "site-packages")]
+            dirs[:] = [d for d in dirs if d != "__pycache__"]
+            parts = [] if root == top else os.path.relpath(root, top).split(os.sep)
+            # The package holding root: the files in root belong to it,
+            # and if root is a package itself its modules are importable.
+            depth = 0
+            while depth < len(parts) and os.path.exists(
+                    os.path.join(top, *parts[:depth + 1], "__init__.py")):
+                depth += 1
+            package = ".".join(parts[:depth])
+            for name in files:
+                if depth == len(parts) and name.endswith((".py", ".pyc", ".so")):
+                    module = name.split(".")[0]
+                    module = ".".join(parts + ([] if module == "__init__" else [module]))
+                elif package:
+                    module = package
+                else:
+                    continue
+                modules.setdefault(module, []).append(os.path.join(root, name))
+    return modules
+
+def is_kept(name, patterns):
+    """A module is kept if it or one of the packages it is in matches
+    one of the patterns.
+    """
+    parts = name.split(".")
+    return any(fnmatch.fnmatchcase(".".join(parts[:i]), pattern)
+               for pattern in patterns for i in range(1, len(parts) + 1))
+
+def find_modules(interpreter, entries, names, excludes=()):
+    """Returns the names of the modules that the entry scripts and
+    the modules in names import, directly or not, as interpreter
+    finds them, without going into the modules matching excludes,
+    and the top-level modules that the entry scripts import but
+    interpreter can't find.
+    """
+    found, missing = json.loads(run_interpreter(
+        interpreter, "-c", FIND_MODULES, json.dumps([entries, sorted(names),
+                                                     list(excludes)])))
+    return set(found), missing
+
+def unused_modules(the_project, modules):
+    """Returns the files of the modules in the library of the <python>
+    element modules that its entry scripts don't use.
+    """
+    interpreter = the_project.evaluate_path(modules.interpreter)
+    dummy_cache_tag, dummy_version, library = interpreter_info(interpreter)
+    available = module_names(library)
+    keep = list(STARTUP_MODULES) + modules.keep
+    # A module kept explicitly isn't excluded by default.
+    excludes = [pattern for pattern in DEFAULT_EXCLUDES
+                if not any(is_kept(name, [pattern]) for name in modules.keep)]
+    excludes += modules.exclude
+    kept = {name for name in available if is_kept(name, keep) and
+            not is_kept(name, excludes)}
+    entries = [the_project.evaluate_path(entry) for entry in modules.entries]
+    used, missing = find_modules(interpreter, entries, kept, excludes)
+    # What a module that can't be found imports is unknown, so nothing
+    # can be pruned safely.
+    if missing:
+        raise ValueError(f'the entry scripts import modules that cannot be found: '
+                         f'{", ".join(missing)}')
+    used |= kept
+    return {name: files for name, files in available.items() if name not in used}
+
+def prune_modules(the_project, modules):
+    """Excludes the modules that the entry scripts don't use from the
+    bundle, and reports them. Nothing is pruned if the entry scripts
+    import modules that the interpreter can't find.
+    """
+    try:
+        unused = unused_modules(the_project, modules)
+    except (OSError, ValueError) as e:
+        print(f'Warning, not pruning the Python modules: {e}')
+        return
+    for files in unused.values():
+        for path in files:
+            the_project.exclude(path)
+    # Packages are listed without their modules.
+    names = sorted(name for name in unused if name.rpartition(".")[0] not in unused)
+    print(f'Pruned {len(unused)} unused Python modules '
+          f'({sum(len(files) for files in unused.values())} files): {", ".join(names)}')
+
+def compile_modules(interpreter, paths, strip_dir, invalidation="unchecked-hash",
+                    optimize=0, legacy=False, jobs=None):
+    """Compiles the modules in paths (directories or files) with
+    interpreter. The compiled files record their sources relative to
+    strip_dir, so that they don't depend on where the bundle was
+    built. legacy puts them next to the sources, where they are loaded
+    even without the sources. Returns False if some didn't compile.
+    """
+    # The worker processes run on the caller's job slot and on the
+    # free ones, at most jobs of them.
+    slots = utils.job_slots()
+    extra = slots.take((jobs or slots.count) - 1)
+    args = [interpreter, "-m", "compileall", "-q", "-j", str(1 + extra),
+            "--invalidation-mode", invalidation, "-s", strip_dir]
+    if optimize:
+        args.extend(["-o", str(optimize)])
+    if legacy:
+        args.append("-b")
+    try:
+        result = run(args + sorted(paths), stdout=PIPE, stderr=STDOUT, check=False,
+                     text=True, errors="replace")
+    finally:
+        slots.give_back(extra)
+    if result.returncode != 0:
+        print(f'Warning, some Python modules did not compile:\n{result.stdout.strip()}')
+        return False
+    return True
+
+def drop_sources(directory):
+    """Removes the sources that have a compiled file next to them, and
+    the __pycache__ directories that are no longer used without them.
+    Returns the number of files removed.
+    """
+    removed = 0
+    for root, dirs, files in os.walk(directory):
+        if "__pycache__" in dirs:
+            cache = os.path.join(root, "__pycache__")
+            removed += sum(len(names) for dummy_root, dummy_dirs, names in os.walk(cache))
+            shutil.rmtree(cache)
+            dirs.remove("__pycache__")
+        for name in files:
+            if name.endswith(".py") and name + "c" in files:
+                os.unlink(os.path.join(root, name))
+                removed += 1
+    return removed
+
+def drop_other_caches(directory, cache_tag):
+    """Removes the files in the __pycache__ directories that another
+    interpreter version compiled. Returns the number of files removed.
+    """
+    removed = 0
+    for root, dummy_dirs, files in os.walk(directory):
+        if os.path.basename(root) != "__pycache__":
+            continue
+        for name in files:
+            parts = name.split(".")
+            if len(parts) >= 3 and parts[-1] == "pyc" and parts[1] != cache_tag:
+                os.unlink(os.path.join(root, name))
+                removed += 1
+    return removed
+
+# Directories of the standard library that stay on disk.
+UNPACKED_DIRS = ("site-packages", "lib-dynload", "__pycache__")
+# Kept on disk as well, since the interpreter looks for it to find its
+# library.
+LANDMARK = "os"
+
+def count_files(directory):
+    return sum(len(files) for dummy_root, dummy_dirs, files in os.walk(directory))
+
+def packable(library, archived=()):
+    """Returns the top level modules and packages of library that can
+    be imported from an archive: the packages holding anything but
+    Python sources and compiled files (extension modules, data that is
+    read from next to the modules) stay on disk. Packages in archived
+    are already in the archive, and don't need their __init__ on disk.
+    """
+    names = []
+    for name in sorted(os.listdir(library)):
+        path = os.path.join(library, name)
+        if os.path.isfile(path):
+            if name.endswith((".py", ".pyc")):
+                names.append(name)
+            continue
+        if (name in UNPACKED_DIRS or name.startswith("config-") or
+                not os.path.isdir(path) or os.path.islink(path)):
+            continue
+        if name not in archived and not any(
+                os.path.exists(os.path.join(path, "__init__" + ext))
+                for ext in (".py", ".pyc")):
+            continue
+        if all(f.endswith((".py", ".pyc")) for dummy_root, dummy_dirs, files
+               in os.walk(path) for f in files):
+            names.append(name)
+    return names
+
+def compiled_name(name, cache_tag, optimize):
+    opt = f'.opt-{optimize}' if optimize else ''
+    return os.path.join("__pycache__", f'{name[:-3]}.{cache_tag}{opt}.pyc')
+
+def archive_members(library, names, cache_tag, optimize):
+    """Returns the archive names of the modules in names, with the
+    files they come from. Compiled files get the names that zipimport
+    looks for, next to their sources.
+    """
+    members = {}
+    def add(directory, arcdir, name):
+        path = os.path.join(directory, name)
+        if name.endswith(".pyc"):
+            members[os.path.join(arcdir, name)] = path
+        elif name.endswith(".py"):
+            members[os.path.join(arcdir, name)] = path
+            compiled = os.path.join(directory, compiled_name(name, cache_tag, optimize))
+            if os.path.exists(compiled) and os.path.join(arcdir, name + "c") not in members:
+                members[os.path.join(arcdir, name + "c")] = compiled
+    for name in names:
+        path = os.path.join(library, name)
+        if os.path.isfile(path):
+            add(library, "", name)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+            for f in sorted(files):
+                add(root, os.path.relpath(root, library), f)
+    return members
+
+def pack_library(library, archive, cache_tag, optimize=0, epoch=None):
+    """Moves the pure Python modules of library into archive. Modules
+    already in an existing archive are kept, unless library has newer
+    ones. Returns the number of files in library before and after.
+    """
+    old = {}
+    if os.path.exists(archive):
+        with zipfile.ZipFile(archive) as zin:
+            for info in zin.infolist():
+                old[info.filename] = (info, zin.read(info))
+    before = count_files(library)
+    names = packable(library, {name.split("/")[0] for name in old})
+    members = archive_members(library, names, cache_tag, optimize)
+    if not members:
+        return before, before
+
+    tmp = archive + ".tmp"
+    # Stored rather than compressed: zipimport would need zlib, itself
+    # an extension module, to read compressed entries.
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as zout:
+        for arcname in sorted(set(members) | set(old)):
+            if arcname not in members:
+                info, data = old[arcname]
+                zout.writestr(info, data)
+                continue
+            mtime = os.path.getmtime(members[arcname])
+            if epoch is not None:
+                mtime = min(mtime, epoch)
+            # Zip times are local, except in reproducible bundles.
+            date_time = (time.gmtime if epoch is not None else time.localtime)(
+                max(mtime, 315532800))[:6]
+            info = zipfile.ZipInfo(arcname, date_time)
+            info.external_attr = 0o644 << 16
+            with open(members[arcname], "rb") as f:
+                zout.writestr(info, f.read())
+    os.replace(tmp, archive)
+
+    for name in names:
+        if name in (LANDMARK + ".py", LANDMARK + ".pyc"):
+            continue
+        path = os.path.join(library, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+    cache = os.path.join(library, "__pycache__")
+    if os.path.isdir(cache):
+        for name in os.listdir(cache):
+            if name.split(".")[0] != LANDMARK:
+                os.unlink(os.path.join(cache, name))
+    return before, count_files(library)
+
+def compile_bundle(the_project, modules, bundle, epoch=None, paths=None, jobs=None):
+    """Compiles the modules of bundle as the <python> element modules
+    asks, or only the sources in paths if given.
+    """
+    interpreter = the_project.evaluate_path(modules.interpreter)
+    try:
+        cache_tag, version, dummy_library = interpreter_info(interpreter)
+    except OSError as e:
+        print(f'Warning, not compiling the Python modules: {e}')
+        return
+    directories = [the_project.evaluate_path(d) for d in modules.directories]
+    if not directories:
+        directories = [os.path.join(bundle, "Contents", "Resources", "lib",
+                                    "python" + version)]
+    missing = [d for d in directories if not os.path.isdir(d)]
+    if missing and paths is None:
+        print(f'Warning, no Python modules to compile in {", ".join(missing)}')
+    directories = [d for d in directories if d not in missing]
+    if not directories:
+        return
+    if paths is not None:
+        paths = [p for p in paths if p.endswith(".py") and
+                 any(p.startswith(d + os.sep) for d in directories)]
+        if not paths:
+            return
+    invalidation = modules.invalidation
+    if epoch is not None and invalidation == "timestamp":
+        # The sources' times are changed once everything is copied,
+        # which would make the compiled files look stale.
+        invalidation = "checked-hash"
+    compile_modules(interpreter, paths or directories, bundle, invalidation,
+                    modules.optimize, modules.drop_sources, jobs)
+    removed = 0
+    for directory in directories:
+        if modules.drop_sources:
+            removed += drop_sources(directory)
+        else:
+            removed += drop_other_caches(directory, cache_tag)
+    if paths is None:
+        print(f'Compiled the Python modules in {", ".join(directories)} with {interpreter}'
+              + (f', removed {removed} files' if removed else ''))
+    if modules.zip:
+        library = os.path.join(bundle, "Contents", "Resources", "lib", "python" + version)
+        archive = os.path.join(bundle, "Contents", "Resources", "lib",
+                               "python" + version.replace(".", "") + ".zip")
+        if os.path.isdir(library):
+            before, after = pack_library(library, archive, cache_tag, modules.optimize,
+                                         epoch)
+            if before != after:
+                print(f'Packed the Python standard library into {os.path.basename(archive)}: '
+                      f'{before} -> {after} files')
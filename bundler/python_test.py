@@ -0,0 +1,182 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+import xml.dom.minidom
+import zipfile
+
+from . import python
+from .macho_test import write_file
+
+def parse(text):
+    return python.PythonModules(xml.dom.minidom.parseString(text).documentElement)
+
+class PythonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bundle = os.path.join(self.tmpdir, "Foo.app")
+        version = "%d.%d" % sys.version_info[:2]
+        self.lib = os.path.join(self.bundle, "Contents", "Resources", "lib",
+                                "python" + version)
+        write_file(os.path.join(self.lib, "pkg", "__init__.py"), b"")
+        write_file(os.path.join(self.lib, "pkg", "mod.py"),
+                   b"VALUE = 42\ndef where():\n    return where.__code__.co_filename\n")
+        self.stale = os.path.join(self.lib, "pkg", "__pycache__", "mod.cpython-20.pyc")
+        write_file(self.stale, b"stale")
+        self.project = mock.Mock(evaluate_path=lambda path: path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def compile(self, text, epoch=None):
+        modules = parse(text.replace("PYTHON", sys.executable))
+        with mock.patch("builtins.print"):
+            python.compile_bundle(self.project, modules, self.bundle, epoch)
+
+    def run_module(self, *paths):
+        # -B keeps the interpreter from writing the compiled files itself.
+        output = subprocess.check_output(
+            [sys.executable, "-B", "-c", "import sys; sys.path[:0] = sys.argv[1:]; "
+             "import pkg.mod; print(pkg.mod.VALUE, pkg.mod.__file__, pkg.mod.where())"]
+            + list(paths or [self.lib]), text=True)
+        return output.split()
+
+    def pyc_flags(self, path):
+        with open(path, "rb") as f:
+            return int.from_bytes(f.read(8)[4:], "little")
+
+    def test_a_compile(self):
+        self.compile('<python interpreter="PYTHON"/>')
+        cached = os.path.join(self.lib, "pkg", "__pycache__",
+                              f'mod.{sys.implementation.cache_tag}.pyc')
+        self.assertTrue(os.path.exists(cached))
+        self.assertFalse(os.path.exists(self.stale))
+        # Unchecked hash-based files are used without looking at the
+        # sources.
+        self.assertEqual(self.pyc_flags(cached), 1)
+        self.assertEqual(self.run_module()[0], "42")
+
+    def test_b_drop_sources(self):
+        self.compile('<python interpreter="PYTHON" drop-sources="yes"/>')
+        pkg = os.path.join(self.lib, "pkg")
+        self.assertEqual(sorted(os.listdir(pkg)), ["__init__.pyc", "mod.pyc"])
+        value, filename, code_filename = self.run_module()
+        self.assertEqual(value, "42")
+        self.assertEqual(filename, os.path.join(pkg, "mod.pyc"))
+        # The build directory isn't recorded in the compiled files.
+        self.assertEqual(code_filename, os.path.join("Contents", "Resources", "lib",
+                                                     os.path.basename(self.lib),
+                                                     "pkg", "mod.py"))
+
+    def test_c_reproducible(self):
+        self.compile('<python interpreter="PYTHON" invalidation="timestamp"/>', epoch=0)
+        cached = os.path.join(self.lib, "pkg", "__pycache__",
+                              f'mod.{sys.implementation.cache_tag}.pyc')
+        self.assertEqual(self.pyc_flags(cached), 3)
+
+    def test_d_zip(self):
+        write_file(os.path.join(self.lib, "os.py"), b"")
+        write_file(os.path.join(self.lib, "data", "__init__.py"), b"")
+        write_file(os.path.join(self.lib, "data", "grammar.txt"), b"")
+        write_file(os.path.join(self.lib, "lib-dynload", "_foo.so"), b"")
+        write_file(os.path.join(self.lib, "site-packages", "foo.py"), b"")
+        self.compile('<python interpreter="PYTHON" zip="yes"/>')
+        archive = os.path.join(os.path.dirname(self.lib),
+                               "python%d%d.zip" % sys.version_info[:2])
+        with zipfile.ZipFile(archive) as z:
+            self.assertEqual(z.namelist(), ["os.py", "os.pyc", "pkg/__init__.py",
+                                            "pkg/__init__.pyc", "pkg/mod.py",
+                                            "pkg/mod.pyc"])
+        # The packages with data, the extensions and the landmark stay.
+        self.assertEqual(sorted(os.listdir(self.lib)),
+                         ["__pycache__", "data", "lib-dynload", "os.py", "site-packages"])
+        value, filename, dummy_code_filename = self.run_module(archive, self.lib)
+        self.assertEqual(value, "42")
+        # Loaded from the compiled file.
+        self.assertEqual(filename, os.path.join(archive, "pkg", "mod.pyc"))
+
+        # Updating a module puts it back in the archive.
+        write_file(os.path.join(self.lib, "pkg", "mod.py"), b"VALUE = 43\n"
+                   b"def where():\n    return ''\n")
+        modules = parse(f'<python interpreter="{sys.executable}" zip="yes"/>')
+        with mock.patch("builtins.print"):
+            python.compile_bundle(self.project, modules, self.bundle,
+                                  paths=[os.path.join(self.lib, "pkg", "mod.py")])
+        self.assertFalse(os.path.exists(os.path.join(self.lib, "pkg")))
+        self.assertEqual(self.run_module(archive, self.lib)[0], "43")
+
+    def make_library(self):
+        library = os.path.join(self.tmpdir, "prefix", "lib", "python3")
+        for name in ("json/__init__.py", "json/decoder.py", "tkinter/__init__.py",
+                     "tkinter/tk.tcl", "tkinter/images/logo.gif", "encodings/__init__.py",
+                     "encodings/cp1252.py", "keepme.py", "config-3/python-config.py",
+                     "config-3/Makefile", "lib-dynload/_json.cpython-3-darwin.so",
+                     "lib-dynload/_tkinter.cpython-3-darwin.so",
+                     "site-packages/app/__init__.py", "site-packages/app.pth"):
+            write_file(os.path.join(library, name), b"")
+        return library
+
+    def test_e_module_names(self):
+        library = self.make_library()
+        modules = python.module_names(library)
+        self.assertEqual(sorted(modules), ["_json", "_tkinter", "app", "encodings",
+                                           "encodings.cp1252", "json", "json.decoder",
+                                           "keepme", "tkinter"])
+        self.assertEqual(sorted(os.path.relpath(path, library) for path in modules["tkinter"]),
+                         ["tkinter/__init__.py", "tkinter/images/logo.gif",
+                          "tkinter/tk.tcl"])
+        self.assertTrue(python.is_kept("encodings.cp1252", ["encodings"]))
+        self.assertTrue(python.is_kept("encodings.cp1252", ["encodings.cp*"]))
+        self.assertFalse(python.is_kept("encodings", ["encodings.cp*"]))
+
+    def test_f_prune(self):
+        library = self.make_library()
+        entry = os.path.join(self.tmpdir, "app", "main.py")
+        write_file(entry, b"import json\nimport helper\n")
+        write_file(os.path.join(self.tmpdir, "app", "helper.py"), b"import json.decoder\n")
+        modules = parse(f'<python interpreter="{sys.executable}"><entry>{entry}</entry>'
+                        '<keep>keep*</keep></python>')
+        project = mock.Mock(evaluate_path=lambda path: path, excluded=set())
+        project.exclude.side_effect = project.excluded.add
+        # The modules are looked up in the host's library, but only
+        # those in the fake one are excluded.
+        with mock.patch.object(python, "interpreter_info",
+                               return_value=("cpython-3", "3", library)):
+            with mock.patch("builtins.print") as print_mock:
+                python.prune_modules(project, modules)
+        self.assertEqual(sorted(os.path.relpath(path, library) for path in project.excluded),
+                         ["lib-dynload/_tkinter.cpython-3-darwin.so",
+                          "site-packages/app/__init__.py", "tkinter/__init__.py",
+                          "tkinter/images/logo.gif", "tkinter/tk.tcl"])
+        print_mock.assert_called_once_with(
+            "Pruned 3 unused Python modules (5 files): _tkinter, app, tkinter")
+
+        # An entry script importing a module that isn't there prunes
+        # nothing.
+        write_file(entry, b"import json\nimport helper\nimport not_installed.sub\n")
+        project.excluded.clear()
+        with mock.patch.object(python, "interpreter_info",
+                               return_value=("cpython-3", "3", library)):
+            with mock.patch("builtins.print") as print_mock:
+                python.prune_modules(project, modules)
+        self.assertEqual(project.excluded, set())
+        print_mock.assert_called_once_with(
+            "Warning, not pruning the Python modules: the entry scripts import "
+            "modules that cannot be found: not_installed")
+
+    def test_g_invalid(self):
+        with self.assertRaisesRegex(ValueError, "invalidation mode"):
+            parse('<python invalidation="never"/>')
+        with self.assertRaisesRegex(ValueError, "optimization level"):
+            parse('<python optimize="3"/>')
+        modules = parse('<python drop-sources="yes">${bundle}/a ${bundle}/b</python>')
+        self.assertEqual(modules.interpreter, "${prefix}/bin/python3")
+        self.assertTrue(modules.drop_sources)
+        self.assertEqual(modules.directories, ["${bundle}/a", "${bundle}/b"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""Runs the steps of building a bundle as a graph. Each stage names the
+inputs it needs and the outputs it produces; a stage starts as soon as
+every stage producing one of its inputs has finished, so independent
+stages overlap, up to the limit of the shared job slots. When a stage
+fails, the stages that depend on it are cancelled, the others finish,
+and the failure is raised again.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import time
+
+from . import utils
+
+class Stage():
+    def __init__(self, name, function, inputs=(), outputs=()):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+class StageGraph():
+    def __init__(self, stages):
+        self.stages = {}
+        producers = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f'Duplicate stage {stage.name}')
+            self.stages[stage.name] = stage
+            for output in stage.outputs:
+                producers.setdefault(output, []).append(stage.name)
+        # The stages each stage waits for, and the ones waiting for it.
+        self.depends = {}
+        self.dependents = {name: set() for name in self.stages}
+        for stage in stages:
+            depends = set()
+            for name in stage.inputs:
+                if name not in producers:
+                    raise ValueError(f'Nothing produces {name}, needed by {stage.name}')
+                depends.update(producers[name])
+            depends.discard(stage.name)
+            self.depends[stage.name] = depends
+            for dependency in depends:
+                self.dependents[dependency].add(stage.name)
+        self.check_cycles()
+
+    def check_cycles(self):
+        done, visiting = set(), set()
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f'Stage {name} depends on itself')
+            visiting.add(name)
+            for dependency in self.depends[name]:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+        for name in self.stages:
+            visit(name)
+
+    def downstream(self, name):
+        """Returns the stages that depend on name, directly or not."""
+        found = set()
+        work = list(self.dependents[name])
+        while work:
+            stage = work.pop()
+            if stage not in found:
+                found.add(stage)
+                work.extend(self.dependents[stage])
+        return found
+
+def run_stages(stages, slots=None):
+    """Runs stages, each holding one of slots (the process's
+    utils.JobSlots by default) while it runs, so that the stages and
+    the parallel work inside them stay within one limit. Returns the
+    time each of them took, in seconds, by name.
+    """
+    slots = slots or utils.job_slots()
+    graph = StageGraph(stages)
+    waiting = {name: set(depends) for name, depends in graph.depends.items()}
+    cancelled = set()
+    failure = None
+    timings = {}
+
+    def run(stage):
+        with slots.slot():
+            start = time.monotonic()
+            try:
+                stage.function()
+            finally:
+                timings[stage.name] = time.monotonic() - start
+
+    # A thread for each stage that may be ready at once; the slots
+    # limit how many of them run.
+    with ThreadPoolExecutor(max_workers=len(stages) or 1) as pool:
+        running = {}
+        def start_ready():
+            # Stages are started in the order they were given.
+            for stage in stages:
+                name = stage.name
+                if name in waiting and not waiting[name] and name not in cancelled:
+                    del waiting[name]
+                    running[pool.submit(run, stage)] = name
+        start_ready()
+        while running:
+            done, dummy_pending = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    if failure is None:
+                        failure = error
+                    for dependent in graph.downstream(name):
+                        if dependent in waiting:
+                            cancelled.add(dependent)
+                            print(f'Cancelled stage {dependent}: {name} failed')
+                    continue
+                for dependent in graph.dependents[name]:
+                    if dependent in waiting:
+                        waiting[dependent].discard(name)
+            start_ready()
+    if failure is not None:
+        raise failure
+    return timings
+
+def print_timings(timings, total, slowest=5):
+    stages = sorted(timings.items(), key=lambda item: -item[1])[:slowest]
+    print(f'Built in {total:.2f}s, {sum(timings.values()):.2f}s of stages; slowest: '
+          + ", ".join(f'{name} {seconds:.2f}s' for name, seconds in stages))
@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from . import stages, utils
+from .stages import Stage
+
+class StagesTest(unittest.TestCase):
+
+    def test_a_order(self):
+        order = []
+        lock = threading.Lock()
+        def stage(name):
+            def run():
+                with lock:
+                    order.append(name)
+            return run
+        timings = stages.run_stages([
+            Stage("strip", stage("strip"), ["binaries", "data"], ["stripped"]),
+            Stage("data", stage("data"), ["skeleton"], ["data"]),
+            Stage("binaries", stage("binaries"), ["skeleton"], ["binaries"]),
+            Stage("skeleton", stage("skeleton"), outputs=["skeleton"]),
+        ], slots=utils.JobSlots(4))
+        self.assertEqual(order[0], "skeleton")
+        self.assertEqual(order[-1], "strip")
+        self.assertEqual(set(order[1:3]), {"data", "binaries"})
+        self.assertEqual(set(timings), set(order))
+
+    def test_b_overlap(self):
+        # Each of the stages waits for the other one to start.
+        barrier = threading.Barrier(2, timeout=10)
+        stages.run_stages([Stage("one", barrier.wait, outputs=["one"]),
+                           Stage("two", barrier.wait, outputs=["two"])],
+                          slots=utils.JobSlots(2))
+
+    def test_c_failure(self):
+        ran = []
+        release = threading.Event()
+        def fail():
+            raise RuntimeError("broken")
+        def independent():
+            release.wait(10)
+            ran.append("independent")
+        with mock.patch("builtins.print"):
+            with self.assertRaisesRegex(RuntimeError, "broken"):
+                stages.run_stages([
+                    Stage("independent", independent, outputs=["other"]),
+                    Stage("binaries", fail, outputs=["binaries"]),
+                    Stage("icons", lambda: ran.append("icons"), ["binaries"], ["icons"]),
+                    Stage("strip", lambda: ran.append("strip"), ["icons", "other"]),
+                    Stage("release", release.set, outputs=["released"]),
+                ], slots=utils.JobSlots(3))
+        self.assertEqual(ran, ["independent"])
+
+    def test_d_graph_errors(self):
+        with self.assertRaisesRegex(ValueError, "Nothing produces"):
+            stages.StageGraph([Stage("strip", None, ["binaries"])])
+        with self.assertRaisesRegex(ValueError, "Duplicate"):
+            stages.StageGraph([Stage("strip", None), Stage("strip", None)])
+        with self.assertRaisesRegex(ValueError, "depends on itself"):
+            stages.StageGraph([Stage("one", None, ["b"], ["a"]),
+                               Stage("two", None, ["a"], ["b"])])
+        graph = stages.StageGraph([Stage("one", None, outputs=["a"]),
+                                   Stage("two", None, ["a"], ["b"]),
+                                   Stage("three", None, ["b"])])
+        self.assertEqual(graph.downstream("one"), {"two", "three"})
+
+    def test_e_shared_slots(self):
+        # The stages and the work they spread over threads share the
+        # slots, and work nested in a stage runs even when no slot is
+        # free.
+        slots = utils.JobSlots(2)
+        lock = threading.Lock()
+        running = [0, 0]
+        def item(value):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return value * 2
+        results = {}
+        def stage(name):
+            def run():
+                results[name] = slots.map(item, range(6))
+            return run
+        stages.run_stages([Stage(name, stage(name), outputs=[name])
+                           for name in ("one", "two", "three")], slots=slots)
+        self.assertEqual(results["one"], [0, 2, 4, 6, 8, 10])
+        self.assertEqual(len(results), 3)
+        self.assertLessEqual(running[1], 2)
+
+if __name__ == '__main__':
+    unittest.main()
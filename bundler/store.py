@@ -0,0 +1,148 @@
+"""A content-addressed store of relocated and signed binaries. A binary
+is stored under a key covering its contents and everything that went
+into processing it, so another build (on this machine or, with the
+store on a shared or synced directory, on another one) can take the
+result instead of running install_name_tool and codesign again.
+
+Entries are added atomically, under names no other writer uses, so
+any number of builds can share a store. Entries are touched when used
+and the least recently used ones are removed once the store grows
+beyond its size limit.
+"""
+import ctypes
+import fcntl
+import functools
+import os
+import re
+import shutil
+import socket
+import sys
+import threading
+import time
+
+from . import utils
+
+DEFAULT_MAX_SIZE = 2 << 30
+FICLONE = 0x40049409
+
+def parse_size(value):
+    """Parses a size in bytes with an optional K, M or G suffix."""
+    m = re.fullmatch(r"\s*(\d+)\s*([KMG]?)B?\s*", value, re.IGNORECASE)
+    if not m:
+        raise ValueError(f'Invalid size {value}')
+    return int(m.group(1)) << {"": 0, "K": 10, "M": 20, "G": 30}[m.group(2).upper()]
+
+def clone_file(source, dest):
+    """Copies source to dest, sharing the data blocks (a reflink) where
+    the file system can.
+    """
+    try:
+        if sys.platform == "darwin":
+            libc = ctypes.CDLL(None, use_errno=True)
+            if libc.clonefile(os.fsencode(source), os.fsencode(dest), 0) == 0:
+                return
+        else:
+            with open(source, "rb") as fin, open(dest, "wb") as fout:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+                return
+    except (AttributeError, OSError):
+        pass
+    shutil.copyfile(source, dest)
+
+class BinaryStore():
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key, dest):
+        """Writes the stored file for key to dest. Returns False if the
+        store doesn't have it.
+        """
+        path = self.path(key)
+        tmp = f'{dest}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            mode = os.stat(path).st_mode
+            clone_file(path, tmp)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return False
+        os.chmod(tmp, mode & 0o7777)
+        os.replace(tmp, dest)
+        try:
+            # Recently used entries are the last to be evicted.
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def add(self, key, source):
+        path = self.path(key)
+        utils.makedirs(os.path.dirname(path))
+        # Unique across the machines sharing the store.
+        tmp = (f'{path}.{socket.gethostname()}.{os.getpid()}.'
+               f'{threading.get_ident()}.tmp')
+        try:
+            shutil.copy2(source, tmp)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f'Warning, cannot add {source} to the binary store: {e}')
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def evict(self):
+        """Removes the least recently used entries until the store fits
+        in its size limit. Returns the number of bytes removed.
+        """
+        entries = []
+        total = 0
+        for root, dummy_dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                # Leave the files being written alone, unless their
+                # writer is long gone.
+                if name.endswith(".tmp") and time.time() - st.st_mtime < 86400:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+                total += st.st_size
+        removed = 0
+        for dummy_mtime, path, size in sorted(entries):
+            if total - removed <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                # Someone else evicted it already.
+                continue
+            removed += size
+        return removed
+
+@functools.lru_cache(maxsize=None)
+def default_store():
+    """Returns the store in $GTK_MAC_BUNDLER_STORE, or in the bundler's
+    cache directory, limited to $GTK_MAC_BUNDLER_STORE_SIZE bytes. None
+    if that is 0.
+    """
+    max_size = DEFAULT_MAX_SIZE
+    if os.getenv("GTK_MAC_BUNDLER_STORE_SIZE"):
+        max_size = parse_size(os.getenv("GTK_MAC_BUNDLER_STORE_SIZE"))
+    if not max_size:
+        return None
+    directory = os.getenv("GTK_MAC_BUNDLER_STORE")
+    if directory:
+        utils.makedirs(directory)
+    else:
+        directory = utils.get_cache_dir("binaries")
+    return BinaryStore(directory, max_size)
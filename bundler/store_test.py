@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import store
+from .macho_test import write_file
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = store.BinaryStore(os.path.join(self.tmpdir, "store"), 250)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_a_parse_size(self):
+        self.assertEqual(store.parse_size("123"), 123)
+        self.assertEqual(store.parse_size("2K"), 2048)
+        self.assertEqual(store.parse_size("1g"), 1 << 30)
+        self.assertRaises(ValueError, store.parse_size, "lots")
+
+    def test_b_fetch(self):
+        source = os.path.join(self.tmpdir, "libfoo.dylib")
+        write_file(source, b"relocated")
+        os.chmod(source, 0o755)
+        dest = os.path.join(self.tmpdir, "out.dylib")
+        self.assertFalse(self.store.fetch("ab12", dest))
+        self.store.add("ab12", source)
+        write_file(dest, b"stale")
+        self.assertTrue(self.store.fetch("ab12", dest))
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), b"relocated")
+        self.assertEqual(os.stat(dest).st_mode & 0o777, 0o755)
+        self.assertEqual((self.store.hits, self.store.misses), (1, 1))
+        # No temporary files are left behind.
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ["libfoo.dylib", "out.dylib", "store"])
+
+    def test_c_evict(self):
+        source = os.path.join(self.tmpdir, "lib")
+        write_file(source, b"x" * 100)
+        for i, key in enumerate(["aa01", "aa02", "aa03"]):
+            self.store.add(key, source)
+            os.utime(self.store.path(key), (1000 + i, 1000 + i))
+        # Using the oldest makes it the most recent.
+        self.store.fetch("aa01", os.path.join(self.tmpdir, "out"))
+        self.assertEqual(self.store.evict(), 100)
+        self.assertFalse(os.path.exists(self.store.path("aa02")))
+        self.assertTrue(os.path.exists(self.store.path("aa01")))
+        self.assertTrue(os.path.exists(self.store.path("aa03")))
@@ -0,0 +1,59 @@
+"""Strips the Mach-O files of a bundle in parallel, optionally
+keeping the unstripped files in a separate directory so that crash
+reports can still be symbolicated.
+"""
+import os
+import shutil
+import stat
+from subprocess import PIPE, STDOUT, run
+
+from . import macho, utils, verify
+
+def strip_args(tool, slices):
+    # Executables keep the symbols that plugins may link against;
+    # libraries and modules only lose their local symbols.
+    if slices[0].filetype == macho.MH_EXECUTE:
+        return [tool, "-u", "-r"]
+    return [tool, "-x"]
+
+def strip_file(tool, path, debug_path=None):
+    """Strips path with tool, first copying it to debug_path if
+    given. Returns the sizes before and after.
+    """
+    slices = macho.read(path)
+    before = os.path.getsize(path)
+    if not slices:
+        return before, before
+    if debug_path:
+        utils.makedirs(os.path.dirname(debug_path))
+        shutil.copy2(path, debug_path)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IWUSR)
+    result = run(strip_args(tool, slices) + [path], stdout=PIPE, stderr=STDOUT,
+                 check=False, text=True, errors="replace")
+    if result.returncode != 0:
+        print(f'Warning, {tool} failed on {path}: {result.stdout.strip()}')
+    return before, os.path.getsize(path)
+
+def strip_bundle(bundle, tool="strip", debug_dir=None, jobs=None, after=None):
+    """Strips every Mach-O file in bundle, mirroring the unstripped
+    files into debug_dir if given, and calls after(path) for each of
+    them once stripped. Returns (relative path, size before, size
+    after) for each file.
+    """
+    def strip(path):
+        rel = os.path.relpath(path, bundle)
+        debug_path = os.path.join(debug_dir, rel) if debug_dir else None
+        before, after_size = strip_file(tool, path, debug_path)
+        if after:
+            after(path)
+        return rel, before, after_size
+
+    return utils.job_slots().map(strip, verify.find_macho_files(bundle), jobs)
+
+def print_report(results):
+    for rel, before, after in results:
+        print(f'Stripped {rel}: {before} -> {after} bytes')
+    before = sum(r[1] for r in results)
+    after = sum(r[2] for r in results)
+    print(f'Stripped {len(results)} Mach-O files: {before} -> {after} bytes, '
+          f'saved {before - after}')
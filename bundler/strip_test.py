@@ -0,0 +1,68 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from . import macho, strip
+from .macho_test import make_macho, write_file
+
+# Stands in for strip: drops the payload after the load commands and
+# logs the arguments it was called with.
+STRIP_STUB = """#!{python}
+import struct, sys
+path = sys.argv[-1]
+with open(path, "rb") as f:
+    data = f.read()
+size = 32 + struct.unpack("<I", data[20:24])[0]
+with open(path, "wb") as f:
+    f.write(data[:size])
+with open(path + ".args", "w") as f:
+    f.write(" ".join(sys.argv[1:-1]))
+"""
+
+class StripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.tool = os.path.join(self.tmpdir, "strip")
+        with open(self.tool, "w", encoding="utf-8") as f:
+            f.write(STRIP_STUB.format(python=sys.executable))
+        os.chmod(self.tool, 0o755)
+
+        self.bundle = os.path.join(self.tmpdir, "Foo.app")
+        self.exe = os.path.join(self.bundle, "Contents", "MacOS", "Foo-bin")
+        self.lib = os.path.join(self.bundle, "Contents", "Resources", "lib",
+                                "libfoo.dylib")
+        write_file(self.exe, make_macho(macho.MH_EXECUTE, payload=b"s" * 1000))
+        write_file(self.lib, make_macho(dylib_id="@rpath/libfoo.dylib",
+                                        payload=b"s" * 500))
+        write_file(os.path.join(self.bundle, "Contents", "Info.plist"), b"plist")
+        os.chmod(self.lib, 0o444)
+        os.chmod(os.path.dirname(self.lib), 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_a_strip_bundle(self):
+        debug_dir = os.path.join(self.tmpdir, "Foo.debug-symbols")
+        signed = []
+        results = strip.strip_bundle(self.bundle, self.tool, debug_dir, jobs=2,
+                                     after=signed.append)
+        exe_rel = os.path.relpath(self.exe, self.bundle)
+        lib_rel = os.path.relpath(self.lib, self.bundle)
+        sizes = {rel: (before, after) for rel, before, after in results}
+        self.assertEqual(sorted(sizes), sorted([exe_rel, lib_rel]))
+        self.assertEqual(sizes[exe_rel][0] - sizes[exe_rel][1], 1000)
+        self.assertEqual(sizes[lib_rel][0] - sizes[lib_rel][1], 500)
+        self.assertEqual(sorted(signed), sorted([self.exe, self.lib]))
+
+        with open(self.exe + ".args", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "-u -r")
+        with open(self.lib + ".args", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "-x")
+        # The unstripped copies are kept, and the directories are
+        # left alone.
+        self.assertEqual(os.path.getsize(os.path.join(debug_dir, lib_rel)),
+                         sizes[lib_rel][0])
+        self.assertEqual(os.stat(os.path.dirname(self.lib)).st_mode & 0o777, 0o755)
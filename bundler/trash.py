@@ -0,0 +1,74 @@
+"""Gets rid of old bundles without waiting for them to be deleted: they
+are renamed into a trash directory, which is quick and atomic, and
+removed on background threads while the build goes on.
+"""
+import itertools
+import os
+import shutil
+import threading
+
+from . import utils
+
+# Name of the directory, next to the bundles, that stale bundles are
+# moved into before they are deleted.
+TRASH_DIR = ".gtk-mac-bundler-trash"
+
+class Trash():
+    def __init__(self, directory):
+        self.directory = directory
+        self.threads = []
+        self.counter = itertools.count()
+
+    def remove_later(self, path):
+        thread = threading.Thread(target=shutil.rmtree, args=(path,),
+                                  kwargs={"ignore_errors": True})
+        thread.start()
+        self.threads.append(thread)
+
+    def empty(self):
+        """Removes whatever earlier runs left in the trash."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            self.remove_later(os.path.join(self.directory, name))
+
+    def discard(self, path):
+        if not os.path.lexists(path):
+            return
+        if os.path.islink(path) or not os.path.isdir(path):
+            os.unlink(path)
+            return
+        utils.makedirs(self.directory)
+        trashed = os.path.join(self.directory, f'{os.path.basename(path)}.'
+                               f'{os.getpid()}.{next(self.counter)}')
+        try:
+            os.rename(path, trashed)
+        except OSError:
+            # Not on the same file system as the trash.
+            shutil.rmtree(path)
+            return
+        self.remove_later(trashed)
+
+    def wait(self):
+        """Waits for the background removals to finish."""
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
+
+def replace(source, dest, trash):
+    """Moves source to dest. An existing dest is swapped out atomically
+    where the system allows it, and never deleted in place, so dest
+    always holds a complete bundle.
+    """
+    if os.path.lexists(dest):
+        if utils.exchange_paths(source, dest):
+            trash.discard(source)
+            return
+        trash.discard(dest)
+    os.rename(source, dest)
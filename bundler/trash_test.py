@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from . import trash, utils
+from .macho_test import write_file
+
+class TrashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.trash = trash.Trash(os.path.join(self.tmpdir, trash.TRASH_DIR))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_bundle(self, name, contents):
+        path = os.path.join(self.tmpdir, name)
+        write_file(os.path.join(path, "Contents", "Info.plist"), contents)
+        return path
+
+    def read_bundle(self, path):
+        with open(os.path.join(path, "Contents", "Info.plist"), "rb") as f:
+            return f.read()
+
+    def test_a_discard(self):
+        bundle = self.make_bundle("Foo.app", b"old")
+        link = os.path.join(self.tmpdir, "link.app")
+        os.symlink("Foo.app", link)
+        self.trash.discard(link)
+        self.assertFalse(os.path.lexists(link))
+        self.assertTrue(os.path.isdir(bundle))
+        self.trash.discard(bundle)
+        self.assertFalse(os.path.exists(bundle))
+        self.trash.discard(bundle)
+        self.trash.wait()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_b_empty(self):
+        write_file(os.path.join(self.trash.directory, "Foo.app.1.0", "file"), b"x")
+        self.trash.empty()
+        self.trash.wait()
+        self.assertFalse(os.path.exists(self.trash.directory))
+
+    def test_c_replace(self):
+        new = self.make_bundle(".Foo.app", b"new")
+        dest = os.path.join(self.tmpdir, "Foo.app")
+        trash.replace(new, dest, self.trash)
+        self.assertEqual(self.read_bundle(dest), b"new")
+
+        for exchange in (True, False):
+            newer = self.make_bundle(".Foo.app", b"newer")
+            if exchange and not utils.exchange_paths(newer, newer):
+                # The system can't swap paths, the fallback is tested below.
+                shutil.rmtree(newer)
+                continue
+            with mock.patch.object(utils, "exchange_paths",
+                                   wraps=utils.exchange_paths if exchange
+                                   else lambda a, b: False):
+                trash.replace(newer, dest, self.trash)
+            self.assertEqual(self.read_bundle(dest), b"newer")
+            self.assertFalse(os.path.exists(newer))
+            shutil.rmtree(dest)
+            self.make_bundle("Foo.app", b"new")
+        self.trash.wait()
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ["Foo.app"])
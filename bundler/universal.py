@@ -0,0 +1,150 @@
+"""Builds a universal bundle from prefixes that each hold one
+architecture: a bundle is made for every architecture, and the results
+are merged file by file, joining the Mach-O files into fat ones the way
+lipo -create does.
+"""
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+
+from .bundler import Bundler
+from .project import Project
+from .trash import TRASH_DIR, Trash, replace
+from . import macho, utils
+
+def list_bundle(root):
+    """Returns the directories and the other entries (files and
+    symbolic links) in root, relative to it.
+    """
+    dirs, entries = [], []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        for name in dirnames:
+            if os.path.islink(os.path.join(dirpath, name)):
+                entries.append(os.path.normpath(os.path.join(rel_dir, name)))
+            else:
+                dirs.append(os.path.normpath(os.path.join(rel_dir, name)))
+        for name in filenames:
+            entries.append(os.path.normpath(os.path.join(rel_dir, name)))
+    return dirs, entries
+
+def merge_entry(target, sources):
+    """Writes target from sources, the (arch, path) pairs that have
+    it. Returns how it was merged: "link", "shared" if the copies are
+    identical, "fat", "partial" if only some architectures have it, or
+    "conflict" if they differ in some other way, in which case the
+    first one wins.
+    """
+    paths = [path for dummy_arch, path in sources]
+    first = paths[0]
+    if os.path.islink(first):
+        link = os.readlink(first)
+        os.symlink(link, target)
+        if all(os.path.islink(p) and os.readlink(p) == link for p in paths):
+            return "link"
+        return "conflict"
+
+    if len(paths) > 1 and all(filecmp.cmp(first, p, shallow=False)
+                              for p in paths[1:]):
+        shutil.copy2(first, target)
+        return "shared"
+    if len(paths) > 1 and all(macho.read(p) for p in paths):
+        try:
+            macho.create_fat(paths, target)
+            shutil.copymode(first, target)
+            return "fat"
+        except macho.MachOError as e:
+            print(f'Warning, cannot merge {target}: {e}')
+    shutil.copy2(first, target)
+    return "partial" if len(paths) == 1 else "conflict"
+
+def merge_bundles(bundles, dest, jobs=None):
+    """Merges bundles, a list of (arch, path) pairs, into dest.
+    Returns the relative paths of the entries by how they were merged.
+    """
+    sources = {}
+    all_dirs = set()
+    for arch, root in bundles:
+        dirs, entries = list_bundle(root)
+        all_dirs.update(dirs)
+        for rel in entries:
+            sources.setdefault(rel, []).append((arch, os.path.join(root, rel)))
+
+    utils.makedirs(dest)
+    for rel in sorted(all_dirs):
+        utils.makedirs(os.path.join(dest, rel))
+
+    def merge(rel):
+        return rel, merge_entry(os.path.join(dest, rel), sources[rel])
+    results = utils.job_slots().map(merge, sorted(sources), jobs)
+
+    report = {}
+    for rel, kind in results:
+        report.setdefault(kind, []).append(rel)
+    return report
+
+def print_report(report, archs):
+    for rel in report.get("partial", []):
+        print(f'Warning, {rel} is only built for some of {" ".join(archs)}')
+    for rel in report.get("conflict", []):
+        print(f'Warning, {rel} differs between architectures, using the first one')
+    counts = ", ".join(f'{len(report[kind])} {kind}' for kind in sorted(report))
+    print(f'Merged the {" ".join(archs)} bundles: {counts}')
+
+class UniversalBundler():
+    def __init__(self, project_path, jobs=None, fs_index=None, resolvers=None):
+        self.project_path = project_path
+        self.project = Project(project_path, fs_index=fs_index)
+        self.meta = self.project.get_meta()
+        self.jobs = jobs
+        self.resolvers = resolvers
+        # The provenance recorded for each architecture's bundle.
+        self.provenances = []
+
+    def run(self):
+        dest = self.project.evaluate_path(self.meta.dest)
+        final_path = os.path.join(dest, self.project.get_bundle_name() + ".app")
+        if not self.meta.overwrite and os.path.exists(final_path):
+            print("Bundle already exists: " + final_path)
+            sys.exit(1)
+
+        utils.makedirs(dest)
+        trash = Trash(os.path.join(dest, TRASH_DIR))
+        workdir = tempfile.mkdtemp(prefix=".universal-", dir=dest)
+        try:
+            bundles = []
+            debug_symbols = []
+            for arch in self.meta.arch_prefixes:
+                print(f'Building the {arch} bundle')
+                project = Project(self.project_path, arch=arch,
+                                  dest=os.path.join(workdir, arch),
+                                  fs_index=self.project.fs_index)
+                bundler = Bundler(project, self.resolvers)
+                bundles.append((arch, bundler.run()))
+                self.provenances.append(project.provenance)
+                if os.path.isdir(bundler.debug_symbols_path()):
+                    debug_symbols.append((arch, bundler.debug_symbols_path()))
+
+            merged = os.path.join(workdir, os.path.basename(final_path))
+            report = merge_bundles(bundles, merged, self.jobs)
+            print_report(report, [arch for arch, dummy_path in bundles])
+            epoch = self.project.get_source_date_epoch()
+            if epoch is not None:
+                utils.normalize_tree(merged, epoch)
+
+            replace(merged, final_path, trash)
+
+            # The unstripped files of each architecture go side by side.
+            if debug_symbols:
+                debug_dir = os.path.join(dest, self.project.get_bundle_name() +
+                                         ".debug-symbols")
+                trash.discard(debug_dir)
+                utils.makedirs(debug_dir)
+                for arch, path in debug_symbols:
+                    shutil.move(path, os.path.join(debug_dir, arch))
+        finally:
+            trash.discard(workdir)
+            trash.wait()
+        return final_path
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+import xml.dom.minidom
+
+from . import macho
+from .macho_test import CPU_TYPE_ARM64, CPU_TYPE_X86_64, make_macho, write_file
+from .project import Meta
+from .universal import merge_bundles
+
+META = """<meta>
+  <prefix name="default" arch="arm64">/opt/arm64</prefix>
+  <prefix name="default" arch="x86_64">/opt/x86_64</prefix>
+  <prefix name="gst">/opt/gstreamer</prefix>
+</meta>"""
+
+class UniversalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bundles = []
+        for arch, cputype, cpusubtype in [("arm64", CPU_TYPE_ARM64, 0),
+                                          ("x86_64", CPU_TYPE_X86_64, 3)]:
+            contents = os.path.join(self.tmpdir, arch, "Foo.app", "Contents")
+            write_file(os.path.join(contents, "MacOS", "Foo-bin"),
+                       make_macho(macho.MH_EXECUTE, cputype, cpusubtype=cpusubtype,
+                                  dylibs=["@executable_path/../Resources/lib/libfoo.dylib"]))
+            write_file(os.path.join(contents, "Resources", "lib", "libfoo.dylib"),
+                       make_macho(cputype=cputype, cpusubtype=cpusubtype,
+                                  dylib_id="@executable_path/../Resources/lib/libfoo.dylib"))
+            write_file(os.path.join(contents, "Resources", "share", "data.txt"),
+                       b"shared data")
+            write_file(os.path.join(contents, "Resources", "etc", "config"),
+                       arch.encode("utf-8"))
+            os.symlink("libfoo.dylib",
+                       os.path.join(contents, "Resources", "lib", "libfoo.1.dylib"))
+            self.bundles.append((arch, os.path.join(self.tmpdir, arch, "Foo.app")))
+        write_file(os.path.join(self.bundles[0][1], "Contents", "Resources", "lib",
+                                "libarm.dylib"), make_macho())
+        self.dest = os.path.join(self.tmpdir, "Foo.app")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_a_meta(self):
+        meta = Meta(xml.dom.minidom.parseString(META).documentElement)
+        self.assertEqual(list(meta.arch_prefixes), ["arm64", "x86_64"])
+        self.assertEqual(meta.prefixes["default"], "/opt/arm64")
+        meta.use_architecture("x86_64")
+        self.assertEqual(meta.prefixes, {"default": "/opt/x86_64",
+                                         "gst": "/opt/gstreamer"})
+        self.assertEqual(meta.architectures, ["x86_64"])
+
+    def test_b_merge(self):
+        report = merge_bundles(self.bundles, self.dest, jobs=2)
+        lib = os.path.join("Contents", "Resources", "lib")
+        self.assertEqual(report["fat"], [os.path.join("Contents", "MacOS", "Foo-bin"),
+                                         os.path.join(lib, "libfoo.dylib")])
+        self.assertEqual(report["shared"],
+                         [os.path.join("Contents", "Resources", "share", "data.txt")])
+        self.assertEqual(report["link"], [os.path.join(lib, "libfoo.1.dylib")])
+        self.assertEqual(report["partial"], [os.path.join(lib, "libarm.dylib")])
+        self.assertEqual(report["conflict"],
+                         [os.path.join("Contents", "Resources", "etc", "config")])
+
+        slices = macho.read(os.path.join(self.dest, lib, "libfoo.dylib"))
+        self.assertEqual([macho.arch_name(s.cputype, s.cpusubtype) for s in slices],
+                         ["arm64", "x86_64"])
+        self.assertEqual(os.readlink(os.path.join(self.dest, lib, "libfoo.1.dylib")),
+                         "libfoo.dylib")
+        with open(os.path.join(self.dest, "Contents", "Resources", "etc", "config"),
+                  "rb") as f:
+            self.assertEqual(f.read(), b"arm64")
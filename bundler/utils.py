@@ -1,6 +1,13 @@
+import contextlib
 import re
 import os
 import errno
+import functools
+import ctypes
+import sys
+import hashlib
+import stat
+import threading
 from xml.dom import DOMException
 
 def evaluate_environment_variables(string):
@@ -16,20 +23,29 @@ def evaluate_environment_variables(string):
 
     return string
 
+@functools.lru_cache(maxsize=None)
 def has_pkgconfig_module(module):
     """Returns True if the pkg-config module exists"""
     f = os.popen("pkg-config --exists " + module)
     f.read().strip()
     return f.close() is None
 
+@functools.lru_cache(maxsize=None)
+def get_pkgconfig_variable(module, key):
+    """Returns the value of the pkg-config variable, or an empty string.
+    The answers are kept for the life of the process, which may build
+    several bundles.
+    """
+    f = os.popen("pkg-config --variable=" + key + " " + module)
+    value = f.read().strip()
+    f.close()
+    return value
+
 def has_pkgconfig_variable(module, key):
     """Returns True if the pkg-config variable exists for the given
     module
     """
-    f = os.popen("pkg-config --variable=" + key + " " + module)
-    status = bool(f.read().strip())
-    f.close()
-    return status
+    return bool(get_pkgconfig_variable(module, key))
 
 def evaluate_pkgconfig_variables(string):
     p = re.compile(r"\${pkg:(.*?):(.*?)}")
@@ -37,8 +53,7 @@ def evaluate_pkgconfig_variables(string):
     while m:
         module = m.group(1)
         key = m.group(2)
-        f = os.popen("pkg-config --variable=" + key + " " + module)
-        value = f.read().strip()
+        value = get_pkgconfig_variable(module, key)
         if not value:
             # pango 1.38 removed modules, try to give a helpful
             # message in case something tries to reference the no
@@ -63,6 +78,170 @@ def makedirs(path):
         if e.errno != errno.EEXIST:
             raise
 
+def default_jobs():
+    """Returns the number of concurrent jobs to use for parallel stages."""
+    return os.cpu_count() or 1
+
+class JobSlots():
+    """The limit on how much work runs at once, shared by every bundle
+    and stage being built. A thread holds a slot while it works.
+    map() runs its items on the calling thread, which already holds a
+    slot, and on helper threads for the slots that are free, so nested
+    parallel work never waits for a slot held by a thread waiting on it.
+    """
+    def __init__(self, count=None):
+        self.count = count or default_jobs()
+        self.semaphore = threading.BoundedSemaphore(self.count)
+
+    @contextlib.contextmanager
+    def slot(self):
+        with self.semaphore:
+            yield
+
+    def take(self, wanted):
+        """Takes up to wanted free slots without waiting, and returns
+        how many it took.
+        """
+        taken = 0
+        while taken < wanted and self.semaphore.acquire(blocking=False):
+            taken += 1
+        return taken
+
+    def give_back(self, count):
+        for dummy in range(count):
+            self.semaphore.release()
+
+    def map(self, function, items, jobs=None):
+        """Returns function applied to each of items, in order, with at
+        most jobs of them running at once.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        pending = iter(range(len(items)))
+        errors = []
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    i = None if errors else next(pending, None)
+                if i is None:
+                    return
+                try:
+                    results[i] = function(items[i])
+                except BaseException as e:
+                    with lock:
+                        errors.append(e)
+                    return
+
+        helpers = self.take(min(jobs or len(items), len(items)) - 1)
+        threads = [threading.Thread(target=work) for dummy in range(helpers)]
+        try:
+            for thread in threads:
+                thread.start()
+            work()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.give_back(helpers)
+        if errors:
+            raise errors[0]
+        return results
+
+_job_slots = None
+_job_slots_lock = threading.Lock()
+
+def job_slots():
+    """Returns the JobSlots of the process."""
+    global _job_slots
+    with _job_slots_lock:
+        if _job_slots is None:
+            _job_slots = JobSlots()
+        return _job_slots
+
+def source_date_epoch():
+    """Returns $SOURCE_DATE_EPOCH, or None if it isn't set."""
+    value = os.getenv("SOURCE_DATE_EPOCH")
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'SOURCE_DATE_EPOCH must be a number of seconds, not {value}')
+
+def normalize_tree(root, mtime):
+    """Gives everything in root the same modification time, and
+    permissions that only depend on whether files are executable.
+    """
+    paths = [root]
+    for dirpath, dirnames, filenames in os.walk(root):
+        paths.extend(os.path.join(dirpath, name) for name in dirnames + filenames)
+    for path in paths:
+        st = os.lstat(path)
+        if stat.S_ISLNK(st.st_mode):
+            if os.utime in os.supports_follow_symlinks:
+                os.utime(path, (mtime, mtime), follow_symlinks=False)
+            continue
+        if stat.S_ISDIR(st.st_mode) or st.st_mode & 0o111:
+            os.chmod(path, 0o755)
+        else:
+            os.chmod(path, 0o644)
+        os.utime(path, (mtime, mtime))
+
+def get_cache_dir(*args):
+    """Returns (and creates) a directory in the bundler's persistent
+    cache, $GTK_MAC_BUNDLER_CACHE or $XDG_CACHE_HOME/gtk-mac-bundler.
+    """
+    base = os.getenv("GTK_MAC_BUNDLER_CACHE")
+    if not base:
+        xdg = os.getenv("XDG_CACHE_HOME",
+                        os.path.join(os.path.expanduser("~"), ".cache"))
+        base = os.path.join(xdg, "gtk-mac-bundler")
+    path = os.path.join(base, *args)
+    makedirs(path)
+    return path
+
+def hash_file(path, digest=None):
+    """Returns the sha256 hex digest of the file's contents, or updates
+    digest with them if one is passed.
+    """
+    own_digest = digest is None
+    if own_digest:
+        digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    if own_digest:
+        return digest.hexdigest()
+    return digest
+
+def cache_store(cache_path, source):
+    """Copies source into cache_path atomically, so that concurrent
+    readers never see a partially written entry.
+    """
+    tmp = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(source, "rb") as fin, open(tmp, "wb") as fout:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            fout.write(block)
+    os.replace(tmp, cache_path)
+
+def exchange_paths(path1, path2):
+    """Atomically swaps path1 and path2 with renamex_np() on macOS or
+    renameat2() on Linux. Returns False if the system can't do it.
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if sys.platform == "darwin":
+            # RENAME_SWAP
+            result = libc.renamex_np(os.fsencode(path1), os.fsencode(path2), 2)
+        else:
+            # AT_FDCWD, RENAME_EXCHANGE
+            result = libc.renameat2(-100, os.fsencode(path1), -100,
+                                    os.fsencode(path2), 2)
+    except (AttributeError, OSError):
+        return False
+    return result == 0
+
 def node_get_elements_by_tag_name(node, name):
     try:
         return node.getElementsByTagName(name)
@@ -0,0 +1,113 @@
+"""Checks a finished bundle for load commands that would make it
+depend on files outside of it: libraries still referenced from the
+build prefix, @rpath or @loader_path references that don't resolve
+inside the bundle, and install ids that weren't relocated.
+"""
+import json
+import os
+import time
+
+from . import macho, utils
+
+# System locations that bundles may link to.
+ALLOWED_PREFIXES = ("/usr/lib/", "/System/Library/")
+
+def is_allowed(path):
+    return path.startswith(ALLOWED_PREFIXES)
+
+def is_inside(path, bundle):
+    return os.path.normpath(path).startswith(bundle + os.sep)
+
+def find_macho_files(bundle):
+    """Returns the Mach-O files in the bundle, skipping symbolic links."""
+    files = []
+    for root, dummy_dirs, names in os.walk(bundle):
+        for name in names:
+            path = os.path.join(root, name)
+            if not os.path.islink(path) and macho.read(path):
+                files.append(path)
+    return sorted(files)
+
+class BundleVerifier():
+    def __init__(self, bundle):
+        self.bundle = os.path.normpath(os.path.abspath(bundle))
+        macos = os.path.join(self.bundle, "Contents", "MacOS")
+        # Only the directory of the executable matters for
+        # @executable_path, and all of them are in Contents/MacOS.
+        self.executable = os.path.join(macos, "executable")
+        self.resolver = macho.DyldResolver()
+        # The executables' rpaths apply to everything they load.
+        self.executable_rpaths = []
+        for path in find_macho_files(macos):
+            for rpath in macho.rpaths(macho.read(path)):
+                rpath = self.resolver.expand(rpath, path, self.executable)
+                if rpath not in self.executable_rpaths:
+                    self.executable_rpaths.append(rpath)
+
+    def problem(self, path, kind, name, detail):
+        return {"file": os.path.relpath(path, self.bundle), "kind": kind,
+                "name": name, "detail": detail}
+
+    def verify_file(self, path):
+        problems = []
+        slices = macho.read(path)
+        if not slices:
+            return problems
+
+        for dylib_id in {s.id for s in slices if s.id}:
+            if not dylib_id.startswith("@") and not is_allowed(dylib_id):
+                problems.append(self.problem(path, "install-id", dylib_id,
+                                             "install id not relocated"))
+
+        rpaths = []
+        for rpath in macho.rpaths(slices):
+            expanded = self.resolver.expand(rpath, path, self.executable)
+            if not is_inside(expanded, self.bundle) and not is_allowed(expanded):
+                problems.append(self.problem(path, "rpath", rpath,
+                                             "rpath points outside of the bundle"))
+            rpaths.append(expanded)
+        rpaths.extend(self.executable_rpaths)
+
+        for name in macho.dylibs(slices):
+            if not name.startswith("@"):
+                if not is_allowed(name):
+                    problems.append(self.problem(path, "leaked", name,
+                                                 "links to a library outside of the bundle"))
+                continue
+            candidates = self.resolver.search_paths(name, path, self.executable,
+                                                    rpaths)
+            for candidate in candidates:
+                if is_inside(candidate, self.bundle) and os.path.exists(candidate):
+                    break
+                if is_allowed(candidate):
+                    break
+            else:
+                problems.append(self.problem(path, "unresolved", name,
+                                             "doesn't resolve to a file in the bundle"))
+        return problems
+
+    def verify(self, jobs=None):
+        """Returns a report of all problems in the bundle."""
+        start = time.time()
+        files = find_macho_files(self.bundle)
+        results = utils.job_slots().map(self.verify_file, files, jobs)
+        problems = [p for result in results for p in result]
+        return {"bundle": self.bundle, "files": len(files),
+                "problems": problems, "seconds": round(time.time() - start, 3)}
+
+def print_report(report):
+    for p in report["problems"]:
+        print(f'{p["file"]}: {p["kind"]}: {p["name"]} ({p["detail"]})')
+    print(f'Verified {report["files"]} Mach-O files in {report["bundle"]} '
+          f'in {report["seconds"]}s: {len(report["problems"])} problems')
+
+def verify_bundle(bundle, json_path=None, jobs=None):
+    """Verifies bundle, prints the report and optionally writes it as
+    JSON. Returns True if there were no problems.
+    """
+    report = BundleVerifier(bundle).verify(jobs)
+    print_report(report)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return not report["problems"]
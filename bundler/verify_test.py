@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import macho
+from .macho_test import make_macho, write_file
+from .verify import BundleVerifier
+
+class VerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bundle = os.path.join(self.tmpdir, "Foo.app")
+        self.contents = os.path.join(self.bundle, "Contents")
+        write_file(os.path.join(self.contents, "MacOS", "Foo"),
+                   make_macho(macho.MH_EXECUTE,
+                              dylibs=["@rpath/libgood.dylib",
+                                      "/usr/lib/libSystem.B.dylib"],
+                              rpaths=["@executable_path/../Resources/lib"]))
+        write_file(os.path.join(self.contents, "Resources", "lib", "libgood.dylib"),
+                   make_macho(dylib_id="@rpath/libgood.dylib",
+                              dylibs=["@loader_path/libother.dylib",
+                                      "/System/Library/Frameworks/Cocoa.framework/Versions/A/Cocoa"]))
+        write_file(os.path.join(self.contents, "Resources", "lib", "libother.dylib"),
+                   make_macho(dylib_id="@executable_path/../Resources/lib/libother.dylib"))
+        write_file(os.path.join(self.contents, "Resources", "share", "data.txt"),
+                   b"not a binary")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_a_clean_bundle(self):
+        report = BundleVerifier(self.bundle).verify()
+        self.assertEqual(report["files"], 3)
+        self.assertEqual(report["problems"], [])
+
+    def test_b_problems(self):
+        write_file(os.path.join(self.contents, "Resources", "lib", "libbad.dylib"),
+                   make_macho(dylib_id="/opt/gtk/lib/libbad.dylib",
+                              dylibs=["/opt/gtk/lib/libglib-2.0.0.dylib",
+                                      "/usr/local/lib/libintl.8.dylib",
+                                      "@loader_path/libmissing.dylib",
+                                      "@rpath/libgood.dylib"],
+                              rpaths=["/opt/gtk/lib"]))
+        report = BundleVerifier(self.bundle).verify(jobs=2)
+        problems = sorted((p["kind"], p["name"]) for p in report["problems"])
+        self.assertEqual(problems,
+                         [("install-id", "/opt/gtk/lib/libbad.dylib"),
+                          ("leaked", "/opt/gtk/lib/libglib-2.0.0.dylib"),
+                          ("leaked", "/usr/local/lib/libintl.8.dylib"),
+                          ("rpath", "/opt/gtk/lib"),
+                          ("unresolved", "@loader_path/libmissing.dylib")])
+        for p in report["problems"]:
+            self.assertEqual(p["file"], "Contents/Resources/lib/libbad.dylib")
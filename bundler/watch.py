@@ -0,0 +1,292 @@
+"""Keeps a development bundle in sync with the prefixes: after the first
+build, the prefixes and the project files are watched and the bundle
+is updated with what changed. Changes are collected until things have
+been quiet for a moment, so that a whole make install only triggers
+one update. inotify is used where the system has it (Linux), the file
+system is polled otherwise.
+"""
+import ctypes
+import errno
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+
+from .bundler import Bundler
+from .project import Project
+from .trash import TRASH_DIR
+from .universal import UniversalBundler
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII")
+
+# Returned by the watchers when events were lost and anything may have
+# changed.
+EVERYTHING = None
+
+class WatcherError(Exception):
+    pass
+
+class InotifyWatcher():
+    """Watches directory trees with inotify. Directories that are
+    created later are watched as they appear.
+    """
+
+    def __init__(self, roots, directories=()):
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        except (AttributeError, OSError) as e:
+            raise WatcherError(f'inotify is not available: {e}') from e
+        if self.fd < 0:
+            raise WatcherError(f'inotify_init1 failed: {os.strerror(ctypes.get_errno())}')
+        self.watches = {}
+        try:
+            for root in roots:
+                self.add_tree(root)
+            for directory in directories:
+                self.add_watch(directory)
+        except WatcherError:
+            self.close()
+            raise
+
+    def add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return
+            raise WatcherError(f'Cannot watch {directory}: {os.strerror(error)}')
+        self.watches[wd] = directory
+
+    def add_tree(self, top):
+        """Watches top and the directories below it, and returns the
+        files in them.
+        """
+        files = []
+        for root, dummy_dirs, names in os.walk(top):
+            self.add_watch(root)
+            files.extend(os.path.join(root, name) for name in names)
+        return files
+
+    def poll(self, timeout=None):
+        """Returns the paths that changed, waiting up to timeout
+        seconds (forever if None) for the first change.
+        """
+        ready, dummy_w, dummy_x = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 1 << 16)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, dummy_cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return EVERYTHING
+            if wd not in self.watches:
+                continue
+            path = os.path.join(self.watches[wd], os.fsdecode(name))
+            changed.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # A make install may fill the directory before it is
+                # watched, so what is already in it counts as changed.
+                changed.update(self.add_tree(path))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher():
+    """Finds changes by comparing the modification times and sizes of
+    the files under the roots every interval seconds.
+    """
+
+    def __init__(self, roots, directories=(), interval=1.0):
+        self.roots = list(roots)
+        self.directories = list(directories)
+        self.interval = interval
+        self.state = self.snapshot()
+
+    def snapshot(self):
+        state = {}
+        def add(path):
+            try:
+                st = os.lstat(path)
+            except OSError:
+                return
+            state[path] = (st.st_mtime_ns, st.st_size, st.st_mode)
+        for root in self.roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                for name in filenames + dirnames:
+                    add(os.path.join(dirpath, name))
+        for directory in self.directories:
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                add(os.path.join(directory, name))
+        return state
+
+    def poll(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.monotonic(), 0))
+            time.sleep(wait)
+            state = self.snapshot()
+            changed = {path for path in set(state) | set(self.state)
+                       if state.get(path) != self.state.get(path)}
+            self.state = state
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+def make_watcher(roots, directories=(), polling=False):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots, directories)
+        except WatcherError as e:
+            print(f'{e}, polling for changes instead')
+    return PollingWatcher(roots, directories)
+
+def wait_for_changes(watcher, debounce=0.5):
+    """Waits for changes and returns them once nothing else has changed
+    for debounce seconds, or EVERYTHING if events were lost.
+    """
+    changed = set()
+    while not changed:
+        changed = watcher.poll()
+        if changed is EVERYTHING:
+            return EVERYTHING
+    while True:
+        more = watcher.poll(debounce)
+        if more is EVERYTHING:
+            return EVERYTHING
+        if not more:
+            return changed
+        changed |= more
+
+def project_files(project):
+    """Returns the files outside of the prefixes that the bundle is
+    made from; changing them means building it again.
+    """
+    files = {project.get_project_path(), project.get_plist_path()}
+    entitlements = project.get_entitlements_path()
+    if entitlements:
+        files.add(entitlements)
+    launcher_script = project.get_launcher_script()
+    if launcher_script:
+        files.add(project.evaluate_path(launcher_script.source))
+    return files
+
+class Watcher():
+    def __init__(self, project_path, debounce=0.5, polling=False, after=None):
+        self.project_path = project_path
+        self.debounce = debounce
+        self.polling = polling
+        # Called with the bundle's path after each build or update.
+        self.after = after
+        self.bundler = None
+        self.final_path = None
+        # Set when building again failed, so any change builds again.
+        self.broken = False
+
+    def build(self):
+        project = Project(self.project_path)
+        if project.get_meta().arch_prefixes:
+            self.bundler = UniversalBundler(self.project_path)
+        else:
+            self.bundler = Bundler(project)
+        self.final_path = self.bundler.run()
+        if self.after:
+            self.after(self.final_path)
+
+    def rebuild(self):
+        """Builds the bundle again, returning False if that failed."""
+        print("Building the bundle again")
+        try:
+            self.build()
+        except (Exception, SystemExit):
+            # The bundler exits on some errors; keep watching so that
+            # they can be fixed.
+            traceback.print_exc()
+            return False
+        return True
+
+    def update(self, changed):
+        """Updates the bundle, returning False if that failed."""
+        try:
+            if self.bundler.update(changed, self.final_path) and self.after:
+                self.after(self.final_path)
+        except (Exception, SystemExit):
+            traceback.print_exc()
+            return False
+        return True
+
+    def ignored(self, path):
+        # Our own output, in case it is inside a watched directory.
+        dest, name = os.path.split(self.final_path)
+        return any(path == p or path.startswith(p + os.sep) for p in
+                   (self.final_path, os.path.join(dest, "." + name),
+                    os.path.join(dest, TRASH_DIR)))
+
+    def watch_once(self, project):
+        """Watches until the bundle has to be built again."""
+        meta = project.get_meta()
+        files = project_files(project)
+        prefixes = set(meta.prefixes.values())
+        for arch_prefixes in meta.arch_prefixes.values():
+            prefixes.update(arch_prefixes.values())
+        prefixes = sorted(prefixes)
+        watcher = make_watcher(prefixes, {os.path.dirname(f) for f in files},
+                               self.polling)
+        print(f'Watching {", ".join(prefixes)} for changes')
+        try:
+            while True:
+                changed = wait_for_changes(watcher, self.debounce)
+                if changed is EVERYTHING:
+                    return
+                changed = {path for path in changed if not self.ignored(path)}
+                if not changed:
+                    continue
+                if (self.broken or changed & files or
+                        isinstance(self.bundler, UniversalBundler)):
+                    return
+                if not self.update(changed):
+                    return
+        finally:
+            watcher.close()
+
+    def run(self):
+        self.build()
+        project = self.bundler.project
+        while True:
+            self.watch_once(project)
+            while not self.rebuild():
+                # Any change may fix it: watch the files of the last
+                # good build and try again.
+                self.broken = True
+                self.watch_once(project)
+            self.broken = False
+            project = self.bundler.project
@@ -0,0 +1,57 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from . import watch
+from .macho_test import write_file
+
+class FakeWatcher():
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.timeouts = []
+
+    def poll(self, timeout=None):
+        self.timeouts.append(timeout)
+        return self.batches.pop(0) if self.batches else set()
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmpdir, "prefix")
+        write_file(os.path.join(self.prefix, "lib", "libfoo.dylib"), b"foo")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_a_debounce(self):
+        watcher = FakeWatcher([{"a"}, {"b"}, {"a", "c"}])
+        self.assertEqual(watch.wait_for_changes(watcher, 0.25), {"a", "b", "c"})
+        self.assertEqual(watcher.timeouts, [None, 0.25, 0.25, 0.25])
+        watcher = FakeWatcher([{"a"}, watch.EVERYTHING])
+        self.assertIs(watch.wait_for_changes(watcher), watch.EVERYTHING)
+
+    def check_watcher(self, watcher):
+        lib = os.path.join(self.prefix, "lib")
+        try:
+            write_file(os.path.join(lib, "libfoo.dylib"), b"changed")
+            os.unlink(os.path.join(lib, "libfoo.dylib"))
+            write_file(os.path.join(lib, "gtk", "mod.so"), b"new")
+            changed = watch.wait_for_changes(watcher, 0.2)
+        finally:
+            watcher.close()
+        self.assertIn(os.path.join(lib, "libfoo.dylib"), changed)
+        self.assertIn(os.path.join(lib, "gtk", "mod.so"), changed)
+
+    def test_b_polling(self):
+        self.check_watcher(watch.PollingWatcher([self.prefix], interval=0.05))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_c_inotify(self):
+        try:
+            watcher = watch.InotifyWatcher([self.prefix])
+        except watch.WatcherError as e:
+            self.skipTest(str(e))
+        self.check_watcher(watcher)
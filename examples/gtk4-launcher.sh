@@ -10,11 +10,10 @@ else
     EXEC=exec
 fi
 
-name=`basename "$0"`
-tmp="$0"
-tmp=`dirname "$tmp"`
-tmp=`dirname "$tmp"`
-bundle=`dirname "$tmp"`
+name="${0##*/}"
+tmp="${0%/*}"
+tmp="${tmp%/*}"
+bundle="${tmp%/*}"
 bundle_contents="$bundle"/Contents
 bundle_res="$bundle_contents"/Resources
 bundle_lib="$bundle_res"/lib
@@ -28,23 +27,56 @@ export GTK_DATA_PREFIX="$bundle_res"
 export GTK_EXE_PREFIX="$bundle_res"
 export GTK_PATH="$bundle_res"
 
-export GDK_PIXBUF_MODULE_FILE="$bundle_lib/gdk-pixbuf-2.0/2.10.0/loaders.cache"
+# gtk-mac-bundler generates launcher-env.sh with the module cache
+# locations and the list of available translations, so that none of
+# it has to be looked up at every start.
+unset APP_LANGUAGES
+if test -f "$bundle_res/launcher-env.sh"; then
+    . "$bundle_res/launcher-env.sh"
+else
+    export GDK_PIXBUF_MODULE_FILE="$bundle_lib/gdk-pixbuf-2.0/2.10.0/loaders.cache"
+    if test -f "$bundle_lib/charset.alias"; then
+        export CHARSETALIASDIR="$bundle_lib"
+    fi
+fi
 
 APP=$name
 I18NDIR="$bundle_data/locale"
+
+# Tests whether the application has a translation for language $1.
+has_translation () {
+    if test "${APP_LANGUAGES+set}"; then
+        case " $APP_LANGUAGES " in
+            *" $1 "*) return 0;;
+        esac
+        return 1
+    fi
+    test -f "$I18NDIR/$1/LC_MESSAGES/$APP.mo"
+}
+
 # Set the locale-related variables appropriately:
 unset LANG LC_MESSAGES LC_MONETARY LC_COLLATE
 
 # Has a language ordering been set?
 # If so, set LC_MESSAGES and LANG accordingly; otherwise skip it.
-# First step uses sed to clean off the quotes and commas, to change - to _, and change the names for the chinese scripts from "Hans" to CN and "Hant" to TW.
-APPLELANGUAGES=`defaults read .GlobalPreferences AppleLanguages | sed -En   -e 's/\-/_/' -e 's/Hant/TW/' -e 's/Hans/CN/' -e 's/[[:space:]]*\"?([[:alnum:]_]+)\"?,?/\1/p' `
+# First step cleans off the quotes and commas, changes - to _, and changes the names for the chinese scripts from "Hans" to CN and "Hant" to TW.
+APPLELANGUAGES=
+for L in `defaults read .GlobalPreferences AppleLanguages`; do
+    L=${L//[\"(),]/}
+    if test -z "$L"; then
+        continue
+    fi
+    L=${L/-/_}
+    L=${L/Hant/TW}
+    L=${L/Hans/CN}
+    APPLELANGUAGES="$APPLELANGUAGES $L"
+done
 if test "$APPLELANGUAGES"; then
     # A language ordering exists.
     # Test, item per item, to see whether there is an corresponding locale.
     for L in $APPLELANGUAGES; do
         #test for exact matches:
-       if test -f "$I18NDIR/${L}/LC_MESSAGES/$APP.mo"; then
+       if has_translation "${L}"; then
             export LANG=$L
             break
         fi
@@ -55,7 +87,7 @@ if test "$APPLELANGUAGES"; then
             break
         fi
         #OK, now test for just the first two letters:
-        if test -f "$I18NDIR/${L:0:2}/LC_MESSAGES/$APP.mo"; then
+        if has_translation "${L:0:2}"; then
             export LANG=${L:0:2}
             break
         fi
@@ -71,7 +103,7 @@ unset APPLELANGUAGES L
 # If we didn't get a language from the language list, try the Collation preference, in case it's the only setting that exists.
 APPLECOLLATION=`defaults read .GlobalPreferences AppleCollationOrder`
 if test -z ${LANG} && test -n $APPLECOLLATION; then
-    if test -f "$I18NDIR/${APPLECOLLATION:0:2}/LC_MESSAGES/$APP.mo"; then
+    if has_translation "${APPLECOLLATION:0:2}"; then
         export LANG=${APPLECOLLATION:0:2}
     fi
 fi
@@ -83,12 +115,12 @@ unset APPLECOLLATION
 # Continue by attempting to find the Locale preference.
 APPLELOCALE=`defaults read .GlobalPreferences AppleLocale`
 
-if test -f "$I18NDIR/${APPLELOCALE:0:5}/LC_MESSAGES/$APP.mo"; then
+if has_translation "${APPLELOCALE:0:5}"; then
     if test -z $LANG; then
         export LANG="${APPLELOCALE:0:5}"
     fi
 
-elif test -z $LANG && test -f "$I18NDIR/${APPLELOCALE:0:2}/LC_MESSAGES/$APP.mo"; then
+elif test -z $LANG && has_translation "${APPLELOCALE:0:2}"; then
     export LANG="${APPLELOCALE:0:2}"
 fi
 
@@ -104,7 +136,7 @@ if test -n $LANG; then
         export LC_MESSAGES=$LANG
 # Next try if the Applelocale is longer than 2 chars and the language
 # bit matches $LANG
-    elif test $LANG == ${APPLELOCALE:0:2} && test $APPLELOCALE > ${APPLELOCALE:0:2}; then
+    elif test $LANG == ${APPLELOCALE:0:2} && test ${#APPLELOCALE} -gt 2; then
         export LC_MESSAGES=${APPLELOCALE:0:5}
     # Fail. Get a list of the locales in $I18DIR that match
     # our two letter language code and pick the first one, special casing
@@ -112,9 +144,10 @@ if test -n $LANG; then
     elif test $LANG == "en"; then
         export LC_MESSAGES="en_US"
     else
-        LOC=`find $I18DIR -name $LANG???`
-        for L in $LOC; do
-            export LC_MESSAGES=$L
+        for L in "$I18NDIR"/$LANG???; do
+            if test -d "$L"; then
+                export LC_MESSAGES=${L##*/}
+            fi
         done
     fi
 else
@@ -122,7 +155,13 @@ else
     export LANG="en_US"
     export LC_MESSAGES="en_US"
 fi
-CURRENCY=`echo $APPLELOCALE |  sed -En 's/.*currency=([[:alpha:]]+).*/\1/p'`
+CURRENCY=
+case "$APPLELOCALE" in
+    *currency=*)
+        CURRENCY=${APPLELOCALE##*currency=}
+        CURRENCY=${CURRENCY%%[![:alpha:]]*}
+        ;;
+esac
 if test -n "$CURRENCY"; then
    # The user has set a special currency. Gtk doesn't install
    # LC_MONETARY files, but Apple does in /usr/share/locale, so we're
@@ -146,11 +185,7 @@ fi
 # For Gtk, which only looks at LC_ALL:
 export LC_ALL=$LC_MESSAGES
 
-unset APPLELOCALE FILES LOC
-
-if test -f "$bundle_lib/charset.alias"; then
-    export CHARSETALIASDIR="$bundle_lib"
-fi
+unset APPLELOCALE APP_LANGUAGES FILES
 
 # Extra arguments can be added in environment.sh.
 EXTRA_ARGS=
@@ -159,9 +194,9 @@ if test -f "$bundle_res/environment.sh"; then
 fi
 
 # Strip out the argument added by the OS.
-if /bin/expr "x$1" : '^x-psn_' > /dev/null; then
-    shift 1
-fi
+case "$1" in
+    -psn_*) shift 1;;
+esac
 
 # Must start binary from its folder, since the application demo searches for "./gtk4-demo-application" in the working directory
 cd "$bundle_contents/MacOS"
@@ -23,6 +23,8 @@
 #include <sys/syslimits.h>
 
 #define PYLIB "/lib/python3.14"
+/* Where the bundler packs the standard library if asked to. */
+#define PYZIP "/lib/python314.zip"
 
 static wchar_t*
 widen_cfstring(CFStringRef str)
@@ -106,16 +108,24 @@ set_python_path(PyConfig *config)
     free(path);
     mstr = CFStringCreateMutableCopy(NULL, PATH_MAX, str);
     CFRelease(str);
+    base_length = CFStringGetLength(mstr);
+    CFStringAppendCString(mstr, PYZIP,
+                          kCFStringEncodingUTF8);
+    path = widen_cfstring(mstr);
+    check_status(config, PyWideStringList_Insert(&config->module_search_paths, 0, path));
+    free (path);
+    curr_length = CFStringGetLength(mstr);
+    CFStringDelete(mstr, CFRangeMake(base_length, curr_length - base_length));
     CFStringAppendCString(mstr, PYLIB,
                           kCFStringEncodingUTF8);
     base_length = CFStringGetLength(mstr);
     path = widen_cfstring(mstr);
-    check_status(config, PyWideStringList_Insert(&config->module_search_paths, 0, path));
+    check_status(config, PyWideStringList_Insert(&config->module_search_paths, 1, path));
     free (path);
     CFStringAppendCString(mstr, "/lib-dynload",
                           kCFStringEncodingUTF8);
     path = widen_cfstring(mstr);
-    check_status(config, PyWideStringList_Insert(&config->module_search_paths, 1, path));
+    check_status(config, PyWideStringList_Insert(&config->module_search_paths, 2, path));
     free (path);
     curr_length = CFStringGetLength(mstr);
     CFStringDelete(mstr, CFRangeMake(base_length, curr_length - base_length));
@@ -123,7 +133,7 @@ set_python_path(PyConfig *config)
                           kCFStringEncodingUTF8);
     path = widen_cfstring(mstr);
     CFRelease(mstr);
-    check_status(config, PyWideStringList_Insert(&config->module_search_paths, 2, path));
+    check_status(config, PyWideStringList_Insert(&config->module_search_paths, 3, path));
     free (path);
     config->module_search_paths_set = 1;
 }
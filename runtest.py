@@ -5,6 +5,23 @@ if __name__ == "__main__" and __package__ is None:
 import unittest
 import os
 from .project_test import ProjectTest
+from .launcher_test import LauncherTest
+from .fsindex_test import FileSystemIndexTest
+from .macho_test import MachOTest
+from .verify_test import VerifyTest
+from .universal_test import UniversalTest
+from .strip_test import StripTest
+from .analyze_test import AnalyzeTest
+from .bundler_test import BundlerTest
+from .archive_test import ArchiveTest
+from .trash_test import TrashTest
+from .batch_test import BatchTest
+from .watch_test import WatchTest
+from .store_test import StoreTest
+from .stages_test import StagesTest
+from .python_test import PythonTest
+from .iconcache_test import IconCacheTest
+from .main_test import MainTest
 
 def setProjects( goodpath, badpath):
     if not os.path.isabs(goodpath):
@@ -21,5 +38,23 @@ def setProjects( goodpath, badpath):
     ProjectTest.badpath = badpath
  
 setProjects("test/goodproject.bundle", "test/badproject.bundle")
-suite = unittest.TestLoader().loadTestsFromTestCase(ProjectTest)
+loader = unittest.TestLoader()
+suite = unittest.TestSuite([loader.loadTestsFromTestCase(ProjectTest),
+                            loader.loadTestsFromTestCase(LauncherTest),
+                            loader.loadTestsFromTestCase(FileSystemIndexTest),
+                            loader.loadTestsFromTestCase(MachOTest),
+                            loader.loadTestsFromTestCase(VerifyTest),
+                            loader.loadTestsFromTestCase(UniversalTest),
+                            loader.loadTestsFromTestCase(StripTest),
+                            loader.loadTestsFromTestCase(AnalyzeTest),
+                            loader.loadTestsFromTestCase(BundlerTest),
+                            loader.loadTestsFromTestCase(ArchiveTest),
+                            loader.loadTestsFromTestCase(TrashTest),
+                            loader.loadTestsFromTestCase(BatchTest),
+                            loader.loadTestsFromTestCase(WatchTest),
+                            loader.loadTestsFromTestCase(StoreTest),
+                            loader.loadTestsFromTestCase(StagesTest),
+                            loader.loadTestsFromTestCase(PythonTest),
+                            loader.loadTestsFromTestCase(IconCacheTest),
+                            loader.loadTestsFromTestCase(MainTest)])
 unittest.TextTestRunner(verbosity=2).run(suite)